@@ -0,0 +1,126 @@
+import logging
+import os
+from typing import Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from database import AsyncDatabase
+from fsm_storage import SQLiteStorage
+from handlers import (
+    commands_router,
+    callbacks_router,
+    ai_advice_router,
+    session_router,
+    history_router,
+    general_router,
+    metrics_router,
+    HandlerMetricsMiddleware,
+)
+from services.gemini import gemini_client
+from services.advice_cache import advice_cache
+from services.question_classifier import question_classifier
+from services.quota import quota_service
+from services.benchmarks import rate_benchmarks
+from services.metrics import start_metrics_server
+
+# Per-process bot wiring: Bot, database settings and Dispatcher, built explicitly (no import-time side effects).
+logger = logging.getLogger(__name__)
+
+metrics_runner: Optional[web.AppRunner] = None
+
+
+def configure_logging():
+    """Настройки логирования процесса"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+
+def create_bot() -> Bot:
+    """Создает бота с токеном из окружения (BOT_TOKEN)"""
+    return Bot(token=os.getenv('BOT_TOKEN'))
+
+
+def create_database() -> AsyncDatabase:
+    """
+    Настраивает базу данных процесса по переменным окружения
+
+    Вызывается один раз на процесс: групповая фиксация и лог запросов
+    включаются на общем экземпляре AsyncDatabase.
+    """
+    db = AsyncDatabase()
+
+    # Групповая фиксация записей (по умолчанию выключена): DB_GROUP_COMMIT_MS=50, DB_GROUP_COMMIT_ROWS=100
+    if os.getenv('DB_GROUP_COMMIT_MS'):
+        db.enable_group_commit(
+            max_delay_ms=float(os.getenv('DB_GROUP_COMMIT_MS')),
+            max_batch=int(os.getenv('DB_GROUP_COMMIT_ROWS', '100'))
+        )
+
+    # Лог медленных запросов (по умолчанию выключен): DB_SLOW_QUERY_MS=50
+    if os.getenv('DB_SLOW_QUERY_MS'):
+        db.database.enable_query_trace(slow_query_ms=float(os.getenv('DB_SLOW_QUERY_MS')))
+
+    return db
+
+
+async def on_startup():
+    global metrics_runner
+    # HTTP-сессия Gemini создается один раз и переиспользуется всеми запросами
+    await gemini_client.start()
+    await advice_cache.load()
+    question_classifier.load()
+    await rate_benchmarks.load()
+    quota_service.start()
+    AsyncDatabase().start_activity_flush()
+
+    # Эндпоинт метрик: METRICS_PORT=9100 (у процессов-обработчиков порты 9100, 9101, ...)
+    if os.getenv('METRICS_PORT'):
+        port = int(os.getenv('METRICS_PORT')) + int(os.getenv('BOT_WORKER_INDEX', '0'))
+        metrics_runner = await start_metrics_server(os.getenv('METRICS_HOST', '127.0.0.1'), port)
+
+
+async def on_shutdown():
+    await rate_benchmarks.stop()
+    await quota_service.stop()
+    await gemini_client.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+
+def create_dispatcher(db: AsyncDatabase) -> Dispatcher:
+    """
+    Создает диспетчер со всеми роутерами (роутеры подключаются один раз на процесс)
+
+    Args:
+        db: База данных процесса (для хранилища состояний FSM)
+    """
+    # Состояния FSM хранятся в базе и переживают перезапуск (FSM_STORAGE=memory - только в памяти)
+    if os.getenv('FSM_STORAGE', 'sqlite') == 'memory':
+        storage = MemoryStorage()
+    else:
+        storage = SQLiteStorage(db, ttl=float(os.getenv('FSM_STATE_TTL', 24 * 3600)))
+    dp = Dispatcher(storage=storage)
+
+    # Register routers
+    routers = {
+        'commands': commands_router,
+        'metrics': metrics_router,
+        'callbacks': callbacks_router,
+        'ai_advice': ai_advice_router,
+        # Импорт файлов раньше смен: документ в состоянии ввода смены - это тоже импорт
+        'history': history_router,
+        # Роутер смен раньше общего: общий обработчик текста перехватывает любые сообщения
+        'session': session_router,
+        'general': general_router,
+    }
+    for name, router in routers.items():
+        # Время обработки по роутерам и событиям (см. /metrics)
+        router.message.outer_middleware(HandlerMetricsMiddleware(name))
+        router.callback_query.outer_middleware(HandlerMetricsMiddleware(name))
+        dp.include_router(router)
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
@@ -0,0 +1,218 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+# Database micro-benchmarks on a synthetic DB, compared against a stored JSON baseline.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from database import Database  # noqa: E402
+from tools.generate_data import generate  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'db_baseline.json'
+
+ORDER = {'time': '12:30', 'address': 'ул. Чуй, 1', 'price': 250.0, 'distance': 3.5}
+
+# Разница меньше этой (мс) считается шумом, даже если в процентах она велика
+NOISE_FLOOR_MS = 0.05
+
+
+def build_cases(db: Database, rng: random.Random) -> List[Tuple[str, Callable[[], Any]]]:
+    """
+    Вызовы публичных методов Database со случайными существующими пользователями
+
+    Returns:
+        Список (название, вызов)
+    """
+    first_user, last_user = db.conn.execute("SELECT MIN(user_id), MAX(user_id) FROM users").fetchone()
+    max_session_id = db.conn.execute("SELECT MAX(session_id) FROM sessions").fetchone()[0] or 1
+    max_order_id = db.conn.execute("SELECT MAX(id) FROM orders").fetchone()[0] or 1
+    day = datetime.now().strftime('%Y-%m-%d')
+    start = datetime(2024, 5, 1, 9, 0)
+
+    def user() -> int:
+        return rng.randint(first_user, last_user)
+
+    def order_id() -> int:
+        return rng.randint(1, max_order_id)
+
+    return [
+        ('get_or_create_user', lambda: db.get_or_create_user(user(), 'courier')),
+        ('get_user_sessions', lambda: db.get_user_sessions(user())),
+        ('get_session', lambda: db.get_session(rng.randint(1, max_session_id))),
+        ('get_last_session_id', lambda: db.get_last_session_id(user())),
+        ('get_user_service', lambda: db.get_user_service(user())),
+        ('get_user_transport', lambda: db.get_user_transport(user())),
+        ('get_orders_by_session', lambda: db.get_orders_by_session(rng.randint(1, max_session_id))),
+        ('get_user_orders', lambda: db.get_user_orders(user())),
+        ('get_order_by_id', lambda: db.get_order_by_id(order_id())),
+        ('get_user_advice', lambda: db.get_user_advice(user())),
+        ('find_cached_advice', lambda: db.find_cached_advice('legal', f"вопрос {rng.randrange(500)}", 7 * 24 * 3600)),
+        ('get_ai_quota_used', lambda: db.get_ai_quota_used(user(), day)),
+        ('get_fsm_record', lambda: db.get_fsm_record(f"fsm:{user()}")),
+        ('get_user_statistics', lambda: db.get_user_statistics(user())),
+        ('get_detailed_statistics', lambda: db.get_detailed_statistics(user())),
+        ('update_user_service', lambda: db.update_user_service(user(), 'glovo')),
+        ('update_user_transport', lambda: db.update_user_transport(user(), 'bike')),
+        ('add_session', lambda: db.add_session(user(), 'glovo', start.strftime('%Y-%m-%d %H:%M:%S'))),
+        ('end_session', lambda: db.end_session(rng.randint(1, max_session_id), 1500, 5)),
+        ('update_session', lambda: db.update_session(rng.randint(1, max_session_id), weather='rain')),
+        ('record_completed_session', lambda: db.record_completed_session(
+            user(), 'glovo', start, start + timedelta(hours=6), 2400, 8)),
+        ('add_order', lambda: db.add_order(user(), rng.randint(1, max_session_id), ORDER)),
+        ('save_order', lambda: db.save_order(user(), ORDER)),
+        ('update_order', lambda: db.update_order(order_id(), price=300)),
+        ('save_temporary_order', lambda: db.save_temporary_order(user(), ORDER)),
+        ('add_ai_advice', lambda: db.add_ai_advice(user(), 'legal', 'Совет', None, question_key='вопрос 1')),
+        ('add_ai_quota_usage', lambda: db.add_ai_quota_usage({(user(), day): 1})),
+        ('set_fsm_records', lambda: db.set_fsm_records([(f"fsm:{user()}", 'S:a', '{}')])),
+        ('rebuild_user_stats', lambda: db.rebuild_user_stats(user())),
+    ]
+
+
+def run_cases(cases: List[Tuple[str, Callable[[], Any]]], iterations: int, only: List[str] = None) -> Dict[str, Any]:
+    """
+    Замеряет каждый вызов iterations раз
+
+    Returns:
+        Название -> {p50_ms, p99_ms, mean_ms, iterations}
+    """
+    results = {}
+    for name, call in cases:
+        if only and name not in only:
+            continue
+
+        # Первый вызов с логами: ошибки метода видны, а не маскируются быстрым временем
+        call()
+        database_logger = logging.getLogger('database')
+        level = database_logger.level
+        database_logger.setLevel(logging.CRITICAL)
+        timings = []
+        try:
+            for _ in range(iterations):
+                started = time.perf_counter()
+                call()
+                timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            database_logger.setLevel(level)
+
+        timings.sort()
+        results[name] = {
+            'p50_ms': round(statistics.median(timings), 4),
+            'p99_ms': round(timings[min(int(len(timings) * 0.99), len(timings) - 1)], 4),
+            'mean_ms': round(statistics.fmean(timings), 4),
+            'iterations': iterations,
+        }
+        logger.info(f"{name}: p50 {results[name]['p50_ms']:.3f} мс, p99 {results[name]['p99_ms']:.3f} мс")
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Сравнивает медианы с базовой линией
+
+    Args:
+        results: Текущие замеры
+        baseline: Сохраненные замеры
+        tolerance: Допустимое замедление (0.2 - на 20%)
+
+    Returns:
+        Описания регрессий
+    """
+    regressions = []
+    print(f"\n{'метод':<28}{'база p50':>12}{'сейчас p50':>12}{'изм.':>9}")
+    for name, current in results.items():
+        previous = baseline.get('methods', {}).get(name)
+        if previous is None:
+            print(f"{name:<28}{'-':>12}{current['p50_ms']:>12.3f}{'новый':>9}")
+            continue
+
+        change = current['p50_ms'] / previous['p50_ms'] - 1 if previous['p50_ms'] else 0.0
+        regressed = (change > tolerance and current['p50_ms'] - previous['p50_ms'] > NOISE_FLOOR_MS)
+        print(f"{name:<28}{previous['p50_ms']:>12.3f}{current['p50_ms']:>12.3f}{change:>+9.0%}"
+              f"{'  ❌' if regressed else ''}")
+        if regressed:
+            regressions.append(f"{name}: {previous['p50_ms']:.3f} -> {current['p50_ms']:.3f} мс ({change:+.0%})")
+    return regressions
+
+
+def dataset_info(db: Database) -> Dict[str, int]:
+    return {
+        table: db.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ('users', 'sessions', 'orders', 'ai_advice')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки методов Database")
+    parser.add_argument('--db', help="Синтетическая база (создается, если файла нет; по умолчанию временная)")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--sessions', type=int, default=50, help="Смен на пользователя")
+    parser.add_argument('--orders', type=int, default=3, help="Заказов на смену")
+    parser.add_argument('--iterations', type=int, default=200, help="Вызовов каждого метода")
+    parser.add_argument('--only', nargs='*', help="Замерить только эти методы")
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help="JSON с базовой линией")
+    parser.add_argument('--save-baseline', action='store_true', help="Записать результаты как новую базовую линию")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Допустимое замедление медианы (0.2 = 20%%)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(name)s - %(message)s')
+    logging.getLogger(__name__).setLevel(logging.INFO)
+    logging.getLogger('tools.generate_data').setLevel(logging.INFO)
+
+    if args.db and os.path.exists(args.db):
+        # Бенчмарк пишет в базу: никогда не запускайте его на рабочей courier_bot.db
+        db = Database(args.db)
+    else:
+        db_path = args.db or os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+        db = generate(db_path, args.users, args.sessions, args.orders, args.seed)
+
+    # Объем данных до замеров: методы записи добавляют строки
+    dataset = dataset_info(db)
+    results = run_cases(build_cases(db, random.Random(args.seed)), args.iterations, args.only)
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'machine': platform.node(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'dataset': dataset,
+        'methods': results,
+    }
+    db.close()
+
+    if args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"Базовая линия записана: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"Нет базовой линии {args.baseline}: запустите с --save-baseline")
+        return
+
+    baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+    if baseline.get('dataset') != report['dataset']:
+        logger.warning(f"Объем данных отличается от базовой линии: {baseline.get('dataset')} != {report['dataset']}")
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nРегрессии:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+    print("\nРегрессий нет")
+
+
+if __name__ == '__main__':
+    main()
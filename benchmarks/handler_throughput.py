@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+# End-to-end handler benchmark: app.py dispatcher, stubbed Bot API, temp DB and a local fake Gemini.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import Chat, Message, Update  # noqa: E402
+
+QUESTIONS = [
+    "Как заработать больше в час пик?",
+    "В какие часы выгоднее выходить на смену?",
+    "Как увеличить количество заказов за смену?",
+    "Сколько можно заработать за день в доставке?",
+]
+
+
+class StubSession(BaseSession):
+    """Сессия Bot API без сети: каждый метод сразу успешно выполняется"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None) -> Any:
+        self.calls[method.__api_method__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.__api_method__ in ('sendMessage', 'editMessageText', 'sendDocument'):
+            self._message_id += 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=getattr(method, 'chat_id', 0) or 0, type='private'),
+                text=getattr(method, 'text', None),
+            ).as_(bot)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+class UpdateFactory:
+    """Синтетические апдейты от имени пользователя"""
+
+    def __init__(self):
+        self._update_id = 0
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'Courier{user_id}', 'username': f'courier{user_id}'}
+
+    def message(self, user_id: int, text: str) -> Update:
+        return Update.model_validate({
+            'update_id': self._next_id(),
+            'message': {
+                'message_id': self._next_id(),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': self._user(user_id),
+                'text': text,
+            },
+        })
+
+    def callback(self, user_id: int, data: str) -> Update:
+        return Update.model_validate({
+            'update_id': self._next_id(),
+            'callback_query': {
+                'id': str(self._next_id()),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': 1,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'text': 'menu',
+                },
+            },
+        })
+
+
+def conversation(factory: UpdateFactory, user_id: int, round_number: int, rng: random.Random) -> List[tuple]:
+    """Один сценарий пользователя: меню, профиль, смена и вопрос ИИ"""
+    day = datetime.now() - timedelta(days=round_number + 1)
+    start = rng.randint(8, 14)
+    shift = f"{day:%d.%m.%Y}\n{start:02d}:00\n{start + rng.randint(3, 8):02d}:30\n{rng.randint(1, 15)}\n{rng.randint(500, 4000)}"
+    return [
+        ('/start', factory.message(user_id, '/start')),
+        ('profile', factory.callback(user_id, 'profile')),
+        ('add_session', factory.callback(user_id, 'add_session')),
+        ('shift_text', factory.message(user_id, shift)),
+        ('ai_advice', factory.callback(user_id, 'ai_advice')),
+        ('advice_topic', factory.callback(user_id, 'optimization')),
+        ('advice_question', factory.message(user_id, rng.choice(QUESTIONS))),
+    ]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def run(users: int, rounds: int, gemini_delay: float, api_latency: float, port: int) -> Dict[str, Any]:
+    from tools.fake_gemini import start_server
+    from app import create_bot, create_database, create_dispatcher
+
+    gemini = await start_server(port, delay=gemini_delay)
+    session = StubSession(api_latency)
+    bot = create_bot()
+    bot.session = session
+    db = create_database()
+    dp = create_dispatcher(db)
+    await dp.emit_startup(bot=bot)
+
+    factory = UpdateFactory()
+    rng = random.Random(42)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+
+    async def user_flow(user_id: int):
+        for round_number in range(rounds):
+            for kind, update in conversation(factory, user_id, round_number, rng):
+                started = time.perf_counter()
+                await dp.feed_update(bot, update)
+                latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_flow(500000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+
+    await dp.emit_shutdown(bot=bot)
+    await db.close()
+    await gemini.cleanup()
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        'updates': total,
+        'seconds': elapsed,
+        'throughput': total / elapsed,
+        'latency': {kind: values for kind, values in latencies.items()},
+        'api_calls': dict(session.calls),
+    }
+
+
+def report(result: Dict[str, Any]):
+    print(f"\nАпдейтов: {result['updates']} за {result['seconds']:.2f} с -> {result['throughput']:.0f} апдейтов/с\n")
+    print(f"{'апдейт':<18}{'кол-во':>8}{'p50 мс':>10}{'p99 мс':>10}")
+    all_values = []
+    for kind, values in result['latency'].items():
+        all_values.extend(values)
+        print(f"{kind:<18}{len(values):>8}{percentile(values, 0.5) * 1000:>10.2f}{percentile(values, 0.99) * 1000:>10.2f}")
+    print(f"{'все':<18}{len(all_values):>8}{percentile(all_values, 0.5) * 1000:>10.2f}{percentile(all_values, 0.99) * 1000:>10.2f}")
+    print(f"\nВызовы Bot API: {result['api_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность обработчиков бота")
+    parser.add_argument('--users', type=int, default=200, help="Одновременных пользователей")
+    parser.add_argument('--rounds', type=int, default=3, help="Сценариев на пользователя")
+    parser.add_argument('--gemini-delay', type=float, default=0.3, help="Задержка ответа заглушки Gemini, с")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="Задержка каждого вызова Bot API, с")
+    parser.add_argument('--port', type=int, default=18765, help="Порт заглушки Gemini")
+    parser.add_argument('--verbose', action='store_true', help="Не отключать INFO-логи обработчиков")
+    args = parser.parse_args()
+
+    # Временная база и окружение задаются до импорта app: база открывается при импорте обработчиков
+    os.chdir(tempfile.mkdtemp(prefix='bot-bench-'))
+    os.environ.update({
+        'BOT_TOKEN': '123456:benchmark',
+        'GEMINI_API_KEY': 'benchmark',
+        'GEMINI_API_URL': f'http://127.0.0.1:{args.port}/v1beta',
+    })
+    os.environ.pop('GEMINI_STREAMING', None)
+
+    from app import configure_logging
+    configure_logging()
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    result = asyncio.run(run(args.users, args.rounds, args.gemini_delay, args.api_latency, args.port))
+    report(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,110 @@
+import asyncio
+import functools
 import logging
 import sqlite3
 import os
-from datetime import datetime
-from typing import Dict, List, Optional, Any, Tuple, Union
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Any, Tuple, Union
 from pathlib import Path
 import threading
+from services.metrics import db_call_duration, db_query_duration
 
 logger = logging.getLogger(__name__)
-# Database init, there are many useless methods and rows, in future version it will be rework.
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, замеряющее время каждого запроса (метрика db_query_duration_seconds)"""
+
+    # Трассировка (см. Database.enable_query_trace): общая для всех соединений процесса
+    slow_query_ms: Optional[float] = None
+    recorded_queries: Optional[Dict[str, Any]] = None
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._observe(sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql: str, parameters) -> sqlite3.Cursor:
+        if self.recorded_queries is not None or self.slow_query_ms is not None:
+            parameters = list(parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            self._observe(sql, parameters, time.perf_counter() - start, many=True)
+
+    @classmethod
+    def _observe(cls, sql: str, parameters, seconds: float, many: bool = False):
+        # Метка - вид запроса (SELECT, INSERT...), текст запроса дал бы слишком много серий
+        db_query_duration.observe(seconds, statement=sql.lstrip().split(None, 1)[0].upper())
+
+        if cls.recorded_queries is not None and sql not in cls.recorded_queries:
+            # Для executemany сохраняем параметры первой строки - их хватит для EXPLAIN
+            cls.recorded_queries[sql] = (parameters[0] if parameters else ()) if many else parameters
+
+        if cls.slow_query_ms is not None and seconds * 1000 >= cls.slow_query_ms:
+            shape = f"{len(parameters)} строк" if many else _parameters_shape(parameters)
+            logger.warning(f"Медленный запрос ({seconds * 1000:.1f} мс, параметры {shape}): {' '.join(sql.split())}")
+
+
+def _parameters_shape(parameters) -> str:
+    """Типы параметров запроса без значений (значения могут быть личными данными)"""
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+
+
 class Database:
     _instance = None
     _lock = threading.Lock()
+
+    # Сколько потоков одновременно работают с базой (по соединению на поток)
+    pool_size = 4
+    # Сколько миллисекунд ждать снятия блокировки записи
+    busy_timeout_ms = 5000
+
+    # Кэш пользователей: время жизни записи (сек) и максимальный размер
+    user_cache_ttl = 300
+    user_cache_size = 10000
+    # Как часто (сек) записывать накопленные обновления last_active
+    activity_flush_interval = 30
+
+    # Записи, которые можно фиксировать группой: метод -> (операция без commit, результат при ошибке)
+    batched_writes = {
+        'add_session': ('_insert_session', None),
+        'end_session': ('_finish_session', False),
+        'update_session': ('_update_session_row', False),
+        'add_order': ('_insert_order', None),
+        'add_ai_advice': ('_insert_ai_advice', None),
+        'save_order': ('_insert_validated_order', None),
+        'record_completed_session': ('_insert_completed_session', None),
+    }
+
+    # Миграции по порядку версий (PRAGMA user_version)
+    migrations = [
+        '_migrate_to_v1',
+        '_migrate_to_v2',
+        '_migrate_to_v3',
+        '_migrate_to_v4',
+        '_migrate_to_v5',
+        '_migrate_to_v6',
+        '_migrate_to_v7',
+        '_migrate_to_v8',
+        '_migrate_to_v9',
+        '_migrate_to_v10',
+        '_migrate_to_v11',
+        '_migrate_to_v12',
+    ]
+
+    # Ограничения на данные смены
+    max_orders_per_session = 25
+    max_earnings_per_session = 6000
+    min_session_year = 2022
     
     def __new__(cls, *args, **kwargs):
         with cls._lock:
@@ -30,9 +124,16 @@ class Database:
             
         try:
             self.db_path = db_path
-            self.conn = sqlite3.connect(db_path, check_same_thread=False)
-            self.conn.row_factory = sqlite3.Row
-            self.cursor = self.conn.cursor()
+            # Пул соединений: у каждого потока свое соединение и свои курсоры
+            self._local = threading.local()
+            self._connections: List[sqlite3.Connection] = []
+            self._connections_lock = threading.Lock()
+            
+            # Кэш пользователей по Telegram ID и отложенные обновления last_active
+            self._user_cache: OrderedDict = OrderedDict()
+            self._pending_activity: Dict[int, str] = {}
+            self._last_activity_flush = time.monotonic()
+            self._cache_lock = threading.Lock()
             
             # Создаем таблицы
             self._create_tables()
@@ -56,6 +157,37 @@ class Database:
             logger.error(f"Ошибка при инициализации базы данных: {e}")
             raise
 
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Соединение текущего потока"""
+        return self._get_connection()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """
+        Возвращает соединение текущего потока, создавая его при первом обращении
+
+        Returns:
+            sqlite3.Connection в режиме WAL
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.busy_timeout_ms / 1000,
+                check_same_thread=False,
+                factory=TimedConnection
+            )
+            conn.row_factory = sqlite3.Row
+            # WAL позволяет читателям работать параллельно с писателем
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+            logger.debug(f"Открыто соединение с базой данных для потока {threading.current_thread().name}")
+        return conn
+
     def _validate_order_data(self, order_data: Dict[str, Any]) -> bool:
         """
         Валидация данных заказа
@@ -196,10 +328,8 @@ class Database:
                 
                 # Создаем индексы для оптимизации
                 self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_active ON users(last_active)")
-                self.conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id)")
                 self.conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at)")
                 self.conn.execute("CREATE INDEX IF NOT EXISTS idx_temp_orders_user_id ON temporary_orders(user_id)")
-                self.conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id)')
                 
                 logger.info("Таблицы успешно созданы")
         except Exception as e:
@@ -218,41 +348,123 @@ class Database:
             Dict с данными пользователя
         """
         try:
+            # Пользователь из кэша: запрос не нужен, last_active запишется позже пачкой
+            user = self._get_cached_user(user_id)
+            if user is not None:
+                self._touch_user(user)
+                return user
+            
             # Проверяем существование пользователя
             cursor = self.conn.execute(
                 "SELECT * FROM users WHERE user_id = ?",
                 (user_id,)
             )
-            user = cursor.fetchone()
+            row = cursor.fetchone()
             
-            if user:
-                # Обновляем время последней активности
-                self.conn.execute(
-                    "UPDATE users SET last_active = CURRENT_TIMESTAMP WHERE user_id = ?",
-                    (user_id,)
-                )
-                logger.debug(f"Обновлено время активности пользователя {user_id}")
+            if row:
+                user = dict(row)
+                # Обновляем время последней активности (отложенно)
+                self._touch_user(user)
             else:
                 # Создаем нового пользователя
-                self.conn.execute(
-                    """
-                    INSERT INTO users (user_id, username, last_active)
-                    VALUES (?, ?, CURRENT_TIMESTAMP)
-                    """,
-                    (user_id, username)
-                )
+                with self.conn:
+                    self.conn.execute(
+                        """
+                        INSERT INTO users (user_id, username, last_active)
+                        VALUES (?, ?, CURRENT_TIMESTAMP)
+                        """,
+                        (user_id, username)
+                    )
                 logger.info(f"Создан новый пользователь: {user_id} ({username})")
+                
+                cursor = self.conn.execute(
+                    "SELECT * FROM users WHERE user_id = ?",
+                    (user_id,)
+                )
+                user = dict(cursor.fetchone())
             
-            # Получаем данные пользователя (как существующего, так и нового)
-            cursor = self.conn.execute(
-                "SELECT * FROM users WHERE user_id = ?",
-                (user_id,)
-            )
-            return dict(cursor.fetchone())
+            self._cache_user(user)
+            return dict(user)
             
         except Exception as e:
             logger.error(f"Ошибка при получении/создании пользователя: {e}")
             raise
+
+    def _get_cached_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Возвращает копию пользователя из кэша или None, если записи нет или она устарела"""
+        with self._cache_lock:
+            entry = self._user_cache.get(user_id)
+            if entry is None:
+                return None
+            cached_at, user = entry
+            if time.monotonic() - cached_at > self.user_cache_ttl:
+                del self._user_cache[user_id]
+                return None
+            self._user_cache.move_to_end(user_id)
+            return dict(user)
+
+    def _cache_user(self, user: Dict[str, Any]):
+        """Кладет пользователя в кэш, вытесняя самые старые записи"""
+        with self._cache_lock:
+            self._user_cache[user['user_id']] = (time.monotonic(), dict(user))
+            self._user_cache.move_to_end(user['user_id'])
+            while len(self._user_cache) > self.user_cache_size:
+                self._user_cache.popitem(last=False)
+
+    def _invalidate_user(self, user_id: int):
+        """Удаляет пользователя из кэша после изменения его данных"""
+        with self._cache_lock:
+            self._user_cache.pop(user_id, None)
+
+    def _touch_user(self, user: Dict[str, Any]):
+        """
+        Откладывает обновление last_active пользователя
+        
+        Обновления копятся в памяти и записываются одним UPDATE раз в
+        activity_flush_interval секунд (по таймеру, см. AsyncDatabase.start_activity_flush).
+        """
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        user['last_active'] = now
+        
+        with self._cache_lock:
+            self._pending_activity[user['user_id']] = now
+            entry = self._user_cache.get(user['user_id'])
+            if entry is not None:
+                entry[1]['last_active'] = now
+            flush_due = time.monotonic() - self._last_activity_flush >= self.activity_flush_interval
+        
+        if flush_due:
+            self.flush_user_activity()
+
+    def flush_user_activity(self) -> int:
+        """
+        Записывает накопленные обновления last_active
+        
+        Returns:
+            Количество обновленных пользователей
+        """
+        with self._cache_lock:
+            pending, self._pending_activity = self._pending_activity, {}
+            self._last_activity_flush = time.monotonic()
+        
+        if not pending:
+            return 0
+        
+        try:
+            with self.conn as conn:
+                conn.executemany(
+                    "UPDATE users SET last_active = ? WHERE user_id = ?",
+                    [(last_active, user_id) for user_id, last_active in pending.items()]
+                )
+            logger.debug(f"Обновлено время активности {len(pending)} пользователей")
+            return len(pending)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при обновлении времени активности: {e}")
+            # Возвращаем обновления в очередь, не затирая более свежие
+            with self._cache_lock:
+                for user_id, last_active in pending.items():
+                    self._pending_activity.setdefault(user_id, last_active)
+            return 0
         
     def get_user_sessions(self, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
         """
@@ -266,7 +478,7 @@ class Database:
             Список словарей с данными о сменах
         """
         try:
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 '''
                 SELECT 
                     session_id,
@@ -278,15 +490,10 @@ class Database:
                     order_count,
                     weather,
                     created_at,
+                    COALESCE(duration_hours, 0) as total_hours,
                     CASE 
-                        WHEN start_time IS NOT NULL AND end_time IS NOT NULL 
-                        THEN (julianday(end_time) - julianday(start_time)) * 24
-                        ELSE 0 
-                    END as total_hours,
-                    CASE 
-                        WHEN start_time IS NOT NULL AND end_time IS NOT NULL 
-                        AND (julianday(end_time) - julianday(start_time)) * 24 > 0 
-                        THEN earnings / ((julianday(end_time) - julianday(start_time)) * 24)
+                        WHEN duration_hours > 0 
+                        THEN COALESCE(earnings, 0) / duration_hours
                         ELSE 0 
                     END as avg_earnings_per_hour
                 FROM sessions 
@@ -296,7 +503,7 @@ class Database:
                 ''',
                 (user_id, limit)
             )
-            sessions = self.cursor.fetchall()
+            sessions = cursor.fetchall()
             
             # Преобразуем Row в dict и округляем числовые значения
             result = []
@@ -327,19 +534,179 @@ class Database:
             ID созданной смены или None в случае ошибки
         """
         try:
-            self.cursor.execute(
-                'INSERT INTO sessions (user_id, service, start_time) VALUES (?, ?, ?)',
-                (user_id, service, start_time)
-            )
-            self.conn.commit()
-            
-            session_id = self.cursor.lastrowid
-            logger.info(f"Добавлена новая смена: {session_id} для пользователя {user_id}")
-            return session_id
+            with self.conn as conn:
+                return self._insert_session(conn, user_id, service, start_time)
         except sqlite3.Error as e:
             logger.error(f"Ошибка при добавлении смены: {e}")
             return None
+
+    def _insert_session(self, conn: sqlite3.Connection, user_id: int, service: str, start_time: str) -> int:
+        """Вставка смены без фиксации транзакции"""
+        cursor = conn.execute(
+            'INSERT INTO sessions (user_id, service, start_time) VALUES (?, ?, ?)',
+            (user_id, service, start_time)
+        )
+        session_id = cursor.lastrowid
+        logger.info(f"Добавлена новая смена: {session_id} для пользователя {user_id}")
+        return session_id
+            
+    def record_completed_session(self, user_id: int, service: Optional[str], start: datetime, end: datetime,
+                                 earnings: float, orders: int) -> Optional[Dict[str, Any]]:
+        """
+        Проверяет и сохраняет завершенную смену одним запросом
+        
+        Args:
+            user_id: ID пользователя
+            service: Сервис доставки (None - текущий сервис пользователя)
+            start: Начало смены
+            end: Конец смены
+            earnings: Заработок за смену
+            orders: Количество заказов за смену
+            
+        Returns:
+            Dict с session_id, service, total_hours и earnings_per_hour или None в случае ошибки
+            
+        Raises:
+            ValueError: Если данные смены некорректны
+        """
+        try:
+            with self.conn as conn:
+                return self._insert_completed_session(conn, user_id, service, start, end, earnings, orders)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при сохранении смены: {e}")
+            return None
+
+    def _insert_completed_session(self, conn: sqlite3.Connection, user_id: int, service: Optional[str],
+                                  start: datetime, end: datetime, earnings: float, orders: int) -> Dict[str, Any]:
+        """Проверка и вставка завершенной смены без фиксации транзакции"""
+        total_hours = self._validate_session_data(start, end, earnings, orders)
+        
+        cursor = conn.execute(
+            '''
+            INSERT INTO sessions (user_id, service, start_time, end_time, earnings, order_count)
+            VALUES (?, COALESCE(?, (SELECT current_service FROM users WHERE user_id = ?), 'yandex_food'), ?, ?, ?, ?)
+            RETURNING session_id, service
+            ''',
+            (
+                user_id,
+                service,
+                user_id,
+                start.strftime('%Y-%m-%d %H:%M:%S'),
+                end.strftime('%Y-%m-%d %H:%M:%S'),
+                earnings,
+                orders
+            )
+        )
+        row = cursor.fetchone()
+        logger.info(f"Добавлена завершенная смена: {row['session_id']} для пользователя {user_id}")
+        
+        return {
+            'session_id': row['session_id'],
+            'service': row['service'],
+            'total_hours': round(total_hours, 2),
+            'earnings_per_hour': round(earnings / total_hours, 2)
+        }
+
+    def import_completed_sessions(self, user_id: int,
+                                  sessions: List[Tuple[datetime, datetime, float, int]]) -> Dict[str, Any]:
+        """
+        Проверяет и сохраняет пачку завершенных смен одним executemany в одной транзакции
+
+        Смены с тем же временем начала, что уже есть у пользователя (или повторяющиеся
+        в пачке), пропускаются, поэтому повторная загрузка того же файла ничего не дублирует.
+
+        Args:
+            user_id: ID пользователя
+            sessions: Смены (начало, конец, заработок, заказы)
+
+        Returns:
+            Dict с imported, duplicates и errors (индекс смены в пачке -> текст ошибки);
+            при ошибке базы imported равен 0, а ошибка записана для всех смен
+        """
+        errors: Dict[int, str] = {}
+        valid = []
+        for index, (start, end, earnings, orders) in enumerate(sessions):
+            try:
+                self._validate_session_data(start, end, earnings, orders)
+            except ValueError as e:
+                errors[index] = str(e)
+                continue
+            valid.append((start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'), earnings, orders))
+
+        if not valid:
+            return {'imported': 0, 'duplicates': 0, 'errors': errors}
+
+        try:
+            with self.conn as conn:
+                row = conn.execute('SELECT current_service FROM users WHERE user_id = ?', (user_id,)).fetchone()
+                service = (row['current_service'] if row else None) or 'yandex_food'
+
+                # Уже сохраненные смены за период пачки (idx_sessions_user_start)
+                existing = {
+                    row['start_time']
+                    for row in conn.execute(
+                        'SELECT start_time FROM sessions WHERE user_id = ? AND start_time BETWEEN ? AND ?',
+                        (user_id, min(session[0] for session in valid), max(session[0] for session in valid))
+                    )
+                }
+                rows = []
+                for start_time, end_time, earnings, orders in valid:
+                    if start_time in existing:
+                        continue
+                    existing.add(start_time)
+                    rows.append((user_id, service, start_time, end_time, earnings, orders))
+
+                conn.executemany(
+                    '''
+                    INSERT INTO sessions (user_id, service, start_time, end_time, earnings, order_count)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ''',
+                    rows
+                )
+            logger.info(f"Импортировано смен: {len(rows)} для пользователя {user_id}")
+            return {'imported': len(rows), 'duplicates': len(valid) - len(rows), 'errors': errors}
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при импорте смен: {e}")
+            for index in range(len(sessions)):
+                errors.setdefault(index, "Ошибка базы данных")
+            return {'imported': 0, 'duplicates': 0, 'errors': errors}
+
+    def _validate_session_data(self, start: datetime, end: datetime, earnings: float, orders: int) -> float:
+        """
+        Валидация данных смены
+        
+        Args:
+            start: Начало смены
+            end: Конец смены
+            earnings: Заработок за смену
+            orders: Количество заказов за смену
+            
+        Returns:
+            float: Длительность смены в часах
             
+        Raises:
+            ValueError: Если данные некорректны (текст ошибки показывается пользователю)
+        """
+        if orders <= 0 or orders > self.max_orders_per_session:
+            raise ValueError(
+                f"Количество заказов должно быть положительным числом и меньше {self.max_orders_per_session}."
+            )
+        
+        if earnings >= self.max_earnings_per_session:
+            raise ValueError("Заработок не соответствует реальности! Введите меньшее число.")
+        
+        if start.year < self.min_session_year:
+            raise ValueError(f"Некорректная дата или время: Год не может быть раньше {self.min_session_year}")
+        
+        current_dt = datetime.now()
+        if start > current_dt or end > current_dt:
+            raise ValueError("Некорректная дата или время: Дата и время не могут быть в будущем")
+        
+        if end <= start:
+            raise ValueError("Некорректная дата или время: Время окончания должно быть позже времени начала")
+        
+        return (end - start).total_seconds() / 3600
+
     def end_session(self, session_id: int, earnings: float, order_count: int) -> bool:
         """
         Завершение смены
@@ -353,18 +720,21 @@ class Database:
             True в случае успеха, False в случае ошибки
         """
         try:
-            end_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            self.cursor.execute(
-                'UPDATE sessions SET end_time = ?, earnings = ?, order_count = ? WHERE session_id = ?',
-                (end_time, earnings, order_count, session_id)
-            )
-            self.conn.commit()
-            
-            logger.info(f"Смена {session_id} успешно завершена. Заработок: {earnings}, заказов: {order_count}")
-            return True
+            with self.conn as conn:
+                return self._finish_session(conn, session_id, earnings, order_count)
         except sqlite3.Error as e:
             logger.error(f"Ошибка при завершении смены: {e}")
             return False
+
+    def _finish_session(self, conn: sqlite3.Connection, session_id: int, earnings: float, order_count: int) -> bool:
+        """Завершение смены без фиксации транзакции"""
+        end_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.execute(
+            'UPDATE sessions SET end_time = ?, earnings = ?, order_count = ? WHERE session_id = ?',
+            (end_time, earnings, order_count, session_id)
+        )
+        logger.info(f"Смена {session_id} успешно завершена. Заработок: {earnings}, заказов: {order_count}")
+        return True
             
     def update_session(self, session_id: int, **kwargs) -> bool:
         """
@@ -378,25 +748,28 @@ class Database:
             True в случае успеха, False в случае ошибки
         """
         try:
-            if not kwargs:
-                logger.warning("Пустые данные для обновления смены")
-                return False
-                
-            set_clause = ', '.join(f'{k} = ?' for k in kwargs.keys())
-            values = list(kwargs.values())
-            values.append(session_id)
-            
-            self.cursor.execute(
-                f'UPDATE sessions SET {set_clause} WHERE session_id = ?',
-                values
-            )
-            self.conn.commit()
-            
-            logger.debug(f"Смена {session_id} успешно обновлена: {kwargs}")
-            return True
+            with self.conn as conn:
+                return self._update_session_row(conn, session_id, **kwargs)
         except sqlite3.Error as e:
             logger.error(f"Ошибка при обновлении смены: {e}")
             return False
+
+    def _update_session_row(self, conn: sqlite3.Connection, session_id: int, **kwargs) -> bool:
+        """Обновление смены без фиксации транзакции"""
+        if not kwargs:
+            logger.warning("Пустые данные для обновления смены")
+            return False
+            
+        set_clause = ', '.join(f'{k} = ?' for k in kwargs.keys())
+        values = list(kwargs.values())
+        values.append(session_id)
+        
+        conn.execute(
+            f'UPDATE sessions SET {set_clause} WHERE session_id = ?',
+            values
+        )
+        logger.debug(f"Смена {session_id} успешно обновлена: {kwargs}")
+        return True
             
     def get_session(self, session_id: int) -> Optional[Dict[str, Any]]:
         """
@@ -409,11 +782,11 @@ class Database:
             Словарь с данными смены или None в случае ошибки
         """
         try:
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 'SELECT * FROM sessions WHERE session_id = ?',
                 (session_id,)
             )
-            session = self.cursor.fetchone()
+            session = cursor.fetchone()
             
             if not session:
                 logger.warning(f"Смена с ID {session_id} не найдена")
@@ -435,11 +808,11 @@ class Database:
             Тип транспорта или None
         """
         try:
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 'SELECT transport FROM users WHERE id = ?',
                 (user_id,)
             )
-            result = self.cursor.fetchone()
+            result = cursor.fetchone()
             
             if not result:
                 logger.warning(f"Пользователь с ID {user_id} не найден")
@@ -461,11 +834,11 @@ class Database:
             ID последней сессии или None
         """
         try:
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 'SELECT session_id FROM sessions WHERE user_id = ? ORDER BY start_time DESC LIMIT 1',
                 (user_id,)
             )
-            result = self.cursor.fetchone()
+            result = cursor.fetchone()
             
             if not result:
                 logger.debug(f"У пользователя {user_id} нет сессий")
@@ -488,11 +861,12 @@ class Database:
             True в случае успеха, False в случае ошибки
         """
         try:
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 'UPDATE users SET current_service = ? WHERE user_id = ?',
                 (service, user_id)
             )
             self.conn.commit()
+            self._invalidate_user(user_id)
             
             logger.info(f"Сервис пользователя {user_id} обновлен на {service}")
             return True
@@ -512,11 +886,12 @@ class Database:
             True в случае успеха, False в случае ошибки
         """
         try:
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 'UPDATE users SET transport = ? WHERE user_id = ?',
                 (transport, user_id)
             )
             self.conn.commit()
+            self._invalidate_user(user_id)
             
             logger.info(f"Транспорт пользователя {user_id} обновлен на {transport}")
             return True
@@ -535,11 +910,15 @@ class Database:
             Название сервиса или None
         """
         try:
-            self.cursor.execute(
+            user = self._get_cached_user(user_id)
+            if user is not None:
+                return user['current_service']
+            
+            cursor = self.conn.execute(
                 'SELECT current_service FROM users WHERE user_id = ?',
                 (user_id,)
             )
-            result = self.cursor.fetchone()
+            result = cursor.fetchone()
             
             if not result:
                 logger.warning(f"Пользователь с ID {user_id} не найден")
@@ -563,29 +942,34 @@ class Database:
             ID созданного заказа или None в случае ошибки
         """
         try:
-            self.cursor.execute(
-                '''
-                INSERT INTO orders 
-                (user_id, session_id, time, address, price, distance) 
-                VALUES (?, ?, ?, ?, ?, ?)
-                ''',
-                (
-                    user_id, 
-                    session_id, 
-                    order_data.get('time'), 
-                    order_data.get('address'), 
-                    order_data.get('price'), 
-                    order_data.get('distance')
-                )
-            )
-            self.conn.commit()
-            
-            order_id = self.cursor.lastrowid
-            logger.info(f"Добавлен новый заказ: {order_id} для пользователя {user_id}")
-            return order_id
+            with self.conn as conn:
+                return self._insert_order(conn, user_id, session_id, order_data)
         except sqlite3.Error as e:
             logger.error(f"Ошибка при добавлении заказа: {e}")
             return None
+
+    def _insert_order(self, conn: sqlite3.Connection, user_id: int, session_id: Optional[int],
+                      order_data: Dict[str, Any], status: Optional[str] = None) -> int:
+        """Вставка заказа без фиксации транзакции"""
+        cursor = conn.execute(
+            '''
+            INSERT INTO orders 
+            (user_id, session_id, time, address, price, distance, status) 
+            VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, 'pending'))
+            ''',
+            (
+                user_id, 
+                session_id, 
+                order_data.get('time'), 
+                order_data.get('address'), 
+                order_data.get('price'), 
+                order_data.get('distance'),
+                status
+            )
+        )
+        order_id = cursor.lastrowid
+        logger.info(f"Добавлен новый заказ: {order_id} для пользователя {user_id}")
+        return order_id
     
     def get_orders_by_session(self, session_id: int) -> List[Dict[str, Any]]:
         """
@@ -598,11 +982,11 @@ class Database:
             Список словарей с данными заказов
         """
         try:
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 'SELECT * FROM orders WHERE session_id = ? ORDER BY created_at',
                 (session_id,)
             )
-            orders = self.cursor.fetchall()
+            orders = cursor.fetchall()
             
             return [dict(order) for order in orders]
         except sqlite3.Error as e:
@@ -621,17 +1005,55 @@ class Database:
             Список словарей с данными заказов
         """
         try:
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 'SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC LIMIT ?',
                 (user_id, limit)
             )
-            orders = self.cursor.fetchall()
+            orders = cursor.fetchall()
             
             return [dict(order) for order in orders]
         except sqlite3.Error as e:
             logger.error(f"Ошибка при получении заказов для пользователя {user_id}: {e}")
             return []
     
+    # Таблицы для выгрузки: название -> (таблица, колонка сортировки из индекса по user_id)
+    export_tables = {
+        'sessions': ('sessions', 'start_time'),
+        'orders': ('orders', 'created_at'),
+        'advice': ('ai_advice', 'created_at'),
+    }
+
+    def iter_user_rows(self, user_id: int, table: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """
+        Построчно отдает все записи пользователя из таблицы (курсор читается порциями)
+
+        Генератор читает базу по мере обхода, поэтому обходить его нужно
+        в потоке базы данных (AsyncDatabase.run), а не в event loop.
+
+        Args:
+            user_id: ID пользователя
+            table: Название из export_tables
+            batch_size: Строк в одном fetchmany
+
+        Returns:
+            Итератор словарей с данными строк
+        """
+        table_name, order_column = self.export_tables[table]
+        cursor = self.conn.execute(
+            f'SELECT * FROM {table_name} WHERE user_id = ? ORDER BY {order_column}',
+            (user_id,)
+        )
+        try:
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(columns, row))
+        finally:
+            cursor.close()
+
     def update_order(self, order_id: int, **kwargs) -> bool:
         """
         Обновление данных заказа
@@ -652,8 +1074,8 @@ class Database:
             values = list(kwargs.values())
             values.append(order_id)
             
-            self.cursor.execute(
-                f'UPDATE orders SET {set_clause} WHERE order_id = ?',
+            cursor = self.conn.execute(
+                f'UPDATE orders SET {set_clause} WHERE id = ?',
                 values
             )
             self.conn.commit()
@@ -675,8 +1097,8 @@ class Database:
             True в случае успеха, False в случае ошибки
         """
         try:
-            self.cursor.execute(
-                'DELETE FROM orders WHERE order_id = ?',
+            cursor = self.conn.execute(
+                'DELETE FROM orders WHERE id = ?',
                 (order_id,)
             )
             self.conn.commit()
@@ -687,7 +1109,8 @@ class Database:
             logger.error(f"Ошибка при удалении заказа: {e}")
             return False
     
-    def add_ai_advice(self, user_id: int, advice_type: str, advice_text: str, related_data: Optional[str] = None) -> Optional[int]:
+    def add_ai_advice(self, user_id: int, advice_type: str, advice_text: str, related_data: Optional[str] = None,
+                      question_key: Optional[str] = None) -> Optional[int]:
         """
         Добавление совета ИИ
         
@@ -696,27 +1119,33 @@ class Database:
             advice_type: Тип совета (order, daily, etc.)
             advice_text: Текст совета
             related_data: Связанные данные в формате JSON
+            question_key: Нормализованный вопрос (ключ кэша ответов)
             
         Returns:
             ID созданной записи совета или None в случае ошибки
         """
         try:
-            self.cursor.execute(
-                '''
-                INSERT INTO ai_advice 
-                (user_id, advice_type, advice_text, related_data) 
-                VALUES (?, ?, ?, ?)
-                ''',
-                (user_id, advice_type, advice_text, related_data)
-            )
-            self.conn.commit()
-            
-            advice_id = self.cursor.lastrowid
-            logger.info(f"Добавлен новый совет ИИ: {advice_id} для пользователя {user_id}")
-            return advice_id
+            with self.conn as conn:
+                return self._insert_ai_advice(conn, user_id, advice_type, advice_text, related_data, question_key)
         except sqlite3.Error as e:
             logger.error(f"Ошибка при добавлении совета ИИ: {e}")
             return None
+
+    def _insert_ai_advice(self, conn: sqlite3.Connection, user_id: int, advice_type: str,
+                          advice_text: str, related_data: Optional[str] = None,
+                          question_key: Optional[str] = None) -> int:
+        """Вставка совета ИИ без фиксации транзакции"""
+        cursor = conn.execute(
+            '''
+            INSERT INTO ai_advice 
+            (user_id, advice_type, advice_text, related_data, question_key) 
+            VALUES (?, ?, ?, ?, ?)
+            ''',
+            (user_id, advice_type, advice_text, related_data, question_key)
+        )
+        advice_id = cursor.lastrowid
+        logger.info(f"Добавлен новый совет ИИ: {advice_id} для пользователя {user_id}")
+        return advice_id
     
     def get_user_advice(self, user_id: int, advice_type: Optional[str] = None, limit: int = 5) -> List[Dict[str, Any]]:
         """
@@ -732,7 +1161,7 @@ class Database:
         """
         try:
             if advice_type:
-                self.cursor.execute(
+                cursor = self.conn.execute(
                     '''
                     SELECT * FROM ai_advice 
                     WHERE user_id = ? AND advice_type = ? 
@@ -741,7 +1170,7 @@ class Database:
                     (user_id, advice_type, limit)
                 )
             else:
-                self.cursor.execute(
+                cursor = self.conn.execute(
                     '''
                     SELECT * FROM ai_advice 
                     WHERE user_id = ? 
@@ -750,127 +1179,493 @@ class Database:
                     (user_id, limit)
                 )
                 
-            advice = self.cursor.fetchall()
+            advice = cursor.fetchall()
             return [dict(a) for a in advice]
         except sqlite3.Error as e:
             logger.error(f"Ошибка при получении советов ИИ для пользователя {user_id}: {e}")
             return []
     
-    def get_connection(self):
+    def find_cached_advice(self, advice_type: str, question_key: str,
+                           max_age_seconds: int) -> Optional[Dict[str, Any]]:
         """
-        Получает соединение с базой данных
+        Ищет свежий ответ ИИ на такой же вопрос по той же теме
+        
+        Args:
+            advice_type: Тема совета
+            question_key: Нормализованный вопрос
+            max_age_seconds: Максимальный возраст ответа
+            
+        Returns:
+            Dict с advice_text и created_at (UTC) или None
         """
-        return self.conn
+        try:
+            cursor = self.conn.execute(
+                '''
+                SELECT advice_text, created_at FROM ai_advice 
+                WHERE advice_type = ? AND question_key = ? AND created_at >= datetime('now', ?)
+                ORDER BY created_at DESC LIMIT 1
+                ''',
+                (advice_type, question_key, f'-{int(max_age_seconds)} seconds')
+            )
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при поиске ответа в кэше советов: {e}")
+            return None
 
-    def get_user_statistics(self, user_id: int) -> Dict[str, Any]:
+    def get_cached_advice(self, max_age_seconds: int, limit: int) -> List[Dict[str, Any]]:
         """
-        Получает статистику пользователя
+        Получает последние ответы ИИ с ключом вопроса (для прогрева кэша)
+        
+        Args:
+            max_age_seconds: Максимальный возраст ответа
+            limit: Максимальное количество ответов
+            
+        Returns:
+            Список словарей advice_type, question_key, advice_text, created_at (от новых к старым)
         """
         try:
-            # Получаем основную статистику
-            self.cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_shifts,
-                    COALESCE(SUM(earnings), 0) as total_earnings,
-                    COALESCE(SUM(order_count), 0) as total_orders,
-                    COALESCE(AVG(earnings), 0) as avg_earnings,
-                    COALESCE(AVG(order_count), 0) as avg_orders,
-                    COALESCE(MAX(earnings), 0) as max_earnings,
-                    COALESCE(MIN(earnings), 0) as min_earnings,
-                    COALESCE(SUM((julianday(end_time) - julianday(start_time)) * 24), 0) as total_hours,
-                    COALESCE(AVG((julianday(end_time) - julianday(start_time)) * 24), 0) as avg_shift_duration
-                FROM sessions 
-                WHERE user_id = ? AND end_time IS NOT NULL
-            """, (user_id,))
-            
-            stats = self.cursor.fetchone()
-            
-            if not stats:
-                return {
-                    'total_shifts': 0,
-                    'total_earnings': 0,
-                    'total_orders': 0,
-                    'avg_earnings': 0,
-                    'avg_orders': 0,
-                    'max_earnings': 0,
-                    'min_earnings': 0,
-                    'total_hours': 0,
-                    'avg_shift_duration': 0
-                }
-            
-            # Преобразуем результат в словарь
-            stats_dict = dict(stats)
-            
-            # Убеждаемся, что все значения не None
-            for key in stats_dict:
-                if stats_dict[key] is None:
-                    stats_dict[key] = 0
-            
-            return stats_dict
-                
-        except Exception as e:
-            logger.error(f"Ошибка при получении статистики пользователя: {e}")
-            return None
+            cursor = self.conn.execute(
+                '''
+                SELECT advice_type, question_key, advice_text, created_at FROM ai_advice 
+                WHERE question_key IS NOT NULL AND created_at >= datetime('now', ?)
+                ORDER BY created_at DESC LIMIT ?
+                ''',
+                (f'-{int(max_age_seconds)} seconds', limit)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при загрузке кэша советов: {e}")
+            return []
 
-    def get_detailed_statistics(self, user_id: int) -> Dict[str, Any]:
+    def get_ai_quota_used(self, user_id: int, day: str) -> int:
         """
-        Получает детальную статистику пользователя
+        Получает число вопросов к ИИ за день
         
         Args:
             user_id: ID пользователя
+            day: День в формате YYYY-MM-DD
             
         Returns:
-            Dict с детальной статистикой
+            Количество заданных вопросов
         """
         try:
-            logger.debug(f"Запрос детальной статистики для пользователя {user_id}")
+            cursor = self.conn.execute(
+                'SELECT used FROM ai_quota WHERE user_id = ? AND day = ?',
+                (user_id, day)
+            )
+            row = cursor.fetchone()
+            return row['used'] if row else 0
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при получении квоты пользователя {user_id}: {e}")
+            return 0
+
+    def add_ai_quota_usage(self, usage: Dict[Tuple[int, str], int]) -> Dict[Tuple[int, str], int]:
+        """
+        Атомарно прибавляет расход квоты нескольких пользователей одной транзакцией
+        
+        Args:
+            usage: {(user_id, day): сколько прибавить}
             
-            # Получаем базовую статистику
-            basic_stats = self.get_user_statistics(user_id)
-            logger.debug(f"Получена базовая статистика: {basic_stats}")
+        Returns:
+            Итоговые значения счетчиков из базы (с учетом других процессов) или {} в случае ошибки
+        """
+        try:
+            totals = {}
+            with self.conn as conn:
+                for (user_id, day), delta in usage.items():
+                    cursor = conn.execute(
+                        '''
+                        INSERT INTO ai_quota (user_id, day, used) VALUES (?, ?, MAX(?, 0))
+                        ON CONFLICT(user_id, day) DO UPDATE SET used = MAX(used + excluded.used, 0)
+                        RETURNING used
+                        ''',
+                        (user_id, day, delta)
+                    )
+                    totals[(user_id, day)] = cursor.fetchone()['used']
+            logger.debug(f"Записан расход квоты ИИ для {len(usage)} пользователей")
+            return totals
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при записи расхода квоты ИИ: {e}")
+            return {}
+
+    def get_fsm_record(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Получает состояние и данные FSM
+        
+        Args:
+            key: Ключ хранилища (бот, чат, пользователь)
             
-            # Получаем статистику по времени суток
-            time_stats = {}
+        Returns:
+            Dict с state, data (JSON) и updated_at или None, если записи нет
+        """
+        try:
+            cursor = self.conn.execute(
+                'SELECT state, data, updated_at FROM fsm_states WHERE key = ?',
+                (key,)
+            )
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при получении состояния FSM {key}: {e}")
+            return None
+
+    def set_fsm_records(self, records: List[Tuple[str, Optional[str], Optional[str]]]) -> bool:
+        """
+        Сохраняет несколько состояний FSM одной транзакцией (пустые записи удаляются)
+
+        Args:
+            records: Список (ключ, состояние или None, данные в формате JSON или None)
+
+        Returns:
+            True в случае успеха, False в случае ошибки
+        """
+        try:
+            with self.conn as conn:
+                now = time.time()
+                for key, state, data in records:
+                    if state is None and not data:
+                        conn.execute('DELETE FROM fsm_states WHERE key = ?', (key,))
+                    else:
+                        conn.execute(
+                            '''
+                            INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(key) DO UPDATE SET
+                                state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                            ''',
+                            (key, state, data, now)
+                        )
+            logger.debug(f"Сохранено состояний FSM: {len(records)}")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при сохранении состояний FSM: {e}")
+            return False
+
+    def delete_expired_fsm_records(self, max_age_seconds: float) -> int:
+        """
+        Удаляет давно не менявшиеся состояния FSM
+        
+        Args:
+            max_age_seconds: Максимальный возраст записи
+            
+        Returns:
+            Количество удаленных записей
+        """
+        try:
+            with self.conn as conn:
+                cursor = conn.execute(
+                    'DELETE FROM fsm_states WHERE updated_at < ?',
+                    (time.time() - max_age_seconds,)
+                )
+            if cursor.rowcount:
+                logger.info(f"Удалено устаревших состояний FSM: {cursor.rowcount}")
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при удалении устаревших состояний FSM: {e}")
+            return 0
+
+    def enable_query_trace(self, slow_query_ms: Optional[float] = None, record: bool = False):
+        """
+        Включает трассировку запросов во всех соединениях процесса
+        
+        Args:
+            slow_query_ms: Запросы дольше порога (мс) пишутся в лог с типами параметров
+            record: Запоминать текст и параметры всех выполненных запросов (для аудита планов)
+        """
+        TimedConnection.slow_query_ms = slow_query_ms
+        if record and TimedConnection.recorded_queries is None:
+            TimedConnection.recorded_queries = {}
+        elif not record:
+            TimedConnection.recorded_queries = None
+
+    def get_recorded_queries(self) -> Dict[str, Any]:
+        """
+        Запросы, выполненные с момента enable_query_trace(record=True)
+        
+        Returns:
+            Dict: текст запроса -> параметры первого выполнения
+        """
+        return dict(TimedConnection.recorded_queries or {})
+
+    def explain_query_plan(self, sql: str, parameters=()) -> List[str]:
+        """
+        План выполнения запроса
+        
+        Args:
+            sql: Текст запроса
+            parameters: Параметры запроса
+            
+        Returns:
+            Строки плана (detail из EXPLAIN QUERY PLAN)
+        """
+        cursor = self.conn.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)
+        return [row['detail'] for row in cursor.fetchall()]
+
+    def get_connection(self):
+        """
+        Получает соединение с базой данных
+        """
+        return self.conn
+
+    def get_user_statistics(self, user_id: int) -> Dict[str, Any]:
+        """
+        Получает статистику пользователя из сводной таблицы user_stats
+        """
+        try:
             cursor = self.conn.execute("""
                 SELECT 
-                    CASE 
-                        WHEN CAST(strftime('%H', time) AS INTEGER) BETWEEN 6 AND 11 THEN 'morning'
-                        WHEN CAST(strftime('%H', time) AS INTEGER) BETWEEN 12 AND 17 THEN 'day'
-                        WHEN CAST(strftime('%H', time) AS INTEGER) BETWEEN 18 AND 23 THEN 'evening'
-                        ELSE 'night'
-                    END as time_of_day,
-                    COUNT(*) as count
-                FROM orders 
-                WHERE user_id = ? 
-                GROUP BY time_of_day
+                    total_shifts,
+                    total_earnings,
+                    total_orders,
+                    CASE WHEN earnings_count > 0 THEN total_earnings / earnings_count ELSE 0 END as avg_earnings,
+                    CASE WHEN orders_count > 0 THEN CAST(total_orders AS REAL) / orders_count ELSE 0 END as avg_orders,
+                    COALESCE(max_earnings, 0) as max_earnings,
+                    COALESCE(min_earnings, 0) as min_earnings,
+                    total_hours,
+                    CASE WHEN hours_count > 0 THEN total_hours / hours_count ELSE 0 END as avg_shift_duration
+                FROM user_stats 
+                WHERE user_id = ?
             """, (user_id,))
             
-            for row in cursor.fetchall():
-                time_stats[row['time_of_day']] = row['count']
+            stats = cursor.fetchone()
             
-            logger.debug(f"Статистика по времени суток: {time_stats}")
+            if not stats:
+                return {
+                    'total_shifts': 0,
+                    'total_earnings': 0,
+                    'total_orders': 0,
+                    'avg_earnings': 0,
+                    'avg_orders': 0,
+                    'max_earnings': 0,
+                    'min_earnings': 0,
+                    'total_hours': 0,
+                    'avg_shift_duration': 0
+                }
             
-            # Получаем статистику по дням недели
-            day_stats = {}
-            cursor = self.conn.execute("""
-                SELECT 
-                    strftime('%w', created_at) as day_of_week,
-                    COUNT(*) as count
-                FROM orders 
-                WHERE user_id = ? 
-                GROUP BY day_of_week
+            # Преобразуем результат в словарь
+            stats_dict = dict(stats)
+            
+            # Убеждаемся, что все значения не None
+            for key in stats_dict:
+                if stats_dict[key] is None:
+                    stats_dict[key] = 0
+            
+            return stats_dict
+                
+        except Exception as e:
+            logger.error(f"Ошибка при получении статистики пользователя: {e}")
+            return None
+
+    def get_session_columns(self, user_id: int) -> List[Tuple[int, float, float, int, str]]:
+        """
+        Все завершенные смены пользователя для аналитики (services/statistics.py)
+
+        Запрос читается только из индекса idx_sessions_user_start, строки - кортежи без sqlite3.Row.
+        Длительность считается по start_time и end_time: виртуальную колонку duration_hours
+        SQLite берет из таблицы, даже если она есть в индексе.
+
+        Args:
+            user_id: ID пользователя
+
+        Returns:
+            Список (начало в секундах Unix, длительность в часах, заработок, заказы, сервис)
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.row_factory = None
+            cursor.execute("""
+                SELECT
+                    CAST(strftime('%s', start_time) AS INTEGER),
+                    (julianday(end_time) - julianday(start_time)) * 24,
+                    COALESCE(earnings, 0),
+                    COALESCE(order_count, 0),
+                    COALESCE(service, '')
+                FROM sessions
+                WHERE user_id = ? AND end_time IS NOT NULL AND julianday(end_time) > julianday(start_time)
+                ORDER BY start_time
             """, (user_id,))
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при получении смен для аналитики пользователя {user_id}: {e}")
+            return []
+
+    def iter_rate_benchmark_rows(self) -> Iterator[Tuple[int, str, int, float, int, float]]:
+        """
+        Итоги всех курьеров одним GROUP BY: пользователь x сервис x час начала смены
+
+        Строки идут по порядку user_id (индекс idx_sessions_user_start), поэтому
+        итоги одного пользователя можно сворачивать, не держа в памяти всю выборку.
+        Генератор нужно обходить в потоке базы данных.
+
+        Returns:
+            Итератор (user_id, сервис, час, заработок, заказы, часы работы)
+        """
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        cursor.execute("""
+            SELECT
+                user_id,
+                COALESCE(service, ''),
+                CAST(strftime('%H', start_time) AS INTEGER) AS hour,
+                SUM(COALESCE(earnings, 0)),
+                SUM(COALESCE(order_count, 0)),
+                SUM(duration_hours)
+            FROM sessions
+            WHERE end_time IS NOT NULL AND duration_hours > 0
+            GROUP BY user_id, service, hour
+            ORDER BY user_id
+        """)
+        try:
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def replace_rate_benchmarks(self, benchmarks: List[Tuple[str, str, str, str, int]]) -> bool:
+        """
+        Заменяет таблицу rate_benchmarks целиком одной транзакцией
+
+        Args:
+            benchmarks: Список (scope, key, metric, quantiles JSON, sample_size)
+
+        Returns:
+            bool: Успешность операции
+        """
+        try:
+            updated_at = time.time()
+            with self.conn as conn:
+                conn.execute("DELETE FROM rate_benchmarks")
+                conn.executemany(
+                    """
+                    INSERT INTO rate_benchmarks (scope, key, metric, quantiles, sample_size, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    [benchmark + (updated_at,) for benchmark in benchmarks]
+                )
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при сохранении распределений дохода: {e}")
+            return False
+
+    def claim_rate_benchmarks_rebuild(self, interval: float) -> bool:
+        """
+        Атомарно занимает пересчет rate_benchmarks для текущего процесса
+
+        Args:
+            interval: Пересчет можно занять, если предыдущий начался раньше, чем interval секунд назад
+
+        Returns:
+            True, если пересчитывать должен этот процесс
+        """
+        try:
+            now = time.time()
+            with self.conn as conn:
+                # Одна инструкция: из процессов, одновременно увидевших устаревшие данные, строку изменит один
+                cursor = conn.execute(
+                    """
+                    INSERT INTO rate_benchmarks_lease (id, claimed_at) VALUES (1, ?)
+                    ON CONFLICT(id) DO UPDATE SET claimed_at = excluded.claimed_at
+                    WHERE rate_benchmarks_lease.claimed_at < ?
+                    """,
+                    (now, now - interval)
+                )
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при захвате пересчета распределений дохода: {e}")
+            return False
+
+    def get_rate_benchmarks(self) -> List[Dict[str, Any]]:
+        """
+        Все распределения из rate_benchmarks
+
+        Returns:
+            Список словарей scope, key, metric, quantiles (JSON), sample_size, updated_at
+        """
+        try:
+            cursor = self.conn.execute("SELECT * FROM rate_benchmarks")
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при получении распределений дохода: {e}")
+            return []
+
+    @staticmethod
+    def _time_of_day(hour: Optional[int]) -> str:
+        """Время суток по часу: morning 6-11, day 12-17, evening 18-23, остальное - night"""
+        if hour is None:
+            return 'night'
+        if 6 <= hour <= 11:
+            return 'morning'
+        if 12 <= hour <= 17:
+            return 'day'
+        if 18 <= hour <= 23:
+            return 'evening'
+        return 'night'
+
+    def _time_breakdown(self, table: str, user_id: int) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """
+        Количество строк пользователя по времени суток и дням недели
+
+        Один запрос по индексу (user_id, weekday, hour_bucket) таблицы: не больше 7 x 24 групп,
+        свертка в время суток и дни недели - в Python.
+
+        Args:
+            table: orders или sessions
+            user_id: ID пользователя
+
+        Returns:
+            (время суток -> количество, день недели '0'-'6' (0 - воскресенье) -> количество)
+        """
+        time_stats: Dict[str, int] = {}
+        day_stats: Dict[str, int] = {}
+        cursor = self.conn.execute(f"""
+            SELECT weekday, hour_bucket, COUNT(*) as count
+            FROM {table}
+            WHERE user_id = ?
+            GROUP BY weekday, hour_bucket
+        """, (user_id,))
+        
+        for row in cursor.fetchall():
+            time_of_day = self._time_of_day(row['hour_bucket'])
+            time_stats[time_of_day] = time_stats.get(time_of_day, 0) + row['count']
+            if row['weekday'] is not None:
+                day = str(row['weekday'])
+                day_stats[day] = day_stats.get(day, 0) + row['count']
+        return time_stats, day_stats
+
+    def get_detailed_statistics(self, user_id: int) -> Dict[str, Any]:
+        """
+        Получает детальную статистику пользователя
+        
+        Args:
+            user_id: ID пользователя
+            
+        Returns:
+            Dict с детальной статистикой
+        """
+        try:
+            logger.debug(f"Запрос детальной статистики для пользователя {user_id}")
             
-            for row in cursor.fetchall():
-                day_stats[row['day_of_week']] = row['count']
+            # Получаем базовую статистику
+            basic_stats = self.get_user_statistics(user_id)
+            logger.debug(f"Получена базовая статистика: {basic_stats}")
+            
+            # Заказы и смены по времени суток и дням недели
+            time_stats, day_stats = self._time_breakdown('orders', user_id)
+            shift_time_stats, shift_day_stats = self._time_breakdown('sessions', user_id)
             
+            logger.debug(f"Статистика по времени суток: {time_stats}")
             logger.debug(f"Статистика по дням недели: {day_stats}")
             
             # Формируем итоговую статистику
             detailed_stats = {
                 **basic_stats,
                 'time_stats': time_stats,
-                'day_stats': day_stats
+                'day_stats': day_stats,
+                'shift_time_stats': shift_time_stats,
+                'shift_day_stats': shift_day_stats
             }
             
             logger.info(f"Сформирована детальная статистика для пользователя {user_id}")
@@ -885,7 +1680,9 @@ class Database:
                 'total_distance': 0,
                 'avg_distance': 0,
                 'time_stats': {},
-                'day_stats': {}
+                'day_stats': {},
+                'shift_time_stats': {},
+                'shift_day_stats': {}
             }
             
     def save_temporary_order(self, user_id: int, order_data: Dict[str, Any]) -> Optional[int]:
@@ -901,7 +1698,7 @@ class Database:
         """
         try:
             # Создаем временную таблицу, если её нет
-            self.cursor.execute('''
+            self.conn.execute('''
                 CREATE TABLE IF NOT EXISTS temp_orders (
                     order_id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER,
@@ -916,7 +1713,7 @@ class Database:
             self.conn.commit()
             
             # Вставляем данные во временную таблицу
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 '''
                 INSERT INTO temp_orders 
                 (user_id, time, address, price, distance) 
@@ -932,7 +1729,7 @@ class Database:
             )
             self.conn.commit()
             
-            order_id = self.cursor.lastrowid
+            order_id = cursor.lastrowid
             logger.info(f"Создан временный заказ #{order_id} для пользователя {user_id}")
             return order_id
         except sqlite3.Error as e:
@@ -953,31 +1750,32 @@ class Database:
         """
         try:
             # Проверяем, есть ли заказ в постоянной таблице
-            self.cursor.execute(
-                'SELECT 1 FROM orders WHERE order_id = ?',
+            cursor = self.conn.execute(
+                'SELECT 1 FROM orders WHERE id = ?',
                 (order_id,)
             )
-            exists_in_orders = self.cursor.fetchone() is not None
+            exists_in_orders = cursor.fetchone() is not None
             
             # Проверяем, есть ли заказ во временной таблице
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 'SELECT 1 FROM temp_orders WHERE order_id = ?',
                 (order_id,)
             )
-            exists_in_temp = self.cursor.fetchone() is not None
+            exists_in_temp = cursor.fetchone() is not None
             
             # Обновляем заказ в соответствующей таблице
+            # В orders ключ называется id, в temp_orders - order_id
             if exists_in_orders:
-                table_name = 'orders'
+                table_name, key_column = 'orders', 'id'
             elif exists_in_temp:
-                table_name = 'temp_orders'
+                table_name, key_column = 'temp_orders', 'order_id'
             else:
                 logger.warning(f"Заказ #{order_id} не найден ни в одной таблице")
                 return False
             
             # Составляем запрос для обновления
-            query = f'UPDATE {table_name} SET {field} = ? WHERE order_id = ?'
-            self.cursor.execute(query, (value, order_id))
+            query = f'UPDATE {table_name} SET {field} = ? WHERE {key_column} = ?'
+            cursor = self.conn.execute(query, (value, order_id))
             self.conn.commit()
             
             logger.debug(f"Поле {field} заказа #{order_id} обновлено в таблице {table_name}")
@@ -997,13 +1795,13 @@ class Database:
             True в случае успеха, False в случае ошибки
         """
         try:
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 'DELETE FROM temp_orders WHERE order_id = ?',
                 (order_id,)
             )
             self.conn.commit()
             
-            affected_rows = self.cursor.rowcount
+            affected_rows = cursor.rowcount
             if affected_rows > 0:
                 logger.info(f"Временный заказ #{order_id} успешно удален")
                 return True
@@ -1026,45 +1824,33 @@ class Database:
             ID сохраненного заказа или None в случае ошибки
         """
         try:
-            # Валидация данных
-            if not self._validate_order_data(order_data):
-                logger.warning(f"Некорректные данные заказа: {order_data}")
-                return None
-                
-            # Конвертация типов
-            order_data = self._convert_order_data_types(order_data)
-            
-            # Получаем текущую сессию пользователя
-            session_id = self.get_last_session_id(user_id)
-            
-            # Сохраняем заказ
-            self.cursor.execute(
-                '''
-                INSERT INTO orders 
-                (user_id, session_id, time, address, price, distance, status) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''',
-                (
-                    user_id, 
-                    session_id, 
-                    order_data['time'], 
-                    order_data['address'], 
-                    order_data['price'], 
-                    order_data['distance'],
-                    'pending'
-                )
-            )
-            self.conn.commit()
-            
-            order_id = self.cursor.lastrowid
-            logger.info(f"Заказ #{order_id} успешно сохранен для пользователя {user_id}")
-            return order_id
-            
+            with self.conn as conn:
+                return self._insert_validated_order(conn, user_id, order_data)
         except Exception as e:
             logger.error(f"Ошибка при сохранении заказа: {e}")
-            self.conn.rollback()
             return None
 
+    def _insert_validated_order(self, conn: sqlite3.Connection, user_id: int,
+                                order_data: Dict[str, Any]) -> Optional[int]:
+        """Проверка и вставка заказа в текущую смену без фиксации транзакции"""
+        # Валидация данных
+        if not self._validate_order_data(order_data):
+            logger.warning(f"Некорректные данные заказа: {order_data}")
+            return None
+            
+        # Конвертация типов
+        order_data = self._convert_order_data_types(order_data)
+        
+        # Получаем текущую сессию пользователя
+        cursor = conn.execute(
+            'SELECT session_id FROM sessions WHERE user_id = ? ORDER BY start_time DESC LIMIT 1',
+            (user_id,)
+        )
+        row = cursor.fetchone()
+        session_id = row['session_id'] if row else None
+        
+        return self._insert_order(conn, user_id, session_id, order_data, status='pending')
+
     def get_order_by_id(self, order_id: int) -> Optional[Dict[str, Any]]:
         """
         Получает данные заказа по его ID (ищет сначала в постоянной таблице, потом во временной)
@@ -1077,21 +1863,21 @@ class Database:
         """
         try:
             # Ищем в постоянной таблице
-            self.cursor.execute(
-                'SELECT * FROM orders WHERE order_id = ?',
+            cursor = self.conn.execute(
+                'SELECT * FROM orders WHERE id = ?',
                 (order_id,)
             )
-            order = self.cursor.fetchone()
+            order = cursor.fetchone()
             
             if order:
                 return dict(order)
             
             # Если не нашли, ищем во временной таблице
-            self.cursor.execute(
+            cursor = self.conn.execute(
                 'SELECT * FROM temp_orders WHERE order_id = ?',
                 (order_id,)
             )
-            temp_order = self.cursor.fetchone()
+            temp_order = cursor.fetchone()
             
             if temp_order:
                 return dict(temp_order)
@@ -1102,11 +1888,60 @@ class Database:
             logger.error(f"Ошибка при получении заказа: {e}")
             return None
             
+    def apply_batch(self, writes: List[Tuple[str, tuple, Dict[str, Any]]]) -> List[Any]:
+        """
+        Выполняет группу записей в одной транзакции (один commit на всю группу)
+
+        Каждая запись выполняется в своей точке сохранения, поэтому ошибка
+        одной записи не откатывает остальные.
+
+        Args:
+            writes: Список (имя метода из batched_writes, args, kwargs)
+
+        Returns:
+            Результаты записей в том же порядке (при ошибке - результат по умолчанию,
+            при ошибке валидации - объект ValueError)
+        """
+        conn = self.conn
+        results = []
+        try:
+            conn.execute("BEGIN")
+            for name, args, kwargs in writes:
+                operation, default = self.batched_writes[name]
+                conn.execute("SAVEPOINT batched_write")
+                try:
+                    results.append(getattr(self, operation)(conn, *args, **kwargs))
+                    conn.execute("RELEASE batched_write")
+                except ValueError as e:
+                    # Ошибку валидации получает вызывающий, как и без группировки
+                    conn.execute("ROLLBACK TO batched_write")
+                    conn.execute("RELEASE batched_write")
+                    results.append(e)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO batched_write")
+                    conn.execute("RELEASE batched_write")
+                    logger.error(f"Ошибка при групповой записи {name}: {e}")
+                    results.append(default)
+            conn.commit()
+            logger.debug(f"Группа из {len(writes)} записей зафиксирована")
+            return results
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при фиксации группы записей: {e}")
+            conn.rollback()
+            return [self.batched_writes[name][1] for name, _, _ in writes]
+
     def close(self):
-        """Закрытие соединения с базой данных"""
-        if hasattr(self, 'conn'):
-            self.conn.close()
-            logger.debug("Соединение с базой данных закрыто")
+        """Закрытие всех соединений пула"""
+        if not hasattr(self, '_connections'):
+            return
+        self.flush_user_activity()
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        # Соединения других потоков закрыты, ссылки на них больше не действительны
+        self._local = threading.local()
+        logger.debug("Соединения с базой данных закрыты")
 
     def migrate_database(self):
         """
@@ -1115,23 +1950,20 @@ class Database:
         try:
             logger.info("Начало миграции базы данных")
             
-            with self.conn:
-                # Проверяем версию базы данных
-                self.cursor.execute("PRAGMA user_version")
-                current_version = self.cursor.fetchone()[0]
-                
-                if current_version == 0:
-                    # Первая миграция
-                    self._migrate_to_v1()
-                    self.cursor.execute("PRAGMA user_version = 1")
-                elif current_version == 1:
-                    # Вторая миграция
-                    self._migrate_to_v2()
-                    self.cursor.execute("PRAGMA user_version = 2")
-                elif current_version == 2:
-                    # Третья миграция
-                    self._migrate_to_v3()
-                    self.cursor.execute("PRAGMA user_version = 3")
+            # Проверяем версию базы данных
+            cursor = self.conn.execute("PRAGMA user_version")
+            current_version = cursor.fetchone()[0]
+            
+            # Применяем все недостающие миграции по порядку, каждую в своей транзакции
+            for version, migration in enumerate(self.migrations[current_version:], start=current_version + 1):
+                self.conn.execute("BEGIN")
+                try:
+                    getattr(self, migration)()
+                    self.conn.execute(f"PRAGMA user_version = {version}")
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
                     
             logger.info("Миграция базы данных успешно завершена")
             
@@ -1182,10 +2014,11 @@ class Database:
     def _migrate_to_v2(self):
         """Вторая миграция базы данных"""
         try:
-            # Добавляем новые колонки в таблицу orders
-            self.conn.execute("""
-                ALTER TABLE orders ADD COLUMN status TEXT DEFAULT 'pending'
-            """)
+            # Добавляем новые колонки в таблицу orders (в новых базах она уже есть)
+            if not self._column_exists('orders', 'status'):
+                self.conn.execute("""
+                    ALTER TABLE orders ADD COLUMN status TEXT DEFAULT 'pending'
+                """)
             
             # Создаем индексы для оптимизации
             self.conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
@@ -1241,9 +2074,10 @@ class Database:
             self.conn.execute("ALTER TABLE sessions_new RENAME TO sessions")
             
             # Добавляем колонку session_id в таблицу orders
-            self.conn.execute("""
-                ALTER TABLE orders ADD COLUMN session_id INTEGER REFERENCES sessions(session_id)
-            """)
+            if not self._column_exists('orders', 'session_id'):
+                self.conn.execute("""
+                    ALTER TABLE orders ADD COLUMN session_id INTEGER REFERENCES sessions(session_id)
+                """)
             
             logger.info("Миграция к версии 3 завершена")
             
@@ -1251,10 +2085,337 @@ class Database:
             logger.error(f"Ошибка при миграции к версии 3: {e}")
             raise
 
+    def _migrate_to_v4(self):
+        """Четвертая миграция: сводная статистика пользователей, поддерживаемая триггерами"""
+        try:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_stats (
+                    user_id INTEGER PRIMARY KEY,
+                    total_shifts INTEGER NOT NULL DEFAULT 0,
+                    total_earnings REAL NOT NULL DEFAULT 0,
+                    earnings_count INTEGER NOT NULL DEFAULT 0,
+                    total_orders INTEGER NOT NULL DEFAULT 0,
+                    orders_count INTEGER NOT NULL DEFAULT 0,
+                    total_hours REAL NOT NULL DEFAULT 0,
+                    hours_count INTEGER NOT NULL DEFAULT 0,
+                    max_earnings REAL,
+                    min_earnings REAL
+                )
+            """)
+            
+            # Триггеры обновляют сводку в той же транзакции, что и изменение смены
+            self.conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_sessions_stats_insert AFTER INSERT ON sessions
+                BEGIN
+                    {self._user_stats_add_sql('NEW')}
+                END
+            """)
+            self.conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_sessions_stats_update AFTER UPDATE ON sessions
+                BEGIN
+                    {self._user_stats_subtract_sql('OLD')}
+                    {self._user_stats_add_sql('NEW')}
+                END
+            """)
+            self.conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_sessions_stats_delete AFTER DELETE ON sessions
+                BEGIN
+                    {self._user_stats_subtract_sql('OLD')}
+                END
+            """)
+            
+            # Заполняем сводку по уже существующим сменам
+            self._rebuild_user_stats(self.conn)
+            
+            logger.info("Миграция к версии 4 завершена")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при миграции к версии 4: {e}")
+            raise
+
+    def _migrate_to_v5(self):
+        """Пятая миграция: хранимая длительность смены и покрывающий индекс"""
+        try:
+            # Длительность считается при записи и хранится в индексе, а не в каждом запросе
+            if not self._column_exists('sessions', 'duration_hours'):
+                self.conn.execute("""
+                    ALTER TABLE sessions ADD COLUMN duration_hours REAL
+                    GENERATED ALWAYS AS ((julianday(end_time) - julianday(start_time)) * 24) VIRTUAL
+                """)
+            
+            # Последние смены и итоги пользователя читаются только из индекса
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_sessions_user_start ON sessions(
+                    user_id, start_time DESC, end_time, duration_hours,
+                    earnings, order_count, service, weather, created_at
+                )
+            """)
+            
+            # Индекс по user_id стал префиксом нового индекса
+            self.conn.execute("DROP INDEX IF EXISTS idx_sessions_user_id")
+            
+            logger.info("Миграция к версии 5 завершена")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при миграции к версии 5: {e}")
+            raise
+
+    def _migrate_to_v6(self):
+        """Шестая миграция: ключ вопроса для кэша ответов ИИ"""
+        try:
+            if not self._column_exists('ai_advice', 'question_key'):
+                self.conn.execute("ALTER TABLE ai_advice ADD COLUMN question_key TEXT")
+            
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_ai_advice_cache
+                ON ai_advice(advice_type, question_key, created_at)
+            """)
+            
+            logger.info("Миграция к версии 6 завершена")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при миграции к версии 6: {e}")
+            raise
+
+    def _migrate_to_v7(self):
+        """Седьмая миграция: дневные счетчики вопросов к ИИ"""
+        try:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS ai_quota (
+                    user_id INTEGER NOT NULL,
+                    day TEXT NOT NULL,
+                    used INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, day)
+                ) WITHOUT ROWID
+            """)
+            
+            logger.info("Миграция к версии 7 завершена")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при миграции к версии 7: {e}")
+            raise
+
+    def _migrate_to_v8(self):
+        """Восьмая миграция: хранилище состояний FSM"""
+        try:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT,
+                    updated_at REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at)")
+            
+            logger.info("Миграция к версии 8 завершена")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при миграции к версии 8: {e}")
+            raise
+
+    def _migrate_to_v9(self):
+        """Девятая миграция: индексы по результатам аудита планов запросов (tools/query_audit.py)"""
+        try:
+            # Столбец user_id раньше добавлялся только после миграций
+            if not self._column_exists('users', 'user_id'):
+                self.conn.execute("ALTER TABLE users ADD COLUMN user_id INTEGER")
+            # get_or_create_user, get_user_service и остальные ищут пользователя по user_id
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_user_id ON users(user_id)")
+            
+            # Списки заказов и советов пользователя отсортированы по времени - без временного B-дерева
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at)")
+            self.conn.execute("DROP INDEX IF EXISTS idx_orders_user_id")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_session_created ON orders(session_id, created_at)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_advice_user_created ON ai_advice(user_id, created_at)")
+            
+            logger.info("Миграция к версии 9 завершена")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при миграции к версии 9: {e}")
+            raise
+
+    def _migrate_to_v10(self):
+        """Десятая миграция: распределения дохода в час по сервисам и часам (services/benchmarks.py)"""
+        try:
+            # quantiles - JSON-массив из 101 точки (перцентили 0..100) по всем курьерам
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_benchmarks (
+                    scope TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    quantiles TEXT NOT NULL,
+                    sample_size INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (scope, key, metric)
+                ) WITHOUT ROWID
+            """)
+            
+            logger.info("Миграция к версии 10 завершена")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при миграции к версии 10: {e}")
+            raise
+
+    def _migrate_to_v11(self):
+        """Одиннадцатая миграция: час и день недели заказов и смен для разбивок по времени"""
+        try:
+            # Столбцы вычисляются SQLite при вставке и изменении строки, как duration_hours;
+            # weekday в нумерации strftime('%w'): 0 - воскресенье
+            time_columns = {
+                'orders': ("CAST(strftime('%H', time) AS INTEGER)", "CAST(strftime('%w', created_at) AS INTEGER)"),
+                'sessions': ("CAST(strftime('%H', start_time) AS INTEGER)", "CAST(strftime('%w', start_time) AS INTEGER)"),
+            }
+            for table, (hour_expression, weekday_expression) in time_columns.items():
+                if not self._column_exists(table, 'hour_bucket'):
+                    self.conn.execute(
+                        f"ALTER TABLE {table} ADD COLUMN hour_bucket INTEGER GENERATED ALWAYS AS ({hour_expression}) VIRTUAL"
+                    )
+                if not self._column_exists(table, 'weekday'):
+                    self.conn.execute(
+                        f"ALTER TABLE {table} ADD COLUMN weekday INTEGER GENERATED ALWAYS AS ({weekday_expression}) VIRTUAL"
+                    )
+            
+            # Индекс хранит вычисленные значения: его создание заполняет их для существующих строк,
+            # и разбивки get_detailed_statistics читаются только из индекса
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_weekday_hour ON orders(user_id, weekday, hour_bucket)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_weekday_hour ON sessions(user_id, weekday, hour_bucket)")
+            
+            logger.info("Миграция к версии 11 завершена")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при миграции к версии 11: {e}")
+            raise
+
+    def _migrate_to_v12(self):
+        """Двенадцатая миграция: аренда пересчета rate_benchmarks между процессами"""
+        try:
+            # Одна строка: когда какой-то процесс последним взялся пересчитывать распределения
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_benchmarks_lease (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    claimed_at REAL NOT NULL
+                )
+            """)
+            
+            logger.info("Миграция к версии 12 завершена")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при миграции к версии 12: {e}")
+            raise
+
+    @staticmethod
+    def _user_stats_add_sql(row: str) -> str:
+        """SQL для триггера: добавляет вклад завершенной смены row (NEW) в user_stats"""
+        hours = f"(julianday({row}.end_time) - julianday({row}.start_time)) * 24"
+        return f"""
+            INSERT INTO user_stats (
+                user_id, total_shifts, total_earnings, earnings_count, total_orders, orders_count,
+                total_hours, hours_count, max_earnings, min_earnings
+            )
+            SELECT
+                {row}.user_id, 1,
+                COALESCE({row}.earnings, 0), {row}.earnings IS NOT NULL,
+                COALESCE({row}.order_count, 0), {row}.order_count IS NOT NULL,
+                COALESCE({hours}, 0), {hours} IS NOT NULL,
+                {row}.earnings, {row}.earnings
+            WHERE {row}.user_id IS NOT NULL AND {row}.end_time IS NOT NULL
+            ON CONFLICT(user_id) DO UPDATE SET
+                total_shifts = total_shifts + 1,
+                total_earnings = total_earnings + excluded.total_earnings,
+                earnings_count = earnings_count + excluded.earnings_count,
+                total_orders = total_orders + excluded.total_orders,
+                orders_count = orders_count + excluded.orders_count,
+                total_hours = total_hours + excluded.total_hours,
+                hours_count = hours_count + excluded.hours_count,
+                max_earnings = COALESCE(MAX(max_earnings, excluded.max_earnings), max_earnings, excluded.max_earnings),
+                min_earnings = COALESCE(MIN(min_earnings, excluded.min_earnings), min_earnings, excluded.min_earnings);
+        """
+
+    @staticmethod
+    def _user_stats_subtract_sql(row: str) -> str:
+        """SQL для триггера: убирает вклад смены row (OLD) из user_stats"""
+        hours = f"(julianday({row}.end_time) - julianday({row}.start_time)) * 24"
+        return f"""
+            UPDATE user_stats SET
+                total_shifts = total_shifts - 1,
+                total_earnings = total_earnings - COALESCE({row}.earnings, 0),
+                earnings_count = earnings_count - ({row}.earnings IS NOT NULL),
+                total_orders = total_orders - COALESCE({row}.order_count, 0),
+                orders_count = orders_count - ({row}.order_count IS NOT NULL),
+                total_hours = total_hours - COALESCE({hours}, 0),
+                hours_count = hours_count - ({hours} IS NOT NULL)
+            WHERE user_id = {row}.user_id AND {row}.end_time IS NOT NULL;
+            
+            UPDATE user_stats SET
+                max_earnings = (
+                    SELECT MAX(earnings) FROM sessions
+                    WHERE user_id = {row}.user_id AND end_time IS NOT NULL
+                ),
+                min_earnings = (
+                    SELECT MIN(earnings) FROM sessions
+                    WHERE user_id = {row}.user_id AND end_time IS NOT NULL
+                )
+            WHERE user_id = {row}.user_id AND {row}.end_time IS NOT NULL
+                AND ({row}.earnings >= max_earnings OR {row}.earnings <= min_earnings);
+        """
+
+    def rebuild_user_stats(self, user_id: Optional[int] = None) -> bool:
+        """
+        Пересчитывает сводную статистику по таблице sessions
+        
+        Args:
+            user_id: ID пользователя (если None, то для всех)
+            
+        Returns:
+            True в случае успеха, False в случае ошибки
+        """
+        try:
+            with self.conn as conn:
+                self._rebuild_user_stats(conn, user_id)
+            logger.info(f"Сводная статистика пересчитана (пользователь: {user_id or 'все'})")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при пересчете сводной статистики: {e}")
+            return False
+
+    def _rebuild_user_stats(self, conn: sqlite3.Connection, user_id: Optional[int] = None):
+        """Пересчет сводной статистики без фиксации транзакции"""
+        if self._column_exists('sessions', 'duration_hours'):
+            hours = "duration_hours"
+        else:
+            hours = "(julianday(end_time) - julianday(start_time)) * 24"
+        user_filter = "AND user_id = ?" if user_id is not None else ""
+        params = (user_id,) if user_id is not None else ()
+        
+        conn.execute(f"DELETE FROM user_stats WHERE 1 = 1 {user_filter}", params)
+        conn.execute(f"""
+            INSERT INTO user_stats (
+                user_id, total_shifts, total_earnings, earnings_count, total_orders, orders_count,
+                total_hours, hours_count, max_earnings, min_earnings
+            )
+            SELECT
+                user_id, COUNT(*),
+                COALESCE(SUM(earnings), 0), COUNT(earnings),
+                COALESCE(SUM(order_count), 0), COUNT(order_count),
+                COALESCE(SUM({hours}), 0), COUNT({hours}),
+                MAX(earnings), MIN(earnings)
+            FROM sessions
+            WHERE user_id IS NOT NULL AND end_time IS NOT NULL {user_filter}
+            GROUP BY user_id
+        """, params)
+
+    def _column_exists(self, table: str, column: str) -> bool:
+        """Проверяет наличие колонки в таблице (включая генерируемые, их не видно в table_info)"""
+        cursor = self.conn.execute(f"PRAGMA table_xinfo({table})")
+        return any(row['name'] == column for row in cursor.fetchall())
+
     def add_user_id_column(self):
         """Добавляет столбец user_id в таблицу users"""
+        if self._column_exists('users', 'user_id'):
+            return
         try:
-            self.cursor.execute("ALTER TABLE users ADD COLUMN user_id INTEGER;")
+            self.conn.execute("ALTER TABLE users ADD COLUMN user_id INTEGER;")
             self.conn.commit()
             logger.info("Столбец user_id успешно добавлен в таблицу users")
         except sqlite3.Error as e:
@@ -1282,4 +2443,186 @@ class Database:
             logger.info("Обновление существующих пользователей завершено")
             
         except Exception as e:
-            logger.error(f"Ошибка при обновлении существующих пользователей: {e}")
\ No newline at end of file
+            logger.error(f"Ошибка при обновлении существующих пользователей: {e}")
+
+
+class AsyncDatabase:
+    """
+    Асинхронная обертка над Database.
+
+    Все методы Database доступны как awaitable: запросы выполняются
+    в пуле потоков базы данных, поэтому event loop бота не блокируется на диске.
+    У каждого потока пула свое соединение, читатели не ждут писателей (WAL).
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(AsyncDatabase, cls).__new__(cls)
+            return cls._instance
+
+    def __init__(self, database: Optional[Database] = None):
+        """
+        Args:
+            database: Синхронная база данных (по умолчанию общий экземпляр Database)
+        """
+        if hasattr(self, 'initialized'):
+            return
+
+        self.database = database or Database()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.database.pool_size,
+            thread_name_prefix="database"
+        )
+        self._batcher: Optional[WriteBatcher] = None
+        self._activity_task: Optional[asyncio.Task] = None
+        self.initialized = True
+
+    def enable_group_commit(self, max_delay_ms: float = 50, max_batch: int = 100):
+        """
+        Включает групповую фиксацию записей из Database.batched_writes
+
+        Args:
+            max_delay_ms: Максимальное время ожидания группы
+            max_batch: Максимальный размер группы
+        """
+        self._batcher = WriteBatcher(self, max_delay_ms, max_batch)
+        logger.info(f"Групповая фиксация включена: {max_delay_ms} мс / {max_batch} записей")
+
+    def start_activity_flush(self):
+        """
+        Запускает периодическую запись отложенных обновлений last_active
+
+        Без нее обновления записывались бы только при следующем обращении
+        после activity_flush_interval или при закрытии базы.
+        """
+        if self._activity_task is None or self._activity_task.done():
+            self._activity_task = asyncio.get_running_loop().create_task(self._flush_activity_periodically())
+
+    async def _flush_activity_periodically(self):
+        while True:
+            await asyncio.sleep(self.database.activity_flush_interval)
+            try:
+                await self.run(self.database.flush_user_activity)
+            except Exception as e:
+                logger.error(f"Ошибка при записи времени активности: {e}")
+
+    def __getattr__(self, name: str) -> Any:
+        # Приватные атрибуты и не до конца созданный объект не проксируем
+        if name.startswith('_') or 'database' not in self.__dict__:
+            raise AttributeError(name)
+
+        attr = getattr(self.database, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            with db_call_duration.time(method=name):
+                if self._batcher is not None and name in self.database.batched_writes:
+                    return await self._batcher.submit(name, args, kwargs)
+                return await self.run(attr, *args, **kwargs)
+
+        return wrapper
+
+    async def run(self, func, *args, **kwargs) -> Any:
+        """
+        Выполняет синхронную функцию в потоке базы данных
+
+        Args:
+            func: Функция, работающая с базой данных
+            *args, **kwargs: Аргументы функции
+
+        Returns:
+            Результат функции
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def close(self):
+        """Останавливает пул потоков и закрывает все соединения"""
+        if self._activity_task is not None:
+            self._activity_task.cancel()
+            self._activity_task = None
+        if self._batcher is not None:
+            await self._batcher.flush()
+        self._executor.shutdown(wait=True)
+        self.database.close()
+
+
+class WriteBatcher:
+    """
+    Очередь групповой фиксации записей.
+
+    Записи копятся до max_batch штук или max_delay_ms миллисекунд и
+    фиксируются одной транзакцией; каждый вызывающий получает свой результат.
+    """
+
+    def __init__(self, database: AsyncDatabase, max_delay_ms: float = 50, max_batch: int = 100):
+        self.database = database
+        self.max_delay = max_delay_ms / 1000
+        self.max_batch = max_batch
+        self._pending: List[Tuple[str, tuple, Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+
+    async def submit(self, name: str, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        """
+        Ставит запись в очередь и ждет фиксации ее группы
+
+        Args:
+            name: Имя метода из Database.batched_writes
+            args, kwargs: Аргументы метода
+
+        Returns:
+            Результат метода (например, ID созданной записи)
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((name, args, kwargs, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._schedule_flush)
+
+        return await future
+
+    def _schedule_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._flush_batch(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush_batch(self, batch: List[Tuple[str, tuple, Dict[str, Any], asyncio.Future]]):
+        writes = [(name, args, kwargs) for name, args, kwargs, _ in batch]
+        try:
+            results = await self.database.run(self.database.database.apply_batch, writes)
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (*_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, ValueError):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def flush(self):
+        """Фиксирует все ожидающие записи"""
+        self._schedule_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
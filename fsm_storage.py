@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from database import AsyncDatabase
+from services.metrics import fsm_operations
+
+# Persistent FSM storage on the bot database with an in-process hot cache.
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в базе бота.
+
+    Состояния переживают перезапуск и доступны нескольким процессам.
+    Чтения обслуживает кэш в памяти. Переход в другое состояние (set_state)
+    записывается в базу сразу, а изменения данных (set_data, update_data)
+    копятся в памяти и раз в write_delay записываются одной транзакцией
+    (write-behind); остаток записывается в close(). Кэш корректен, пока все
+    апдейты одного пользователя обрабатывает один процесс (см. распределение
+    по user_id между воркерами).
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        ttl: float = 24 * 3600,
+        cache_size: int = 10000,
+        purge_interval: float = 3600,
+        write_delay: float = 1,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        """
+        Args:
+            db: База данных
+            ttl: Через сколько секунд без изменений состояние считается брошенным
+            cache_size: Максимум записей в кэше
+            purge_interval: Как часто (сек) удалять брошенные состояния из базы
+            write_delay: Через сколько секунд записывать накопленные изменения данных
+            key_builder: Построитель ключей (по умолчанию bot:chat:user)
+        """
+        self.db = db
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.purge_interval = purge_interval
+        self.write_delay = write_delay
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache: OrderedDict = OrderedDict()  # ключ -> (state, data, updated_at)
+        self._last_purge = time.monotonic()
+        self._purge_task: Optional[asyncio.Task] = None
+        # Изменения, еще не записанные в базу, и записываемые прямо сейчас
+        self._dirty: Dict[str, Tuple[Optional[str], Dict[str, Any], float]] = {}
+        self._writing: Dict[str, Tuple[Optional[str], Dict[str, Any], float]] = {}
+        self._write_lock = asyncio.Lock()
+        self._write_timer: Optional[asyncio.TimerHandle] = None
+        self._write_task: Optional[asyncio.Task] = None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        storage_key = self.key_builder.build(key)
+        _, data, _ = await self._load(storage_key)
+        self._save(storage_key, state, data)
+        # Переход между шагами сценария не должен потеряться: пишем сразу вместе с накопленным
+        await self.flush()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        state, _, _ = await self._load(storage_key)
+        self._save(storage_key, state, dict(data))
+        self._schedule_write()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data, _ = await self._load(self.key_builder.build(key))
+        return dict(data)
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._purge_task is not None and not self._purge_task.done():
+            await self._purge_task
+        self._cache.clear()
+
+    async def _load(self, storage_key: str) -> Tuple[Optional[str], Dict[str, Any], float]:
+        """Запись из кэша или из базы"""
+        record = self._cache.get(storage_key)
+        if record is None:
+            # Вытесненная из кэша запись может быть еще не записана в базу
+            record = self._dirty.get(storage_key) or self._writing.get(storage_key)
+            if record is not None:
+                self._remember(storage_key, record)
+        fsm_operations.inc(operation='read', source='database' if record is None else 'cache')
+        if record is None:
+            row = await self.db.get_fsm_record(storage_key)
+            if row is None:
+                record = (None, {}, time.time())
+            else:
+                record = (row['state'], json.loads(row['data']) if row['data'] else {}, row['updated_at'])
+            self._remember(storage_key, record)
+        else:
+            self._cache.move_to_end(storage_key)
+
+        state, data, updated_at = record
+        if (state is not None or data) and time.time() - updated_at > self.ttl:
+            # Брошенный разговор начинается заново
+            return None, {}, updated_at
+        return record
+
+    def _save(self, storage_key: str, state: Optional[str], data: Dict[str, Any]):
+        """Сохраняет запись в кэш и отмечает ее для записи в базу"""
+        record = (state, data, time.time())
+        self._remember(storage_key, record)
+        self._dirty[storage_key] = record
+        fsm_operations.inc(operation='write', source='cache')
+        self._schedule_purge()
+
+    async def flush(self):
+        """Записывает накопленные изменения в базу одной транзакцией"""
+        if self._write_timer is not None:
+            self._write_timer.cancel()
+            self._write_timer = None
+
+        # Записи идут по очереди: более старая пачка не перетрет более новую
+        async with self._write_lock:
+            if not self._dirty:
+                return
+            self._writing, self._dirty = self._dirty, {}
+            # Компактная сериализация: без пробелов и \u-экранирования кириллицы
+            records = [
+                (storage_key, state,
+                 json.dumps(data, ensure_ascii=False, separators=(',', ':')) if data else None)
+                for storage_key, (state, data, _) in self._writing.items()
+            ]
+            saved = False
+            try:
+                saved = await self.db.set_fsm_records(records)
+            finally:
+                writing, self._writing = self._writing, {}
+                if not saved:
+                    # Запись не удалась или прервана (отмена, остановка пула) - вернем в очередь,
+                    # не затирая более новые изменения
+                    for storage_key, record in writing.items():
+                        self._dirty.setdefault(storage_key, record)
+
+            if not saved:
+                self._schedule_write()
+                return
+            fsm_operations.inc(len(records), operation='write', source='database')
+
+    def _schedule_write(self):
+        if self._write_timer is None and self._dirty:
+            self._write_timer = asyncio.get_running_loop().call_later(self.write_delay, self._start_write)
+
+    def _start_write(self):
+        self._write_timer = None
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.get_running_loop().create_task(self._write_safely())
+        else:
+            # Предыдущая запись еще идет: попробуем после нее
+            self._schedule_write()
+
+    async def _write_safely(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Ошибка при записи состояний FSM: {e}")
+
+    def _remember(self, storage_key: str, record: Tuple[Optional[str], Dict[str, Any], float]):
+        self._cache[storage_key] = record
+        self._cache.move_to_end(storage_key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _schedule_purge(self):
+        if time.monotonic() - self._last_purge < self.purge_interval:
+            return
+        if self._purge_task is not None and not self._purge_task.done():
+            return
+        self._last_purge = time.monotonic()
+        self._purge_task = asyncio.get_running_loop().create_task(self.purge_expired())
+
+    async def purge_expired(self) -> int:
+        """
+        Удаляет брошенные состояния из базы и кэша
+
+        Returns:
+            Количество удаленных записей в базе
+        """
+        deadline = time.time() - self.ttl
+        for storage_key in [k for k, (_, _, updated_at) in self._cache.items() if updated_at < deadline]:
+            del self._cache[storage_key]
+        return await self.db.delete_expired_fsm_records(self.ttl)
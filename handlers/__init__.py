@@ -3,11 +3,16 @@ from .calllbacks import router as callbacks_router
 from .general import router as general_router
 from .ai_advice import router as ai_advice_router
 from .session import router as session_router
+from .history import router as history_router
+from .metrics import router as metrics_router, HandlerMetricsMiddleware
 
 __all__ = [
     'commands_router',
     'callbacks_router',
     'general_router',
     'ai_advice_router',
-    'session_router'
+    'session_router',
+    'history_router',
+    'metrics_router',
+    'HandlerMetricsMiddleware'
 ]
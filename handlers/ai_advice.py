@@ -1,14 +1,22 @@
-import requests
+import asyncio
+import contextlib
 import logging
 from dotenv import load_dotenv
 import os
 import random
+import time
 from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from keyboards.inline import get_ai_advice_topics_keyboard, get_back_keyboard
-from database import Database
+from database import AsyncDatabase
+from services.gemini import GeminiClient, GeminiError, gemini_client
+from services.advice_cache import AdviceCache, advice_cache, normalize_question
+from services.question_classifier import QuestionClassifier, question_classifier
+from services.quota import QuotaService, quota_service
+from services.singleflight import SingleFlight
 
 # Full AI advice callbacks and functional (request in class)
 load_dotenv()
@@ -17,14 +25,20 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 router = Router()
-db = Database()
+db = AsyncDatabase()
 
 class AIAdviceStates(StatesGroup):
     waiting_for_advice_question = State()
 
 # Main prompt and answer.
 class AIAdviceHandler:
-    def __init__(self):
+    def __init__(
+        self,
+        client: GeminiClient = gemini_client,
+        cache: AdviceCache = advice_cache,
+        classifier: QuestionClassifier = question_classifier,
+        quota: QuotaService = quota_service
+    ):
         # Шаблоны промптов
         self.prompts = [
             "Ты - встроен в тг бота для помощи курьерам в Бишкеке. Помоги юзеру в том, что он просит и задай вопрос, позволяющий оптимизировать заработок и дай статистику. Если вопрос не о курьерстве, верни: 'Этот вопрос не касается курьерства.' Отвечай НЕ БОЛЕЕ 1000-1200 символов! Prompt:",
@@ -33,24 +47,36 @@ class AIAdviceHandler:
             "Ты - встроен в тг бота для помощи курьерам в Бишкеке. Ты механик во всех видах транспорта. Помоги по максимуму оптимизировать юзеру транспорт для курьерки - дай все нужные советы и тонкости. Если вопрос не о курьерстве, верни: 'Этот вопрос не касается курьерства.' Отвечай НЕ БОЛЕЕ 1000-1200 символов! Вопрос юзера:"
         ]
         
-        # Ограничения
-        self.max_questions_per_day = 6
+        # Ограничения (дневная квота общая для всех процессов, см. QuotaService)
         self.max_characters_per_prompt = 120
-        self.questions_today = 0
 
-        # Инициализация API-ключа
-        self.api_key = os.getenv('GEMINI_API_KEY')
-        if not self.api_key:
+        # Общий HTTP-клиент Gemini, кэш готовых ответов и квота
+        self.client = client
+        self.cache = cache
+        self.classifier = classifier
+        self.quota = quota
+        # Потоковые ответы с постепенным редактированием сообщения (GEMINI_STREAMING=1)
+        self.streaming = os.getenv('GEMINI_STREAMING') == '1'
+        # Одинаковые вопросы, заданные одновременно, ждут один запрос к Gemini
+        self.inflight = SingleFlight(max_waiters=50)
+        if not self.client.api_key:
             logger.error("API ключ не найден. Убедитесь, что он указан в .env файле.")
             raise ValueError("API ключ не найден.")
 
-    async def get_advice(self, user_question, selected_topic):
-        if self.questions_today >= self.max_questions_per_day:
-            return "Превышено количество вопросов на сегодня. 6 в сутки."
-
+    async def get_advice(self, user_question, selected_topic, user_id=None, on_partial=None):
         if len(user_question) > self.max_characters_per_prompt:
             return "Вопрос превышает максимальное количество символов (120)."
 
+        # Вопросы не о курьерстве отсекаем локально, без запроса к API
+        if not self.classifier.is_courier_question(user_question):
+            logger.info(f"Вопрос отклонен локальным классификатором: {user_question}")
+            return "Этот вопрос не касается курьерства."
+
+        # Готовый ответ на такой же или похожий вопрос не тратит квоту и запрос к API
+        cached_advice = await self.cache.get(selected_topic, user_question)
+        if cached_advice:
+            return cached_advice
+
         # Выбор шаблона в зависимости от топика.
         if selected_topic == "legal":
             prompt_template = self.prompts[1]  # Первый шаблон
@@ -63,49 +89,124 @@ class AIAdviceHandler:
         else:
             return "Неизвестный топик."
 
+        # Списываем вопрос из дневной квоты пользователя
+        quota_key = None
+        if user_id is not None:
+            quota_key = await self.quota.try_consume(user_id)
+            if quota_key is None:
+                return f"Превышено количество вопросов на сегодня. {self.quota.daily_limit} в сутки."
+
         # Формирование полного промпта
         full_prompt = f"{prompt_template}\nВопрос: {user_question}"
 
-        # Здесь будет логика для получения совета от Gemini
+        # Получаем совет от Gemini
         try:
-            response = requests.post(
-                f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent',
-                headers={
-                    'Content-Type': 'application/json',
-                    'x-goog-api-key': self.api_key
-                },
-                json={
-                    "contents": [{
-                        "parts": [{
-                            "text": full_prompt
-                        }]
-                    }]
-                }
+            advice, shared = await self.inflight.do(
+                (selected_topic, normalize_question(user_question)),
+                lambda: self._request_advice(full_prompt, on_partial, user_id, selected_topic, user_question)
             )
-            response.raise_for_status()  # Проверка на ошибки HTTP
-            self.questions_today += 1  # Увеличиваем счетчик вопросов
-            
-            response_data = response.json()
-            if 'candidates' not in response_data or not response_data['candidates']:
-                logger.warning("Ответ не содержит candidates")
-                return 'Совет не найден'
-                
-            advice = response_data['candidates'][0]['content']['parts'][0]['text']
             
             if not advice:
                 logger.warning("Пустой ответ от нейронной сети")
+                self._release_quota(quota_key)
                 return 'Совет не найден'
             
-            logger.info(f"Ответ от нейронной сети: {advice}")
+            if shared:
+                # Ответ получен чужим запросом - как из кэша, квота не тратится
+                self._release_quota(quota_key)
             return advice
             
-        except requests.exceptions.HTTPError as http_err:
-            logger.error(f"HTTP ошибка: {http_err}")
+        except GeminiError as api_err:
+            logger.error(f"Ошибка API: {api_err}")
+            self._release_quota(quota_key)
             return "Произошла ошибка при запросе к API."
+        except asyncio.CancelledError:
+            # Обработчик остановлен (например, при завершении бота): вопрос не задан
+            self._release_quota(quota_key)
+            raise
         except Exception as e:
             logger.error(f"Ошибка при получении совета: {e}")
+            self._release_quota(quota_key)
             return "Произошла ошибка при получении совета."
-        
+
+    async def _request_advice(self, full_prompt, on_partial, user_id, selected_topic, user_question):
+        if self.streaming and on_partial is not None:
+            advice = await self._stream_advice(full_prompt, on_partial)
+        else:
+            advice = await self.client.generate(full_prompt)
+
+        if advice:
+            logger.info(f"Ответ от нейронной сети: {advice}")
+            await self.cache.put(user_id, selected_topic, user_question, advice)
+        return advice
+
+    async def _stream_advice(self, full_prompt, on_partial):
+        # Каждый фрагмент сразу передаем дальше, текст целиком нужен для кэша.
+        # aclosing: если on_partial упадет, поток сразу освободит слот клиента и HTTP-ответ
+        advice = ''
+        async with contextlib.aclosing(self.client.stream(full_prompt)) as chunks:
+            async for chunk in chunks:
+                advice += chunk
+                await on_partial(advice)
+        return advice or None
+
+    def _release_quota(self, quota_key):
+        # Неудачный запрос не должен расходовать квоту
+        if quota_key is not None:
+            self.quota.release(quota_key)
+
+
+class ProgressiveMessage:
+    """
+    Сообщение, которое дописывается по мере прихода ответа.
+
+    Правки идут не чаще min_interval секунд (лимиты Telegram на редактирование),
+    первая - сразу. Промежуточный текст, не успевший попасть в сообщение,
+    показывается финальной правкой.
+    """
+
+    max_length = 4096
+
+    def __init__(self, message: Message, min_interval: float = 1.0):
+        self.message = message
+        self.min_interval = min_interval
+        self._shown_text = message.text
+        self._next_edit_at = 0.0
+
+    async def update(self, text: str):
+        if time.monotonic() >= self._next_edit_at:
+            await self._edit(text + " ▌")
+
+    async def finish(self, text: str):
+        self._next_edit_at = 0.0
+        await self._edit(text)
+
+    async def _edit(self, text: str):
+        text = text[:self.max_length]
+        if text == self._shown_text:
+            return
+        try:
+            await self.message.edit_text(text)
+            self._shown_text = text
+            self._next_edit_at = time.monotonic() + self.min_interval
+        except TelegramRetryAfter as e:
+            # Telegram просит подождать - пропускаем промежуточные правки
+            self._next_edit_at = time.monotonic() + e.retry_after
+        except TelegramBadRequest as e:
+            logger.warning(f"Не удалось обновить сообщение: {e}")
+
+
+_advice_handler = None
+
+
+def get_advice_handler() -> AIAdviceHandler:
+    """Общий обработчик советов (создается при первом вопросе)"""
+    global _advice_handler
+    if _advice_handler is None:
+        _advice_handler = AIAdviceHandler()
+    return _advice_handler
+
+
 # Callbacks, waiting for advice question state.
 @router.callback_query(F.data == "ai_advice")
 async def process_ai_advice(callback: CallbackQuery):
@@ -152,20 +253,36 @@ async def process_advice_question(message: Message, state: FSMContext):
         user_data = await state.get_data()
         selected_topic = user_data.get('selected_topic')
         
+        if not selected_topic:
+            # Пробуем определить тему по самому вопросу
+            selected_topic = question_classifier.suggest_topic(message.text)
+        
         if not selected_topic:
             await message.answer("Пожалуйста, выберите тему перед тем, как задавать вопрос.")
             return
         
-        advice_handler = AIAdviceHandler()
-        advice = await advice_handler.get_advice(message.text, selected_topic)
-        
-        if not advice:
-            await message.answer("Не удалось получить ответ. Попробуйте позже.")
+        advice_handler = get_advice_handler()
+        if advice_handler.streaming:
+            # Заглушка появляется сразу, ответ дописывается в нее по мере генерации
+            placeholder = await message.answer("🤖 Думаю над ответом...")
+            progress = ProgressiveMessage(placeholder)
+            advice = await advice_handler.get_advice(
+                message.text, selected_topic, message.from_user.id, on_partial=progress.update
+            )
+            await progress.finish(advice or "Не удалось получить ответ. Попробуйте позже.")
             await state.clear()
-            return
+            if not advice:
+                return
+        else:
+            advice = await advice_handler.get_advice(message.text, selected_topic, message.from_user.id)
             
-        await message.answer(advice)
-        await state.clear()
+            if not advice:
+                await message.answer("Не удалось получить ответ. Попробуйте позже.")
+                await state.clear()
+                return
+                
+            await message.answer(advice)
+            await state.clear()
         
         await message.answer(
             "🤖 Хотите задать еще один вопрос? Выберите тему:",
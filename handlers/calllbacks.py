@@ -1,14 +1,19 @@
 import logging
-from typing import Any
+from typing import Any, Dict, Optional, Sequence
+import numpy as np
 from aiogram import Router, F, types
 from aiogram.fsm.context import FSMContext
 from keyboards.inline import (
     get_main_menu_keyboard,
     get_service_keyboard,
     get_back_keyboard,
-    get_ai_advice_topics_keyboard
+    get_ai_advice_topics_keyboard,
+    get_profile_keyboard
 )
-from database import Database
+from database import AsyncDatabase
+from services.statistics import calculate_user_statistics, best_time_slots
+from services.benchmarks import rate_benchmarks
+from .session import service_names
 from .states import SessionStates, AIAdviceStates
 
 # Main buttons handler right here.
@@ -16,7 +21,7 @@ logger = logging.getLogger(__name__)
 
 # Router and database.
 router = Router()
-db = Database()
+db = AsyncDatabase()
 
 
 @router.callback_query(F.data == "ai_advice")
@@ -114,8 +119,8 @@ async def handle_service_selection(callback: types.CallbackQuery):
         
         user_id = callback.from_user.id
         username = callback.from_user.username
-        user = db.get_or_create_user(user_id, username=username)
-        db.update_user_service(user_id, selected_service_key)
+        user = await db.get_or_create_user(user_id, username=username)
+        await db.update_user_service(user_id, selected_service_key)
         
         await callback.message.edit_text(
             f"✅ Сервис успешно изменен на: {selected_service_name}",
@@ -137,7 +142,7 @@ async def show_profile(callback: types.CallbackQuery):
     try:
         user_id = callback.from_user.id
         username = callback.from_user.username
-        user = db.get_or_create_user(user_id, username=username)
+        user = await db.get_or_create_user(user_id, username=username)
         
         if not user:
             await callback.message.edit_text(
@@ -147,7 +152,7 @@ async def show_profile(callback: types.CallbackQuery):
             )
             return
             
-        stats = db.get_user_statistics(user_id)
+        stats = await db.get_user_statistics(user_id)
 
         # Проверка на наличие статистики
         if not stats:
@@ -196,7 +201,8 @@ async def show_profile(callback: types.CallbackQuery):
                 f"⏱ *Временные показатели:*\n"
                 f"• 🕒 Общее время работы: {total_hours:.1f} ч\n"
                 f"• ⏳ Средняя длительность смены: {avg_shift_duration:.1f} ч\n"
-                f"• 💸 Средний доход в час: {earnings_per_hour:.0f}с\n\n"
+                f"• 💸 Средний доход в час: {earnings_per_hour:.0f}с\n"
+                f"{_rank_line(earnings_per_hour)}\n"
                 
                 f"📈 *Результативность:*\n"
                 f"• 📊 Средний заработок за смену: {avg_earnings:.0f}с\n"
@@ -210,8 +216,8 @@ async def show_profile(callback: types.CallbackQuery):
                 "Добавьте информацию о первой смене, чтобы увидеть статистику."
             )
         
-        # Добавляем кнопку "Назад"
-        keyboard = get_back_keyboard()
+        # Кнопки подробной статистики и "Назад"
+        keyboard = get_profile_keyboard() if total_shifts > 0 else get_back_keyboard()
         
         await callback.message.edit_text(profile_text, reply_markup=keyboard, parse_mode="Markdown")
     except Exception as e:
@@ -222,6 +228,139 @@ async def show_profile(callback: types.CallbackQuery):
         await callback.message.edit_text("❌ Произошла ошибка при загрузке профиля")
 
 
+def _rank_text(top: int) -> str:
+    # "Топ 90%" звучит как похвала, поэтому нижней половине показываем, кого курьер обгоняет
+    return f"топ {top}%" if top <= 50 else f"выше, чем у {100 - top}%"
+
+
+def _rank_line(earnings_per_hour: float) -> str:
+    """Строка профиля с местом среди всех курьеров (пустая, если распределение еще не посчитано)"""
+    top = rate_benchmarks.top_percent('all', '', 'earnings_per_hour', earnings_per_hour)
+    return f"• 🏆 Доход в час среди всех курьеров: {_rank_text(top)}\n" if top is not None else ""
+
+
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+SPARK_BARS = "▁▂▃▄▅▆▇█"
+
+
+def _change(value: Optional[float]) -> str:
+    return "нет данных" if value is None else f"{value:+.0%}"
+
+
+def _sparkline(values: Sequence[float]) -> str:
+    top = max(values) if len(values) else 0
+    if top <= 0:
+        return SPARK_BARS[0] * len(values)
+    return ''.join(SPARK_BARS[min(int(value / top * (len(SPARK_BARS) - 1)), len(SPARK_BARS) - 1)] for value in values)
+
+
+def format_detailed_statistics(stats: Dict[str, Any]) -> str:
+    """
+    Текст подробной статистики (HTML, тепловая карта - моноширинным блоком)
+
+    Args:
+        stats: Результат services.statistics.calculate_user_statistics
+    """
+    rate = stats['earnings_per_hour_percentiles']
+    shift = stats['shift_earnings_percentiles']
+    week, month = stats['trends'][7], stats['trends'][30]
+    lines = [
+        "📈 <b>Подробная статистика</b>",
+        "",
+        f"💸 Доход в час: {stats['avg_earnings_per_hour']:.0f}с",
+        f"• медиана смены {rate[50]:.0f}с, половина смен {rate[25]:.0f}-{rate[75]:.0f}с, лучшие 10% от {rate[90]:.0f}с",
+        f"📦 Заказов в час: {stats['avg_orders_per_hour']:.1f}",
+        f"💰 Заработок за смену: медиана {shift[50]:.0f}с, лучшие 10% от {shift[90]:.0f}с",
+        "",
+        f"📅 7 дней: {week['earnings']:.0f}с за {week['hours']:.1f} ч ({week['earnings_per_hour']:.0f}с/ч), "
+        f"к прошлой неделе {_change(week['earnings_change'])}",
+        f"📅 30 дней: {month['earnings']:.0f}с за {month['hours']:.1f} ч ({month['earnings_per_hour']:.0f}с/ч), "
+        f"к прошлому месяцу {_change(month['earnings_change'])}",
+        f"Заработок за 7 дней, последние 30 дней: {_sparkline(stats['trends']['daily_7d'])}",
+        "",
+        "🚚 <b>По сервисам:</b>",
+    ]
+    for service, values in sorted(stats['services'].items(), key=lambda item: -item[1]['earnings_per_hour']):
+        line = (
+            f"• {service_names.get(service, service or 'Не указан')}: {values['shifts']} смен, "
+            f"{values['earnings_per_hour']:.0f}с/ч, {values['orders_per_hour']:.1f} заказа/ч"
+        )
+        top = rate_benchmarks.top_percent('service', service, 'earnings_per_hour', values['earnings_per_hour'])
+        if top is not None:
+            line += f", {_rank_text(top)}"
+        lines.append(line)
+
+    # Медианы всех курьеров: ответ на "яндекс или глово?"
+    medians = [
+        (service, rate_benchmarks.median('service', service, 'earnings_per_hour'))
+        for service in service_names
+    ]
+    medians = [(service, median) for service, median in medians if median is not None]
+    if medians:
+        lines.append("👥 Медиана дохода в час у всех курьеров: " + ", ".join(
+            f"{service_names[service]} {median:.0f}с" for service, median in sorted(medians, key=lambda item: -item[1])
+        ))
+
+    # Тепловая карта по 4 часа: доход в час в каждой клетке
+    heatmap = stats['heatmap']
+    hours = heatmap['hours'].reshape(7, 6, 4).sum(axis=2)
+    earnings = heatmap['earnings'].reshape(7, 6, 4).sum(axis=2)
+    table = ["    " + "".join(f"{f'{start}-{start + 4}':>6}" for start in range(0, 24, 4))]
+    for day, name in enumerate(WEEKDAYS):
+        cells = [f"{earnings[day, block] / hours[day, block]:>6.0f}" if hours[day, block] else f"{'·':>6}"
+                 for block in range(6)]
+        table.append(f"{name}  " + "".join(cells))
+    lines += ["", "🗓 <b>Доход в час по дням и часам:</b>", "<pre>" + "\n".join(table) + "</pre>"]
+
+    slots = best_time_slots(heatmap)
+    if slots:
+        lines.append("🔝 Лучшее время: " + ", ".join(
+            f"{WEEKDAYS[day]} {hour:02d}:00 ({value:.0f}с/ч)" for day, hour, value in slots
+        ))
+
+    # Место среди курьеров, начинавших смену в тот же час
+    hour_hours = stats['start_hours']['hours']
+    hour_rate = stats['start_hours']['earnings'] / np.maximum(hour_hours, 1e-9)
+    ranked = [
+        (hour, rate_benchmarks.top_percent('hour', str(hour), 'earnings_per_hour', float(hour_rate[hour])))
+        for hour in np.argsort(hour_rate)[::-1][:3] if hour_hours[hour] >= 2
+    ]
+    ranked = [(hour, top) for hour, top in ranked if top is not None]
+    if ranked:
+        lines.append("⏰ Среди курьеров с началом смены в тот же час: " + ", ".join(
+            f"{hour:02d}:00 - {_rank_text(top)}" for hour, top in ranked
+        ))
+    return "\n".join(lines)
+
+
+@router.callback_query(F.data == "profile_details")
+async def show_profile_details(callback: types.CallbackQuery):
+    """
+    Подробная статистика профиля: перцентили, тренды, сервисы и тепловая карта.
+    Считается по всем сменам пользователя в потоке базы данных.
+    """
+    try:
+        stats = await db.run(calculate_user_statistics, callback.from_user.id)
+        if not stats or not stats['total_shifts']:
+            await callback.message.edit_text(
+                "У вас пока нет завершенных смен для подробной статистики.",
+                reply_markup=get_back_keyboard()
+            )
+            return
+
+        await callback.message.edit_text(
+            format_detailed_statistics(stats)[:4096],
+            reply_markup=get_back_keyboard(),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при показе подробной статистики: {e}")
+        await callback.message.edit_text("❌ Произошла ошибка при загрузке статистики",
+                                         reply_markup=get_back_keyboard())
+    finally:
+        await callback.answer()
+
+
 @router.callback_query(F.data == "back_to_main")
 async def back_to_main(callback: types.CallbackQuery, state: FSMContext):
     try:
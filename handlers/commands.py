@@ -3,7 +3,7 @@ from aiogram import Router, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from keyboards.inline import get_main_menu_keyboard, get_service_keyboard
-from database import Database
+from database import AsyncDatabase
 
 # Main commands handler right here.
 
@@ -11,7 +11,7 @@ logger = logging.getLogger(__name__)
 
 # Создаем роутер для команд
 router = Router()
-db = Database()
+db = AsyncDatabase()
 
 @router.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext = None):
@@ -21,7 +21,7 @@ async def cmd_start(message: types.Message, state: FSMContext = None):
     """
     try:
         # Получаем или создаем пользователя
-        user = db.get_or_create_user(message.from_user.id, message.from_user.username)
+        user = await db.get_or_create_user(message.from_user.id, message.from_user.username)
         
         # Отправляем приветственное сообщение с клавиатурой
         sent_message = await message.answer(
@@ -49,6 +49,8 @@ async def cmd_help(message: types.Message):
         "/start - Запустить бота\n"
         "/help - Показать это сообщение\n"
         "/service - Изменить сервис доставки (По умолчанию - Яндекс Еда)\n"
+        "/import - Загрузить историю смен из CSV или JSON файла\n"
+        "/export - Выгрузить смены, заказы и советы (/export jsonl gz - в JSON Lines со сжатием)\n"
         "И другие функции, доступные через кнопки в меню.\n\n"
         "🤖 Этот бот поможет вам эффективно управлять работой и отслеживать статистику.\n"
         "💡 Используйте ИИ советы для оптимизации работы и повышения заработка!\n"
@@ -5,12 +5,12 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
-from database import Database
+from database import AsyncDatabase
 from keyboards.inline import get_main_menu_keyboard, get_back_keyboard
 
 # Messages without states, or not handled messages are here.
 logger = logging.getLogger(__name__)
-db = Database()
+db = AsyncDatabase()
 
 # Создаем роутер для общих обработчиков
 router = Router()
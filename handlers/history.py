@@ -0,0 +1,355 @@
+import csv
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Tuple
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
+from aiogram.types import BufferedInputFile, FSInputFile, Message
+from database import AsyncDatabase
+from keyboards.inline import get_main_menu_keyboard
+from .session import parse_session_fields
+
+# Bulk shift history import from CSV / JSON / JSON Lines documents and /export of the user's data.
+router = Router()
+logger = logging.getLogger(__name__)
+db = AsyncDatabase()
+
+SUPPORTED_EXTENSIONS = ('.csv', '.json', '.jsonl')
+# Ограничения на файл: Telegram отдает ботам файлы до 20 МБ
+MAX_FILE_SIZE = 5 * 1024 * 1024
+MAX_ROWS = 50000
+# Смен в одной транзакции
+CHUNK_SIZE = 1000
+# Сколько ошибок показать в сообщении (полный список - файлом)
+ERRORS_IN_MESSAGE = 10
+
+# Telegram принимает от ботов документы до 50 МБ
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+FIELDS = ('date', 'start', 'end', 'orders', 'earnings')
+# Названия колонок в заголовке CSV и ключи JSON
+FIELD_ALIASES = {
+    'date': 'date', 'дата': 'date',
+    'start': 'start', 'start_time': 'start', 'начало': 'start',
+    'end': 'end', 'end_time': 'end', 'конец': 'end', 'окончание': 'end',
+    'orders': 'orders', 'order_count': 'orders', 'заказы': 'orders', 'заказов': 'orders',
+    'earnings': 'earnings', 'заработок': 'earnings',
+}
+
+IMPORT_HELP = (
+    "📥 Импорт истории смен\n\n"
+    "Отправьте файл .csv, .json или .jsonl, одна смена на строку:\n"
+    "дата, начало, конец, заказы, заработок\n\n"
+    "Пример CSV:\n"
+    "date,start,end,orders,earnings\n"
+    "05.02.2025,16:40,18:21,2,454\n\n"
+    "Пример JSON: [{\"date\": \"05.02.2025\", \"start\": \"16:40\", \"end\": \"18:21\", "
+    "\"orders\": 2, \"earnings\": 454}]\n\n"
+    "Смены проверяются так же, как при ручном вводе. Уже добавленные смены не дублируются."
+)
+
+
+def _normalize_record(record: Dict[str, Any]) -> Tuple[Any, ...]:
+    fields = {FIELD_ALIASES.get(str(key).strip().lower()): value for key, value in record.items()}
+    missing = [field for field in FIELDS if fields.get(field) in (None, '')]
+    if missing:
+        raise ValueError(f"Нет полей: {', '.join(missing)}")
+    return tuple(fields[field] for field in FIELDS)
+
+
+def _read_csv(file) -> Iterator[Tuple[int, Any]]:
+    first_line = file.readline()
+    try:
+        dialect = csv.Sniffer().sniff(first_line, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+
+    reader = csv.reader(chain([first_line], file), dialect)
+    first = next(reader, None)
+    if first is None:
+        return
+
+    # Заголовок определяется по названиям колонок, без него порядок колонок - как в FIELDS
+    header = [FIELD_ALIASES.get(cell.strip().lower()) for cell in first]
+    if any(header):
+        rows = reader
+    else:
+        header = list(FIELDS)
+        rows = chain([first], reader)
+
+    for row in rows:
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(row) != len(header):
+            yield reader.line_num, ValueError(f"Ожидалось колонок: {len(header)}, получено: {len(row)}")
+            continue
+        yield reader.line_num, dict(zip(header, row))
+
+
+def _read_json(file) -> Iterator[Tuple[int, Any]]:
+    # JSON-массив читается целиком (размер файла ограничен), JSON Lines - построчно
+    first_char = file.read(1)
+    while first_char.isspace():
+        first_char = file.read(1)
+
+    if first_char == '[':
+        try:
+            records = json.loads(first_char + file.read())
+        except json.JSONDecodeError as e:
+            yield e.lineno, ValueError(f"Некорректный JSON: {e.msg}")
+            return
+        for number, record in enumerate(records, start=1):
+            yield number, record
+        return
+
+    for number, line in enumerate(chain([first_char + file.readline()], file), start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, ValueError(f"Некорректный JSON: {e.msg}")
+
+
+def _detect_encoding(path: str) -> str:
+    # Excel сохраняет CSV на русском в cp1251
+    with open(path, 'rb') as file:
+        head = file.read(64 * 1024)
+    try:
+        head.decode('utf-8-sig')
+    except UnicodeDecodeError as e:
+        # Обрезанный на границе блока многобайтовый символ - не повод менять кодировку
+        if e.start < len(head) - 3:
+            return 'cp1251'
+    return 'utf-8-sig'
+
+
+def read_history_file(path: str, file_name: str) -> Iterator[Tuple[int, Any]]:
+    """
+    Читает файл истории построчно
+
+    Args:
+        path: Путь к скачанному файлу
+        file_name: Имя файла у пользователя (формат определяется по расширению)
+
+    Returns:
+        Итератор (номер строки, смена (начало, конец, заработок, заказы) или ValueError)
+    """
+    reader = _read_json if file_name.lower().endswith(('.json', '.jsonl')) else _read_csv
+    with open(path, encoding=_detect_encoding(path), newline='') as file:
+        for number, record in reader(file):
+            if isinstance(record, ValueError):
+                yield number, record
+                continue
+            try:
+                if not isinstance(record, dict):
+                    raise ValueError("Ожидался объект с полями смены")
+                start, end, orders, earnings = parse_session_fields(*_normalize_record(record))
+                yield number, (start, end, earnings, orders)
+            except ValueError as e:
+                yield number, e
+
+
+def import_history_file(path: str, file_name: str, user_id: int) -> Dict[str, Any]:
+    """
+    Импортирует файл истории пачками по CHUNK_SIZE смен (выполняется в потоке базы данных)
+
+    Args:
+        path: Путь к скачанному файлу
+        file_name: Имя файла у пользователя
+        user_id: ID пользователя
+
+    Returns:
+        Dict с rows, imported, duplicates и errors (список (номер строки, текст ошибки))
+    """
+    result = {'rows': 0, 'imported': 0, 'duplicates': 0, 'errors': []}
+    chunk: List[Tuple[int, tuple]] = []
+
+    def flush():
+        saved = db.database.import_completed_sessions(user_id, [session for _, session in chunk])
+        result['imported'] += saved['imported']
+        result['duplicates'] += saved['duplicates']
+        result['errors'].extend((chunk[index][0], error) for index, error in saved['errors'].items())
+        chunk.clear()
+
+    for number, record in read_history_file(path, file_name):
+        result['rows'] += 1
+        if result['rows'] > MAX_ROWS:
+            result['errors'].append((number, f"Превышен лимит в {MAX_ROWS} строк, остаток файла пропущен"))
+            break
+        if isinstance(record, ValueError):
+            result['errors'].append((number, str(record)))
+            continue
+        chunk.append((number, record))
+        if len(chunk) >= CHUNK_SIZE:
+            flush()
+
+    if chunk:
+        flush()
+    result['errors'].sort()
+    return result
+
+
+def write_export(user_id: int, table: str, path: str, fmt: str = 'csv', compress: bool = False) -> int:
+    """
+    Пишет записи пользователя в файл прямо из курсора (выполняется в потоке базы данных)
+
+    Память не зависит от объема истории: в памяти только текущая порция строк курсора.
+
+    Args:
+        user_id: ID пользователя
+        table: Название из Database.export_tables
+        path: Путь к файлу
+        fmt: csv или jsonl
+        compress: Сжать gzip
+
+    Returns:
+        Количество выгруженных строк
+    """
+    # BOM нужен Excel, чтобы открыть CSV на русском в UTF-8
+    encoding = 'utf-8-sig' if fmt == 'csv' else 'utf-8'
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(path, 'wt', encoding=encoding, newline='') as file:
+        writer = None
+        for row in db.database.iter_user_rows(user_id, table):
+            if fmt == 'csv':
+                if writer is None:
+                    writer = csv.DictWriter(file, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+            else:
+                file.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+            count += 1
+    return count
+
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject):
+    """
+    Обработчик команды /export.
+    Выгружает смены, заказы и советы пользователя файлами: /export [csv|jsonl] [gz] [sessions|orders|advice]
+    """
+    options = (command.args or '').lower().split()
+    fmt = next((option for option in options if option in EXPORT_FORMATS), 'csv')
+    compress = any(option in ('gz', 'gzip') for option in options)
+    tables = [option for option in options if option in db.database.export_tables] or list(db.database.export_tables)
+    unknown = [
+        option for option in options
+        if option not in EXPORT_FORMATS and option not in ('gz', 'gzip') and option not in db.database.export_tables
+    ]
+    if unknown:
+        await message.answer(
+            f"❌ Неизвестные параметры: {', '.join(unknown)}\n\n"
+            "Формат: /export [csv|jsonl] [gz] [sessions|orders|advice]"
+        )
+        return
+
+    processing_msg = await message.answer("⌛ Готовлю выгрузку...")
+    exported = 0
+    # Таблицы, не отправленные из-за лимита Telegram на размер файла
+    too_large = []
+    try:
+        for table in tables:
+            file_name = f"{table}.{fmt}" + ('.gz' if compress else '')
+            fd, path = tempfile.mkstemp(suffix='-' + file_name)
+            os.close(fd)
+            try:
+                started = time.perf_counter()
+                count = await db.run(write_export, message.from_user.id, table, path, fmt, compress)
+                logger.info(
+                    f"Выгрузка {file_name} пользователя {message.from_user.id}: {count} строк "
+                    f"за {time.perf_counter() - started:.2f} с"
+                )
+                if not count:
+                    continue
+                if os.path.getsize(path) > MAX_UPLOAD_SIZE:
+                    too_large.append(table)
+                    hint = "" if compress else f" Попробуйте /export {fmt} gz {table}"
+                    await message.answer(f"❌ {file_name} больше 50 МБ.{hint}")
+                    continue
+                await message.answer_document(FSInputFile(path, filename=file_name), caption=f"📄 {table}: {count}")
+                exported += 1
+            finally:
+                os.remove(path)
+
+        if not exported and not too_large:
+            await message.answer("📭 Нет данных для выгрузки.", reply_markup=get_main_menu_keyboard())
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке данных: {e}")
+        await message.answer("❌ Не удалось выгрузить данные. Пожалуйста, попробуйте позже.",
+                             reply_markup=get_main_menu_keyboard())
+    finally:
+        await processing_msg.delete()
+
+
+@router.message(Command("import"))
+async def cmd_import(message: Message):
+    """
+    Обработчик команды /import.
+    Объясняет формат файла для импорта истории смен.
+    """
+    await message.answer(IMPORT_HELP)
+
+
+@router.message(F.document)
+async def process_history_file(message: Message):
+    """
+    Обработчик документа с историей смен.
+    Скачивает файл, проверяет строки по правилам ручного ввода и сохраняет смены пачками.
+    """
+    document = message.document
+    file_name = document.file_name or ''
+    if not file_name.lower().endswith(SUPPORTED_EXTENSIONS):
+        await message.answer("❌ Поддерживаются файлы .csv, .json и .jsonl.\n\n" + IMPORT_HELP)
+        return
+    if document.file_size and document.file_size > MAX_FILE_SIZE:
+        await message.answer(f"❌ Файл больше {MAX_FILE_SIZE // (1024 * 1024)} МБ. Разбейте его на части.")
+        return
+
+    processing_msg = await message.answer("⌛ Импортирую историю смен...")
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(file_name)[1])
+    os.close(fd)
+    try:
+        await message.bot.download(document, destination=path)
+
+        started = time.perf_counter()
+        result = await db.run(import_history_file, path, file_name, message.from_user.id)
+        logger.info(
+            f"Импорт {file_name} пользователя {message.from_user.id}: строк {result['rows']}, "
+            f"сохранено {result['imported']}, ошибок {len(result['errors'])} "
+            f"за {time.perf_counter() - started:.2f} с"
+        )
+
+        errors = result['errors']
+        summary = (
+            "✅ Импорт завершен\n\n"
+            f"📄 Строк в файле: {result['rows']}\n"
+            f"💾 Добавлено смен: {result['imported']}\n"
+            f"🔁 Уже были добавлены: {result['duplicates']}\n"
+            f"❌ Строк с ошибками: {len(errors)}"
+        )
+        if errors:
+            summary += "\n\n" + "\n".join(f"Строка {number}: {error}" for number, error in errors[:ERRORS_IN_MESSAGE])
+            if len(errors) > ERRORS_IN_MESSAGE:
+                summary += f"\n… и еще {len(errors) - ERRORS_IN_MESSAGE}, полный список в файле"
+
+        await message.answer(summary[:4096], reply_markup=get_main_menu_keyboard())
+        if len(errors) > ERRORS_IN_MESSAGE:
+            report = "\n".join(f"Строка {number}: {error}" for number, error in errors)
+            await message.answer_document(
+                BufferedInputFile(report.encode('utf-8'), filename='import_errors.txt')
+            )
+    except Exception as e:
+        logger.error(f"Ошибка при импорте истории: {e}")
+        await message.answer("❌ Не удалось импортировать файл. Пожалуйста, попробуйте позже.",
+                             reply_markup=get_main_menu_keyboard())
+    finally:
+        os.remove(path)
+        await processing_msg.delete()
@@ -0,0 +1,124 @@
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+from dotenv import load_dotenv
+from aiogram import BaseMiddleware, F, Router
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.filters import Command
+from aiogram.types import BufferedInputFile, CallbackQuery, Message, TelegramObject
+from services.metrics import (
+    metrics,
+    handler_duration,
+    handler_errors,
+    db_call_duration,
+    gemini_duration,
+    gemini_requests,
+    quota_events,
+    advice_cache_lookups,
+    fsm_operations,
+)
+
+# Handler latency middleware and the admin /metrics command.
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+# ID администраторов через запятую: ADMIN_IDS=123,456
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv('ADMIN_IDS', '').split(',') if admin_id.strip()}
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Внешний middleware роутера: время обработки апдейта по роутеру и событию.
+
+    Событие - callback_data для кнопок, команда или состояние FSM для сообщений.
+    Апдейты, которые роутер не обработал, не учитываются.
+    """
+
+    def __init__(self, router_name: str):
+        self.router_name = router_name
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        start = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception:
+            handler_errors.inc(router=self.router_name, event=self._event_label(event, data))
+            raise
+
+        if result is not UNHANDLED:
+            handler_duration.observe(
+                time.perf_counter() - start,
+                router=self.router_name,
+                event=self._event_label(event, data)
+            )
+        return result
+
+    @staticmethod
+    def _event_label(event: TelegramObject, data: Dict[str, Any]) -> str:
+        if isinstance(event, CallbackQuery):
+            return f"callback:{(event.data or '')[:64]}"
+        if isinstance(event, Message):
+            if event.text and event.text.startswith('/'):
+                return event.text.split(maxsplit=1)[0][:32]
+            if data.get('raw_state'):
+                return f"state:{data['raw_state']}"
+        return 'message'
+
+
+def format_metrics_summary() -> str:
+    """Краткая сводка метрик для администратора"""
+    lines = ["📊 Метрики процесса", "", "Обработчики (кол-во, среднее мс):"]
+    for (router_name, event), (count, total) in sorted(handler_duration.snapshot().items()):
+        lines.append(f"  {router_name} {event}: {count}, {total / count * 1000:.1f}")
+    for (router_name, event), count in sorted(handler_errors.snapshot().items()):
+        lines.append(f"  ❌ {router_name} {event}: {count:g} ошибок")
+
+    lines.append("")
+    lines.append("База данных (кол-во, среднее мс):")
+    slowest = sorted(db_call_duration.snapshot().items(), key=lambda item: item[1][1] / item[1][0], reverse=True)
+    for (method,), (count, total) in slowest[:10]:
+        lines.append(f"  {method}: {count}, {total / count * 1000:.2f}")
+
+    lines.append("")
+    lines.append("Gemini:")
+    for (mode,), (count, total) in sorted(gemini_duration.snapshot().items()):
+        lines.append(f"  {mode}: {count}, среднее {total / count:.2f} с")
+    for (mode, result), count in sorted(gemini_requests.snapshot().items()):
+        lines.append(f"  {mode} {result}: {count:g}")
+
+    lines.append("")
+    quota = {event: count for (event,), count in quota_events.snapshot().items()}
+    lines.append(
+        f"Квота: списано {quota.get('consumed', 0):g}, возвращено {quota.get('released', 0):g}, "
+        f"отказов {quota.get('rejected', 0):g}"
+    )
+    cache = {result: count for (result,), count in advice_cache_lookups.snapshot().items()}
+    lines.append("Кэш советов: " + ", ".join(f"{result} {count:g}" for result, count in sorted(cache.items())))
+    fsm = {f"{operation}/{source}": count for (operation, source), count in fsm_operations.snapshot().items()}
+    lines.append("FSM: " + ", ".join(f"{name} {count:g}" for name, count in sorted(fsm.items())))
+    return '\n'.join(lines)
+
+
+@router.message(Command("metrics"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_metrics(message: Message):
+    """
+    Обработчик команды /metrics (только для администраторов).
+    Показывает сводку метрик и прикладывает полный текст в формате Prometheus.
+    """
+    try:
+        await message.answer(format_metrics_summary()[:4096])
+        await message.answer_document(
+            BufferedInputFile(metrics.render().encode('utf-8'), filename='metrics.txt')
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в команде metrics: {e}")
+        await message.answer("❌ Не удалось получить метрики.")
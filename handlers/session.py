@@ -2,16 +2,17 @@ from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 from datetime import datetime
+from typing import Tuple
 import logging
 import re
-from database import Database
+from database import AsyncDatabase
 from .states import SessionStates
 from keyboards.inline import get_main_menu_keyboard, get_back_keyboard
 
 # Courier session handler.
 router = Router()
 logger = logging.getLogger(__name__)
-db = Database()
+db = AsyncDatabase()
 
 # Services dictionary
 service_names = {
@@ -20,6 +21,47 @@ service_names = {
     "glovo": "Глово"
 }
 
+def parse_session_fields(date_str: str, start_time_str: str, end_time_str: str,
+                         orders_str: str, earnings_str: str) -> Tuple[datetime, datetime, int, float]:
+    """
+    Разбирает поля смены (формат сообщения и строк импорта истории)
+    
+    Args:
+        date_str: Дата в формате ДД.ММ.ГГГГ
+        start_time_str: Время начала ЧЧ:ММ
+        end_time_str: Время окончания ЧЧ:ММ
+        orders_str: Количество заказов
+        earnings_str: Заработок
+        
+    Returns:
+        (начало, конец, заказы, заработок); диапазоны проверяет Database._validate_session_data
+        
+    Raises:
+        ValueError: Если формат поля неверный (текст ошибки показывается пользователю)
+    """
+    date_str = str(date_str).strip()
+    start_time_str = str(start_time_str).strip()
+    end_time_str = str(end_time_str).strip()
+    orders = int(str(orders_str).strip())
+    earnings = float(str(earnings_str).strip())
+    
+    # Проверяем формат даты
+    if not re.match(r'\d{2}\.\d{2}\.\d{4}', date_str):
+        raise ValueError("Неверный формат даты")
+    
+    # Проверяем формат времени
+    if not re.match(r'\d{2}:\d{2}', start_time_str) or not re.match(r'\d{2}:\d{2}', end_time_str):
+        raise ValueError("Неверный формат времени")
+    
+    # Преобразуем строки в объекты datetime
+    try:
+        start_dt = datetime.strptime(f"{date_str} {start_time_str}", "%d.%m.%Y %H:%M")
+        end_dt = datetime.strptime(f"{date_str} {end_time_str}", "%d.%m.%Y %H:%M")
+    except ValueError as e:
+        raise ValueError(f"Некорректная дата или время: {str(e)}")
+    
+    return start_dt, end_dt, orders, earnings
+
 @router.message(SessionStates.waiting_for_session_data)
 async def process_session_data(message: Message, state: FSMContext):
     try:
@@ -35,78 +77,17 @@ async def process_session_data(message: Message, state: FSMContext):
         if len(lines) != 5:
             raise ValueError("Неверный формат данных")
         
-        # Парсим данные
-        date_str = lines[0].strip()
-        start_time_str = lines[1].strip()
-        end_time_str = lines[2].strip()
-        orders = int(lines[3].strip())
-        earnings = float(lines[4].strip())
-        
-        # Проверяем формат даты
-        if not re.match(r'\d{2}\.\d{2}\.\d{4}', date_str):
-            raise ValueError("Неверный формат даты")
-        
-        # Проверяем формат времени
-        if not re.match(r'\d{2}:\d{2}', start_time_str) or not re.match(r'\d{2}:\d{2}', end_time_str):
-            raise ValueError("Неверный формат времени")
-        
-        # Проверяем количество заказов и заработок
-        if orders <= 0 or orders > 25:
-            raise ValueError("Количество заказов должно быть положительным числом и меньше 25.")
-        
-        # Проверяем количество заказов за смену
-        if orders > 25 or earnings >= 6000:
-            raise ValueError("Заработок не соответствует реальности! Введите меньшее число.")
-
-        # Проверяем корректность времени
-        try:
-            # Преобразуем строки в объекты datetime
-            start_dt = datetime.strptime(f"{date_str} {start_time_str}", "%d.%m.%Y %H:%M")
-            end_dt = datetime.strptime(f"{date_str} {end_time_str}", "%d.%m.%Y %H:%M")
-            
-            # Получаем текущую дату и время
-            current_dt = datetime.now()
-            
-            # Проверка года (должен быть не раньше 2022)
-            if start_dt.year < 2022:
-                raise ValueError("Год не может быть раньше 2022")
-            
-            # Проверка месяца (должен быть от 1 до 12)
-            if not 1 <= start_dt.month <= 12:
-                raise ValueError("Месяц должен быть от 1 до 12")
-            
-            # Проверка, что дата не в будущем
-            if start_dt > current_dt or end_dt > current_dt:
-                raise ValueError("Дата и время не могут быть в будущем")
-            
-            # Проверяем, что время окончания позже времени начала
-            if end_dt <= start_dt:
-                raise ValueError("Время окончания должно быть позже времени начала")
-            
-            # Вычисляем общее время работы в часах
-            total_hours = (end_dt - start_dt).total_seconds() / 3600
-            if total_hours <= 0:
-                raise ValueError("Время работы должно быть положительным")
-                
-        except ValueError as e:
-            raise ValueError(f"Некорректная дата или время: {str(e)}")
+        date_str, start_time_str, end_time_str = (line.strip() for line in lines[:3])
+        start_dt, end_dt, orders, earnings = parse_session_fields(*lines)
         
-        # Получаем текущий сервис пользователя из базы данных
-        user_id = message.from_user.id
-        current_service_key = db.get_user_service(user_id)
-
-        # Если сервис не найден, устанавливаем по умолчанию
-        if not current_service_key:
-            current_service_key = "yandex_food"
-
-        # Получаем название сервиса на русском
-        current_service = service_names.get(current_service_key, "Неизвестный сервис")
-
-        # Сохраняем смену с полной датой и временем
-        session_id = db.add_session(
+        # Проверяем и сохраняем смену одним запросом (сервис берется из профиля пользователя)
+        result = await db.record_completed_session(
             message.from_user.id,
-            "delivery",
-            start_dt.strftime('%Y-%m-%d %H:%M:%S')
+            None,
+            start_dt,
+            end_dt,
+            earnings,
+            orders
         )
         
         await state.clear()
@@ -115,16 +96,9 @@ async def process_session_data(message: Message, state: FSMContext):
         keyboard = get_main_menu_keyboard()
         
         # Обновляем основное сообщение с результатом
-        if session_id:
-            # Обновляем сессию с добавлением текущего сервиса
-            db.update_session(
-                session_id, 
-                earnings=earnings, 
-                order_count=orders, 
-                start_time=start_dt.strftime('%Y-%m-%d %H:%M:%S'),
-                end_time=end_dt.strftime('%Y-%m-%d %H:%M:%S'),
-                service=current_service_key
-            )
+        if result:
+            # Получаем название сервиса на русском
+            current_service = service_names.get(result['service'], "Неизвестный сервис")
             
             success_text = (
                 "✅ Смена успешно добавлена!\n\n"
@@ -132,7 +106,8 @@ async def process_session_data(message: Message, state: FSMContext):
                 f"🕒 Время: {start_time_str} - {end_time_str}\n"
                 f"📦 Заказов: {orders}\n"
                 f"💰 Заработок: {earnings}с\n\n"
-                f"🕒 Общее время работы: {total_hours:.1f} ч\n\n"
+                f"🕒 Общее время работы: {result['total_hours']:.1f} ч\n"
+                f"💸 Доход в час: {result['earnings_per_hour']:.0f}с\n\n"
                 f"🚚 Текущий сервис: {current_service}\n\n"
                 "👋 Выберите действие:"
             )
@@ -28,6 +28,19 @@ def get_service_keyboard() -> InlineKeyboardMarkup:
         ]
     ])
 
+def get_profile_keyboard() -> InlineKeyboardMarkup:
+    """
+    Создает клавиатуру профиля с кнопкой подробной статистики.
+    """
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="📈 Подробная статистика", callback_data="profile_details")
+        ],
+        [
+            InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main")
+        ]
+    ])
+
 def get_back_keyboard() -> InlineKeyboardMarkup:
     """
     Создает клавиатуру с кнопкой "Назад".
@@ -1,51 +1,28 @@
+import argparse
 import logging
 import os
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram import types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
 from aiogram.filters import Command, StateFilter
-from database import Database
 import re
 from datetime import datetime
 from dotenv import load_dotenv
 from typing import Dict, Any
-from handlers import (
-    commands_router,
-    callbacks_router,
-    ai_advice_router,
-    session_router,
-    general_router,
-)
 from handlers.states import SessionStates
+from app import configure_logging, create_bot, create_database, create_dispatcher
+from webhook import run_webhook
+from workers import run_sharded
 
 # Версия 1.0.1, базовые исправления времени. Добавлена функция get_user_sessions, добавлена функция расчета статистики,
 # времени и дохода в час calculate_user_statistics.
 
 # 1 PART OF BOT (Initialization)
-# Logging settings.
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Бот, база и диспетчер создаются в main() (см. app.py): процессы-обработчики
+# импортируют этот модуль заново и не должны повторять настройку.
 logger = logging.getLogger(__name__)
 
-# Bot initialization (lol)
-load_dotenv()
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-db = Database()
-
-# Register routers
-dp.include_router(commands_router)
-dp.include_router(callbacks_router)
-dp.include_router(ai_advice_router)
-dp.include_router(general_router)
-dp.include_router(session_router)
-
 
 # FSM states
 class SessionStates(StatesGroup):
@@ -54,13 +31,47 @@ class SessionStates(StatesGroup):
     waiting_for_advice_question = State()  # Новое состояние
 
 
-async def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бот для курьеров")
+    parser.add_argument('--webhook', action='store_true', help="Принимать апдейты по вебхуку вместо long polling")
+    parser.add_argument('--host', default=os.getenv('WEBHOOK_HOST', '127.0.0.1'), help="Адрес сервера вебхука")
+    parser.add_argument('--port', type=int, default=int(os.getenv('WEBHOOK_PORT', '8080')), help="Порт сервера вебхука")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('BOT_WORKERS', '1')),
+                        help="Число процессов-обработчиков (апдейты распределяются по user_id)")
+    return parser.parse_args()
+
+
+def webhook_options() -> Dict[str, Any]:
+    """Параметры вебхука из окружения"""
+    # WEBHOOK_URL - внешний адрес (https://bot.example.com), без него вебхук не регистрируется
+    return {
+        'path': os.getenv('WEBHOOK_PATH', '/webhook'),
+        'secret_token': os.getenv('WEBHOOK_SECRET'),
+        'base_url': os.getenv('WEBHOOK_URL'),
+        'max_concurrent_updates': int(os.getenv('WEBHOOK_MAX_UPDATES', '64')),
+    }
+
+
+async def main(args=None):
+    args = args or argparse.Namespace(webhook=False, workers=1)
+    # Bot initialization (lol)
+    bot = create_bot()
+    db = create_database()
     try:
         logger.info("Бот запущен")
-        await dp.start_polling(bot)
+        if args.workers > 1:
+            await run_sharded(bot, args.workers, webhook=args.webhook, host=args.host, port=args.port, **webhook_options())
+        elif args.webhook:
+            await run_webhook(create_dispatcher(db), bot, host=args.host, port=args.port, **webhook_options())
+        else:
+            await create_dispatcher(db).start_polling(bot)
     except Exception as e:
         logger.error(f"Критическая ошибка при запуске бота: {e}")
+    finally:
+        await db.close()
 
 if __name__ == '__main__':
     import asyncio
-    asyncio.run(main())
+    configure_logging()
+    load_dotenv()
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from database import AsyncDatabase
+from services.metrics import advice_cache_lookups
+
+# AI advice answer cache: topic + normalized question, persisted in ai_advice.
+logger = logging.getLogger(__name__)
+
+try:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import linear_kernel
+except ImportError:  # Без scikit-learn работает только точное совпадение
+    TfidfVectorizer = None
+
+
+def normalize_question(text: str) -> str:
+    """
+    Нормализует вопрос для ключа кэша: регистр, ё, пунктуация, лишние пробелы
+
+    Args:
+        text: Вопрос пользователя
+
+    Returns:
+        Нормализованный вопрос
+    """
+    text = text.lower().replace('ё', 'е')
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+def _created_at_epoch(created_at: str) -> float:
+    """Время ответа из ai_advice.created_at (CURRENT_TIMESTAMP, UTC) в секундах"""
+    return datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+
+
+class AdviceCache:
+    """
+    Кэш ответов ИИ.
+
+    Ключ - тема и нормализованный вопрос. Горячие ответы лежат в памяти
+    (LRU с TTL), все ответы - в таблице ai_advice. Если точного совпадения
+    нет, похожий вопрос ищется по TF-IDF (при наличии scikit-learn).
+
+    Индекс похожих вопросов темы после новых ответов не выбрасывается, а
+    перестраивается в фоновом потоке не чаще раза в index_rebuild_interval;
+    до этого поиск идет по прежнему индексу.
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        ttl: int = 7 * 24 * 3600,
+        max_size: int = 2000,
+        similarity_threshold: float = 0.8,
+        index_rebuild_interval: float = 10,
+    ):
+        """
+        Args:
+            db: База данных
+            ttl: Время жизни ответа в секундах
+            max_size: Максимум ответов в памяти
+            similarity_threshold: Минимальное косинусное сходство для похожего вопроса
+            index_rebuild_interval: Как часто (сек) можно перестраивать индекс темы
+        """
+        self.db = db
+        self.ttl = ttl
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self.index_rebuild_interval = index_rebuild_interval
+        self._entries: OrderedDict = OrderedDict()  # (topic, key) -> (время, ответ)
+        self._indexes: Dict[str, Tuple[object, object, List[str]]] = {}  # topic -> (vectorizer, matrix, keys)
+        # Темы, у которых вопросы изменились после построения индекса
+        self._stale_indexes: set = set()
+        self._index_tasks: Dict[str, asyncio.Task] = {}
+        self._index_built_at: Dict[str, float] = {}
+
+    async def load(self):
+        """Загружает свежие ответы из базы в память (при запуске бота)"""
+        rows = await self.db.get_cached_advice(self.ttl, self.max_size)
+        # Строки идут от новых к старым, а в LRU самые свежие должны быть в конце
+        for row in reversed(rows):
+            # Возраст ответа считается от его создания, а не от перезапуска бота
+            self._remember(row['advice_type'], row['question_key'], row['advice_text'],
+                           _created_at_epoch(row['created_at']))
+        logger.info(f"Кэш советов загружен: {len(self._entries)} ответов")
+
+        if TfidfVectorizer is not None:
+            for topic in {topic for topic, _ in self._entries}:
+                self._schedule_index_rebuild(topic)
+
+    async def get(self, topic: str, question: str) -> Optional[str]:
+        """
+        Ищет готовый ответ
+
+        Args:
+            topic: Тема вопроса
+            question: Вопрос пользователя
+
+        Returns:
+            Ответ из кэша или None
+        """
+        key = normalize_question(question)
+        if not key:
+            return None
+
+        answer = self._lookup(topic, key)
+        if answer is not None:
+            logger.info(f"Ответ найден в кэше: [{topic}] {key}")
+            advice_cache_lookups.inc(result='memory')
+            return answer
+
+        row = await self.db.find_cached_advice(topic, key, self.ttl)
+        if row is not None:
+            answer = row['advice_text']
+            self._remember(topic, key, answer, _created_at_epoch(row['created_at']))
+            logger.info(f"Ответ найден в базе: [{topic}] {key}")
+            advice_cache_lookups.inc(result='database')
+            return answer
+
+        similar_key = self._find_similar(topic, key)
+        if similar_key is not None:
+            answer = self._lookup(topic, similar_key)
+            if answer is not None:
+                logger.info(f"Найден похожий вопрос: [{topic}] {key} -> {similar_key}")
+                advice_cache_lookups.inc(result='similar')
+                return answer
+
+        advice_cache_lookups.inc(result='miss')
+        return None
+
+    async def put(self, user_id: Optional[int], topic: str, question: str, answer: str):
+        """
+        Сохраняет ответ в память и в историю советов
+
+        Args:
+            user_id: ID пользователя, задавшего вопрос
+            topic: Тема вопроса
+            question: Вопрос пользователя
+            answer: Ответ ИИ
+        """
+        key = normalize_question(question)
+        if not key:
+            return
+
+        self._remember(topic, key, answer)
+        await self.db.add_ai_advice(
+            user_id,
+            topic,
+            answer,
+            related_data=json.dumps({'question': question}, ensure_ascii=False),
+            question_key=key
+        )
+
+    def _lookup(self, topic: str, key: str) -> Optional[str]:
+        entry = self._entries.get((topic, key))
+        if entry is None:
+            return None
+
+        cached_at, answer = entry
+        if time.time() - cached_at > self.ttl:
+            del self._entries[(topic, key)]
+            self._stale_indexes.add(topic)
+            return None
+
+        self._entries.move_to_end((topic, key))
+        return answer
+
+    def _remember(self, topic: str, key: str, answer: str, cached_at: Optional[float] = None):
+        is_new = (topic, key) not in self._entries
+        self._entries[(topic, key)] = (cached_at or time.time(), answer)
+        self._entries.move_to_end((topic, key))
+
+        while len(self._entries) > self.max_size:
+            (evicted_topic, _), _ = self._entries.popitem(last=False)
+            self._stale_indexes.add(evicted_topic)
+
+        # Индекс похожих вопросов темы перестроится в фоне при следующем поиске
+        if is_new:
+            self._stale_indexes.add(topic)
+
+    def _find_similar(self, topic: str, key: str) -> Optional[str]:
+        """Ищет самый похожий закэшированный вопрос темы по TF-IDF"""
+        if TfidfVectorizer is None:
+            return None
+
+        if topic in self._stale_indexes or topic not in self._indexes:
+            self._schedule_index_rebuild(topic)
+        index = self._indexes.get(topic)
+        if index is None:
+            return None
+
+        # Ключи прежнего индекса могли уйти из кэша - это проверит _lookup
+        vectorizer, matrix, keys = index
+        # Векторы TF-IDF нормированы, поэтому скалярное произведение - косинусное сходство
+        similarities = linear_kernel(vectorizer.transform([key]), matrix)[0]
+        best = similarities.argmax()
+        if similarities[best] >= self.similarity_threshold:
+            return keys[best]
+        return None
+
+
+    def _schedule_index_rebuild(self, topic: str):
+        """Запускает перестройку индекса темы в фоне (одна на тему, не чаще index_rebuild_interval)"""
+        task = self._index_tasks.get(topic)
+        if task is not None and not task.done():
+            return
+        built_at = self._index_built_at.get(topic)
+        if topic in self._indexes and built_at is not None and time.monotonic() - built_at < self.index_rebuild_interval:
+            return
+
+        self._stale_indexes.discard(topic)
+        keys = [k for t, k in self._entries if t == topic]
+        if not keys:
+            self._indexes.pop(topic, None)
+            return
+        self._index_built_at[topic] = time.monotonic()
+        self._index_tasks[topic] = asyncio.get_running_loop().create_task(self._rebuild_index(topic, keys))
+
+    async def _rebuild_index(self, topic: str, keys: List[str]):
+        try:
+            # Обучение TF-IDF занимает десятки миллисекунд: в потоке, чтобы не держать event loop
+            self._indexes[topic] = await asyncio.get_running_loop().run_in_executor(None, self._build_index, keys)
+        except Exception as e:
+            logger.error(f"Ошибка при построении индекса похожих вопросов [{topic}]: {e}")
+            self._stale_indexes.add(topic)
+
+    @staticmethod
+    def _build_index(keys: List[str]) -> Tuple[object, object, List[str]]:
+        # Символьные n-граммы устойчивы к окончаниям в русских словах
+        vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=(2, 4))
+        return vectorizer, vectorizer.fit_transform(keys), keys
+
+
+advice_cache = AdviceCache(AsyncDatabase())
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import time
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from database import AsyncDatabase
+
+# Materialized earnings/orders-per-hour distributions across couriers for "top N%" in the profile.
+logger = logging.getLogger(__name__)
+
+
+class RateBenchmarks:
+    """
+    Распределения дохода и заказов в час по всем курьерам.
+
+    Разрезы (scope): all - все смены курьера, service - по сервису,
+    hour - по часу начала смены.
+
+    Таблица rate_benchmarks пересчитывается одним проходом GROUP BY по сменам
+    раз в refresh_interval и хранит 101 точку перцентилей на разрез.
+    Пересчет занимает один процесс (rate_benchmarks_lease), остальные
+    перечитывают таблицу раз в claim_retry, пока он не закончит.
+    В памяти лежат только эти точки: место курьера ищется bisect'ом.
+    """
+
+    def __init__(self, db: AsyncDatabase, refresh_interval: float = 3600, min_hours: float = 5,
+                 min_sample_size: int = 20, claim_retry: float = 60):
+        """
+        Args:
+            db: База данных
+            refresh_interval: Как часто (сек) пересчитывать распределения
+            min_hours: Минимум часов курьера в разрезе, чтобы он попал в распределение
+            min_sample_size: Минимум курьеров в разрезе, чтобы показывать место
+            claim_retry: Через сколько секунд перечитать таблицу, если пересчет занял другой процесс
+        """
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.min_hours = min_hours
+        self.min_sample_size = min_sample_size
+        self.claim_retry = claim_retry
+        self._quantiles: Dict[Tuple[str, str, str], List[float]] = {}
+        self._sample_sizes: Dict[Tuple[str, str, str], int] = {}
+        self._updated_at = 0.0
+        self._next_check = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def load(self):
+        """Загружает распределения из базы; устаревшие пересчитываются в фоне"""
+        self._next_check = time.monotonic() + self.refresh_interval
+        quantiles, sample_sizes, updated_at = {}, {}, 0.0
+        for row in await self.db.get_rate_benchmarks():
+            key = (row['scope'], row['key'], row['metric'])
+            quantiles[key] = json.loads(row['quantiles'])
+            sample_sizes[key] = row['sample_size']
+            updated_at = max(updated_at, row['updated_at'])
+        # Замена целиком: обработчики не видят наполовину загруженные данные
+        self._quantiles, self._sample_sizes, self._updated_at = quantiles, sample_sizes, updated_at
+        logger.info(f"Загружено распределений дохода: {len(quantiles)}")
+
+        if time.time() - updated_at >= self.refresh_interval:
+            self._start_refresh()
+
+    async def refresh(self):
+        """Пересчитывает распределения, если они устарели и пересчет не занял другой процесс"""
+        rows = await self.db.get_rate_benchmarks()
+        stale = not rows or time.time() - max(row['updated_at'] for row in rows) >= self.refresh_interval
+        # Захват атомарный: при запуске всех воркеров полный проход по сменам делает один
+        claimed = stale and await self.db.claim_rate_benchmarks_rebuild(self.refresh_interval)
+        if claimed:
+            started = time.perf_counter()
+            count = await self.db.run(self.rebuild)
+            logger.info(f"Пересчитано распределений дохода: {count} за {time.perf_counter() - started:.1f} с")
+        await self.load()
+        if stale and not claimed:
+            # Пересчитывает другой процесс: его результат заберем раньше, чем через refresh_interval
+            self._next_check = time.monotonic() + self.claim_retry
+
+    async def stop(self):
+        """Отменяет фоновый пересчет (при остановке бота, до закрытия базы)"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+
+    def rebuild(self) -> int:
+        """
+        Считает распределения по итогам всех курьеров (выполняется в потоке базы данных)
+
+        Returns:
+            Количество сохраненных разрезов
+        """
+        # Значения по разрезам в компактных массивах double: курьеров могут быть сотни тысяч
+        values: Dict[Tuple[str, str, str], array] = defaultdict(lambda: array('d'))
+        current_user = None
+        totals: Dict[Tuple[str, str], List[float]] = {}
+
+        def add_user():
+            for (scope, key), (earnings, orders, hours) in totals.items():
+                if hours >= self.min_hours:
+                    values[(scope, key, 'earnings_per_hour')].append(earnings / hours)
+                    values[(scope, key, 'orders_per_hour')].append(orders / hours)
+            totals.clear()
+
+        for user_id, service, hour, earnings, orders, hours in self.db.database.iter_rate_benchmark_rows():
+            if user_id != current_user:
+                add_user()
+                current_user = user_id
+            # Итоги пользователя сворачиваются сразу в три разреза
+            for group in (('all', ''), ('service', service), ('hour', str(hour))):
+                total = totals.setdefault(group, [0.0, 0.0, 0.0])
+                total[0] += earnings
+                total[1] += orders
+                total[2] += hours
+        add_user()
+
+        percentiles = np.arange(101)
+        benchmarks = [
+            (scope, key, metric,
+             json.dumps(np.percentile(np.frombuffer(samples), percentiles).round(2).tolist()),
+             len(samples))
+            for (scope, key, metric), samples in values.items()
+        ]
+        self.db.database.replace_rate_benchmarks(benchmarks)
+        return len(benchmarks)
+
+    def percentile_rank(self, scope: str, key: str, metric: str, value: float) -> Optional[float]:
+        """
+        Доля курьеров в разрезе с показателем не выше value
+
+        Args:
+            scope: all, service или hour
+            key: Сервис или час ('' для all)
+            metric: earnings_per_hour или orders_per_hour
+            value: Показатель курьера
+
+        Returns:
+            Процент от 0 до 100 или None, если данных по разрезу мало
+        """
+        self._schedule_refresh()
+        quantiles = self._quantiles.get((scope, key, metric))
+        if not quantiles or self._sample_sizes.get((scope, key, metric), 0) < self.min_sample_size:
+            return None
+        # Точка i - i-й перцентиль: число точек не выше value - место курьера
+        return float(min(max(bisect_right(quantiles, value) - 1, 0), 100))
+
+    def top_percent(self, scope: str, key: str, metric: str, value: float) -> Optional[int]:
+        """В какие топ N% курьеров разреза входит показатель (None, если данных мало)"""
+        rank = self.percentile_rank(scope, key, metric, value)
+        return None if rank is None else max(int(round(100 - rank)), 1)
+
+    def median(self, scope: str, key: str, metric: str) -> Optional[float]:
+        """Медиана показателя в разрезе (None, если данных мало)"""
+        quantiles = self._quantiles.get((scope, key, metric))
+        if not quantiles or self._sample_sizes.get((scope, key, metric), 0) < self.min_sample_size:
+            return None
+        return quantiles[50]
+
+    def _schedule_refresh(self):
+        if time.monotonic() < self._next_check:
+            return
+        self._start_refresh()
+
+    def _start_refresh(self):
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        self._next_check = time.monotonic() + self.refresh_interval
+        self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_safely())
+
+    async def _refresh_safely(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Ошибка при пересчете распределений дохода: {e}")
+
+
+rate_benchmarks = RateBenchmarks(AsyncDatabase())
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Optional
+import aiohttp
+from dotenv import load_dotenv
+from services.metrics import gemini_duration, gemini_requests
+
+# Gemini API client: one pooled HTTP session for the whole bot.
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = "https://generativelanguage.googleapis.com/v1beta"
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+
+class GeminiError(Exception):
+    """Ошибка запроса к Gemini API"""
+
+
+class GeminiClient:
+    """
+    Асинхронный клиент Gemini API.
+
+    Держит одну aiohttp-сессию с пулом keep-alive соединений, ограничивает
+    число одновременных запросов и время каждого запроса.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        api_url: Optional[str] = None,
+        model: Optional[str] = None,
+        timeout: float = 20,
+        max_concurrency: int = 8,
+    ):
+        """
+        Args:
+            api_key: Ключ API (по умолчанию GEMINI_API_KEY)
+            api_url: Базовый URL API (по умолчанию GEMINI_API_URL, для тестов - адрес локальной заглушки)
+            model: Модель (по умолчанию GEMINI_MODEL)
+            timeout: Таймаут одного запроса в секундах
+            max_concurrency: Максимум одновременных запросов к API
+        """
+        self.api_key = api_key or os.getenv('GEMINI_API_KEY')
+        self.api_url = (api_url or os.getenv('GEMINI_API_URL', DEFAULT_API_URL)).rstrip('/')
+        self.model = model or os.getenv('GEMINI_MODEL', DEFAULT_MODEL)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        """Создает HTTP-сессию (вызывается один раз при запуске бота)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            logger.info(f"HTTP-сессия Gemini создана: {self.api_url}")
+
+    async def close(self):
+        """Закрывает HTTP-сессию"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP-сессия Gemini закрыта")
+        self._session = None
+
+    async def generate(self, prompt: str) -> Optional[str]:
+        """
+        Запрашивает ответ модели
+
+        Args:
+            prompt: Полный текст промпта
+
+        Returns:
+            Текст ответа или None, если ответ пустой
+
+        Raises:
+            GeminiError: При ошибке HTTP, сети или таймауте
+        """
+        if self._session is None or self._session.closed:
+            await self.start()
+
+        url = f"{self.api_url}/models/{self.model}:generateContent"
+        payload = {
+            "contents": [{
+                "parts": [{
+                    "text": prompt
+                }]
+            }]
+        }
+
+        start = time.perf_counter()
+        try:
+            async with self._semaphore:
+                async with self._session.post(url, json=payload, headers={'x-goog-api-key': self.api_key}) as response:
+                    response.raise_for_status()
+                    response_data = await response.json()
+        except aiohttp.ClientResponseError as e:
+            gemini_requests.inc(mode='generate', result='http_error')
+            raise GeminiError(f"HTTP ошибка {e.status}: {e.message}") from e
+        except asyncio.TimeoutError as e:
+            gemini_requests.inc(mode='generate', result='timeout')
+            raise GeminiError("Превышено время ожидания ответа") from e
+        except aiohttp.ClientError as e:
+            gemini_requests.inc(mode='generate', result='network_error')
+            raise GeminiError(f"Ошибка соединения: {e}") from e
+        finally:
+            gemini_duration.observe(time.perf_counter() - start, mode='generate')
+
+        text = self._extract_text(response_data)
+        gemini_requests.inc(mode='generate', result='ok' if text else 'empty')
+        return text
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Запрашивает ответ модели потоком (streamGenerateContent, SSE)
+
+        Args:
+            prompt: Полный текст промпта
+
+        Yields:
+            Очередные фрагменты текста ответа
+
+        Raises:
+            GeminiError: При ошибке HTTP, сети или если поток надолго замолчал
+        """
+        if self._session is None or self._session.closed:
+            await self.start()
+
+        url = f"{self.api_url}/models/{self.model}:streamGenerateContent"
+        payload = {
+            "contents": [{
+                "parts": [{
+                    "text": prompt
+                }]
+            }]
+        }
+        # Длинный ответ может идти дольше общего таймаута, поэтому ограничиваем паузу между фрагментами
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout.total, sock_read=self.timeout.total)
+
+        start = time.perf_counter()
+        received = False
+        try:
+            async with self._semaphore:
+                async with self._session.post(
+                    url,
+                    params={'alt': 'sse'},
+                    json=payload,
+                    headers={'x-goog-api-key': self.api_key},
+                    timeout=timeout
+                ) as response:
+                    response.raise_for_status()
+                    async for line in response.content:
+                        line = line.strip()
+                        if not line.startswith(b'data:'):
+                            continue
+                        text = self._extract_text(json.loads(line[5:]), warn=False)
+                        if text:
+                            if not received:
+                                received = True
+                                gemini_duration.observe(time.perf_counter() - start, mode='stream_first_chunk')
+                            yield text
+        except aiohttp.ClientResponseError as e:
+            gemini_requests.inc(mode='stream', result='http_error')
+            raise GeminiError(f"HTTP ошибка {e.status}: {e.message}") from e
+        except asyncio.TimeoutError as e:
+            gemini_requests.inc(mode='stream', result='timeout')
+            raise GeminiError("Превышено время ожидания ответа") from e
+        except aiohttp.ClientError as e:
+            gemini_requests.inc(mode='stream', result='network_error')
+            raise GeminiError(f"Ошибка соединения: {e}") from e
+        except ValueError as e:
+            gemini_requests.inc(mode='stream', result='bad_chunk')
+            raise GeminiError(f"Некорректный фрагмент потока: {e}") from e
+        finally:
+            gemini_duration.observe(time.perf_counter() - start, mode='stream')
+
+        gemini_requests.inc(mode='stream', result='ok' if received else 'empty')
+
+    @staticmethod
+    def _extract_text(response_data: dict, warn: bool = True) -> Optional[str]:
+        """Достает текст из ответа generateContent (или фрагмента потока)"""
+        candidates = response_data.get('candidates')
+        if not candidates:
+            if warn:
+                logger.warning("Ответ не содержит candidates")
+            return None
+
+        parts = candidates[0].get('content', {}).get('parts') or []
+        return ''.join(part.get('text', '') for part in parts) or None
+
+
+# Общий клиент: сессия создается при запуске бота и переиспользуется всеми запросами
+gemini_client = GeminiClient()
@@ -0,0 +1,136 @@
+import json
+import logging
+from pathlib import Path
+from typing import Optional
+
+# Local pre-filter for AI questions, trained on dataset.json at startup.
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+except ImportError:  # Без scikit-learn все вопросы уходят в Gemini
+    TfidfVectorizer = None
+
+DATASET_PATH = Path(__file__).resolve().parent.parent / "dataset.json"
+
+# Категории датасета -> темы ИИ советов
+CATEGORY_TOPICS = {
+    "юридические вопросы": "legal",
+    "здоровье": "nutrition",
+    "транспорт": "vehicle",
+    "заработок": "optimization",
+}
+
+
+class QuestionClassifier:
+    """
+    Классификатор вопросов: TF-IDF по символьным n-граммам + логистическая регрессия.
+
+    Отсекает вопросы не о курьерстве до запроса к Gemini и подсказывает тему.
+    Пока модель не обучена, пропускает все вопросы.
+    """
+
+    def __init__(self, reject_threshold: float = 0.35, topic_threshold: float = 0.5, regularization: float = 30):
+        """
+        Args:
+            reject_threshold: Вопрос отклоняется, если вероятность "о курьерстве" ниже порога
+            topic_threshold: Минимальная вероятность темы для подсказки
+            regularization: Параметр C логистической регрессии (датасет маленький, штраф слабый)
+        """
+        self.reject_threshold = reject_threshold
+        self.topic_threshold = topic_threshold
+        self.regularization = regularization
+        self._vectorizer = None
+        # Веса всех моделей одной матрицей: столбец 0 - "о курьерстве", остальные - темы
+        self._weights = None
+        self._bias = None
+        self._topics = []
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._weights is not None
+
+    def load(self, path: Path = DATASET_PATH) -> bool:
+        """
+        Обучает модели на датасете (один раз при запуске бота)
+
+        Args:
+            path: Путь к dataset.json
+
+        Returns:
+            True если модели обучены, False если классификатор недоступен
+        """
+        if TfidfVectorizer is None:
+            logger.warning("scikit-learn не установлен, фильтр вопросов отключен")
+            return False
+
+        try:
+            with open(path, encoding='utf-8') as f:
+                dataset = json.load(f)
+
+            questions = [item['question'] for item in dataset]
+            vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=(2, 4), lowercase=True)
+            features = vectorizer.fit_transform(questions)
+
+            models = [self._fit(features, [bool(item['is_courier']) for item in dataset])]
+
+            # По модели "тема / не тема" на каждую категорию с примерами обоих классов
+            topics = []
+            for category, topic in CATEGORY_TOPICS.items():
+                labels = [category in item.get('categories', []) for item in dataset]
+                if any(labels) and not all(labels):
+                    models.append(self._fit(features, labels))
+                    topics.append(topic)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Ошибка при обучении классификатора вопросов: {e}")
+            return False
+
+        self._vectorizer = vectorizer
+        self._weights = np.vstack([model.coef_[0] for model in models]).T
+        self._bias = np.array([model.intercept_[0] for model in models])
+        self._topics = topics
+        logger.info(f"Классификатор вопросов обучен на {len(questions)} примерах")
+        return True
+
+    def _fit(self, features, labels) -> "LogisticRegression":
+        return LogisticRegression(C=self.regularization, class_weight='balanced').fit(features, labels)
+
+    def _predict(self, question: str):
+        """Вероятности всех моделей за одно умножение разреженного вектора на матрицу весов"""
+        scores = self._vectorizer.transform([question]) @ self._weights + self._bias
+        return 1 / (1 + np.exp(-np.asarray(scores).ravel()))
+
+    def courier_probability(self, question: str) -> Optional[float]:
+        """
+        Вероятность того, что вопрос о курьерстве
+
+        Returns:
+            Вероятность или None, если модель не обучена
+        """
+        if not self.is_loaded:
+            return None
+        return float(self._predict(question)[0])
+
+    def is_courier_question(self, question: str) -> bool:
+        """Проверяет, стоит ли отправлять вопрос в Gemini"""
+        probability = self.courier_probability(question)
+        return probability is None or probability >= self.reject_threshold
+
+    def suggest_topic(self, question: str) -> Optional[str]:
+        """
+        Подсказывает тему вопроса
+
+        Returns:
+            Тема (legal, nutrition, vehicle, optimization) или None
+        """
+        if not self.is_loaded or not self._topics:
+            return None
+
+        probabilities = self._predict(question)[1:]
+        best = int(probabilities.argmax())
+        return self._topics[best] if probabilities[best] >= self.topic_threshold else None
+
+
+question_classifier = QuestionClassifier()
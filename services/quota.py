@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Optional, Tuple
+from database import AsyncDatabase
+from services.metrics import quota_events
+
+# Per-user daily AI quota: in-memory counters, write-behind to the ai_quota table.
+logger = logging.getLogger(__name__)
+
+
+class QuotaService:
+    """
+    Дневная квота вопросов к ИИ.
+
+    Проверка и списание идут по счетчикам в памяти, изменения копятся и
+    раз в flush_interval пачкой записываются в таблицу ai_quota (фоновая
+    задача, см. start). После записи счетчики с изменениями берутся из базы,
+    остальные выгружаются и при следующем вопросе читаются заново. Поэтому
+    расход других процессов учитывается с задержкой не больше двух
+    flush_interval (запись там и перечитывание здесь).
+    """
+
+    def __init__(self, db: AsyncDatabase, daily_limit: int = 6, flush_interval: float = 5):
+        """
+        Args:
+            db: База данных
+            daily_limit: Максимум вопросов в сутки на пользователя
+            flush_interval: Как часто (сек) записывать накопленный расход
+        """
+        self.db = db
+        self.daily_limit = daily_limit
+        self.flush_interval = flush_interval
+        self._used: Dict[Tuple[int, str], int] = {}
+        self._pending: Dict[Tuple[int, str], int] = defaultdict(int)
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запускает периодическую запись расхода (вызывается при старте бота)"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Останавливает периодическую запись и записывает остаток"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def try_consume(self, user_id: int) -> Optional[Tuple[int, str]]:
+        """
+        Списывает один вопрос, если квота не исчерпана
+
+        Args:
+            user_id: ID пользователя
+
+        Returns:
+            Ключ списания (user_id, день) для release или None, если квота на сегодня исчерпана
+        """
+        key = (user_id, date.today().isoformat())
+        if key not in self._used:
+            used = await self.db.get_ai_quota_used(*key)
+            # Пока шел запрос, счетчик мог появиться из параллельного вызова;
+            # незаписанные возвраты (release) еще не попали в базу
+            self._used.setdefault(key, used + self._pending.get(key, 0))
+
+        if self._used[key] >= self.daily_limit:
+            quota_events.inc(event='rejected')
+            return None
+
+        self._add(key, 1)
+        quota_events.inc(event='consumed')
+        return key
+
+    def release(self, key: Tuple[int, str]):
+        """
+        Возвращает вопрос в квоту (например, если запрос к API не удался)
+
+        Args:
+            key: Ключ из try_consume: вопрос, заданный до полуночи, возвращается в свой день
+        """
+        # Выгруженный после записи счетчик тоже возвращается: остаток не уйдет ниже нуля в базе
+        if self._used.get(key, 1) > 0:
+            self._add(key, -1)
+            quota_events.inc(event='released')
+
+    def remaining(self, user_id: int) -> Optional[int]:
+        """Сколько вопросов осталось на сегодня (None, если счетчик еще не загружен)"""
+        used = self._used.get((user_id, date.today().isoformat()))
+        return None if used is None else max(self.daily_limit - used, 0)
+
+    def _add(self, key: Tuple[int, str], delta: int):
+        if key in self._used:
+            self._used[key] += delta
+        self._pending[key] += delta
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при записи расхода квоты ИИ: {e}")
+
+    async def flush(self):
+        """Записывает накопленный расход в базу и сбрасывает счетчики без изменений"""
+        pending = {key: delta for key, delta in self._pending.items() if delta}
+        self._pending.clear()
+
+        totals = await self.db.add_ai_quota_usage(pending) if pending else {}
+        if pending and not totals:
+            # Запись не удалась - попробуем в следующий раз
+            for key, delta in pending.items():
+                self._pending[key] += delta
+            return
+
+        for key in list(self._used):
+            if key in totals:
+                # Итог из базы плюс то, что успели списать во время записи
+                self._used[key] = totals[key] + self._pending.get(key, 0)
+            elif not self._pending.get(key):
+                # Счетчик мог измениться в другом процессе: при следующем вопросе прочитаем из базы
+                del self._used[key]
+
+
+quota_service = QuotaService(AsyncDatabase())
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+# Single-flight: concurrent calls with the same key share one in-flight request.
+logger = logging.getLogger(__name__)
+
+
+class CallCancelled(Exception):
+    """Общий запрос отменен у первого вызова: ожидающие получают ошибку, а не отмену себя"""
+
+
+class _Call:
+    __slots__ = ('future', 'waiters')
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов.
+
+    Первый вызов с ключом выполняет запрос, остальные ждут его результата
+    (или исключения). К одному запросу присоединяется не больше max_waiters
+    ожидающих, следующий вызов запускает новый запрос.
+    """
+
+    def __init__(self, max_waiters: int = 100):
+        """
+        Args:
+            max_waiters: Максимум ожидающих на один запрос
+        """
+        self.max_waiters = max_waiters
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Выполняет func или дожидается уже идущего вызова с тем же ключом
+
+        Args:
+            key: Ключ запроса
+            func: Функция запроса (вызывается только первым)
+
+        Returns:
+            Кортеж (результат, shared): shared=True, если результат получен от чужого запроса
+
+        Raises:
+            Исключение func - всем, кто ждал этот запрос;
+            CallCancelled - ожидающим, если отменили первый вызов
+        """
+        call = self._calls.get(key)
+        if call is not None and call.waiters < self.max_waiters:
+            call.waiters += 1
+            # shield: отмена одного ожидающего не отменяет общий запрос
+            return await asyncio.shield(call.future), True
+
+        call = _Call(asyncio.get_running_loop().create_future())
+        self._calls[key] = call
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            # cancel() у future отменил бы и ожидающих: они не смогли бы обработать ошибку
+            call.future.set_exception(CallCancelled(f"Запрос {key} отменен"))
+            call.future.exception()
+            raise
+        except Exception as e:
+            call.future.set_exception(e)
+            # Исключение получат ожидающие; если их нет, asyncio не должен ругаться
+            call.future.exception()
+            raise
+        else:
+            call.future.set_result(result)
+            if call.waiters:
+                logger.info(f"Запрос {key} разделен с ожидающими: {call.waiters}")
+            return result, False
+        finally:
+            if self._calls.get(key) is call:
+                del self._calls[key]
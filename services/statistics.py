@@ -1,49 +1,227 @@
-from datetime import datetime
 import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
 from database import Database
 
+# Vectorized courier analytics over columnar session arrays (backs the detailed profile view).
 logger = logging.getLogger(__name__)
 db = Database()
-# Not using! User statistic, sklearn in future version.
 
-def calculate_user_statistics(user_id: int) -> dict:
-    try:
-        sessions = db.get_user_sessions(user_id)
-        if not sessions:
-            return {
-                'total_shifts': 0,
-                'total_hours': 0,
-                'total_earnings': 0,
-                'total_orders': 0,
-                'avg_shift_duration': 0,
-                'avg_earnings_per_hour': 0
-            }
-
-        total_hours = 0
-        total_earnings = 0
-        total_orders = 0
-
-        for session in sessions:
-            if session.get('start_time') and session.get('end_time'):
-                start_dt = datetime.strptime(session['start_time'], '%Y-%m-%d %H:%M:%S')
-                end_dt = datetime.strptime(session['end_time'], '%Y-%m-%d %H:%M:%S')
-                session_hours = (end_dt - start_dt).total_seconds() / 3600
-                total_hours += session_hours
-            
-            total_earnings += session.get('earnings', 0)
-            total_orders += session.get('order_count', 0)
-
-        avg_shift_duration = total_hours / len(sessions) if sessions else 0
-        avg_earnings_per_hour = total_earnings / total_hours if total_hours > 0 else 0
+HOUR = 3600
+DAY = 24 * HOUR
+# 1 января 1970 - четверг: (дней с эпохи + 3) % 7 дает 0 для понедельника
+EPOCH_WEEKDAY_SHIFT = 3
+PERCENTILES = (25, 50, 75, 90)
+
+
+def to_epoch(dt: datetime) -> int:
+    """Время без часового пояса в секундах, как strftime('%s') в SQLite"""
+    return int((dt - datetime(1970, 1, 1)).total_seconds())
+
 
+def load_session_arrays(rows: List[Tuple[int, float, float, int, str]]) -> Dict[str, np.ndarray]:
+    """
+    Переводит строки Database.get_session_columns в колонки NumPy
+
+    Args:
+        rows: Список (начало в секундах, длительность в часах, заработок, заказы, сервис)
+
+    Returns:
+        Dict с массивами start, duration, earnings, orders, service
+    """
+    if not rows:
         return {
-            'total_shifts': len(sessions),
-            'total_hours': round(total_hours, 2),
-            'total_earnings': round(total_earnings, 2),
-            'total_orders': total_orders,
-            'avg_shift_duration': round(avg_shift_duration, 2),
-            'avg_earnings_per_hour': round(avg_earnings_per_hour, 2)
+            'start': np.empty(0, dtype=np.int64),
+            'duration': np.empty(0),
+            'earnings': np.empty(0),
+            'orders': np.empty(0, dtype=np.int64),
+            'service': np.empty(0, dtype=object),
+        }
+
+    start, duration, earnings, orders, service = zip(*rows)
+    return {
+        'start': np.array(start, dtype=np.int64),
+        'duration': np.array(duration, dtype=np.float64),
+        'earnings': np.array(earnings, dtype=np.float64),
+        'orders': np.array(orders, dtype=np.int64),
+        'service': np.array(service, dtype=object),
+    }
+
+
+def _hour_segments(start: np.ndarray, duration: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Режет смены на отрезки по календарным часам
+
+    Returns:
+        (индекс смены, начало часа в секундах, секунды смены внутри этого часа) для каждого отрезка
+    """
+    end = start + np.rint(duration * HOUR).astype(np.int64)
+    first_hour = start // HOUR
+    counts = (end - 1) // HOUR - first_hour + 1
+
+    shift_index = np.repeat(np.arange(len(start)), counts)
+    # Номер отрезка внутри своей смены: 0, 1, 2, ... для каждой смены
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    hour_start = (first_hour[shift_index] + offsets) * HOUR
+    seconds = (
+        np.minimum(end[shift_index], hour_start + HOUR) - np.maximum(start[shift_index], hour_start)
+    )
+    return shift_index, hour_start, seconds
+
+
+def _heatmap(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Часы работы и заработок по дням недели и часам суток (матрицы 7x24)
+
+    Заработок смены распределяется по часам пропорционально отработанному времени.
+    """
+    hours = np.zeros((7, 24))
+    earnings = np.zeros((7, 24))
+    if len(arrays['start']):
+        shift_index, hour_start, seconds = _hour_segments(arrays['start'], arrays['duration'])
+        weekday = (hour_start // DAY + EPOCH_WEEKDAY_SHIFT) % 7
+        hour = (hour_start // HOUR) % 24
+        cell = weekday * 24 + hour
+        share = seconds / (arrays['duration'][shift_index] * HOUR)
+        hours = np.bincount(cell, weights=seconds / HOUR, minlength=7 * 24).reshape(7, 24)
+        earnings = np.bincount(cell, weights=arrays['earnings'][shift_index] * share, minlength=7 * 24).reshape(7, 24)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(hours > 0, earnings / hours, 0.0)
+    return {'hours': hours, 'earnings': earnings, 'earnings_per_hour': rate}
+
+
+def _trends(arrays: Dict[str, np.ndarray], now: int) -> Dict[str, Any]:
+    """
+    Скользящие суммы за 7 и 30 дней: текущий период против предыдущего
+
+    Returns:
+        Dict с периодами 7 и 30 (заработок, часы, доход в час и изменение к прошлому периоду)
+        и daily_7d - скользящий заработок за 7 дней на каждый из последних 30 дней
+    """
+    today = now // DAY
+    window = 60
+    day = arrays['start'] // DAY
+    recent = day > today - window
+    index = (day[recent] - (today - window + 1)).astype(np.int64)
+    daily_earnings = np.bincount(index, weights=arrays['earnings'][recent], minlength=window)[:window]
+    daily_hours = np.bincount(index, weights=arrays['duration'][recent], minlength=window)[:window]
+
+    trends: Dict[str, Any] = {}
+    for days in (7, 30):
+        current = slice(window - days, window)
+        previous = slice(window - 2 * days, window - days)
+        earnings, hours = daily_earnings[current].sum(), daily_hours[current].sum()
+        previous_earnings, previous_hours = daily_earnings[previous].sum(), daily_hours[previous].sum()
+        rate = earnings / hours if hours else 0.0
+        previous_rate = previous_earnings / previous_hours if previous_hours else 0.0
+        trends[days] = {
+            'earnings': round(float(earnings), 2),
+            'hours': round(float(hours), 2),
+            'earnings_per_hour': round(float(rate), 2),
+            'earnings_change': float(earnings / previous_earnings - 1) if previous_earnings else None,
+            'rate_change': float(rate / previous_rate - 1) if previous_rate else None,
+        }
+
+    cumulative = np.concatenate(([0.0], np.cumsum(daily_earnings)))
+    trends['daily_7d'] = (cumulative[7:] - cumulative[:-7])[-30:]
+    return trends
+
+
+def _by_service(arrays: Dict[str, np.ndarray]) -> Dict[str, Dict[str, float]]:
+    services, index = np.unique(arrays['service'].astype(str), return_inverse=True)
+    shifts = np.bincount(index, minlength=len(services))
+    hours = np.bincount(index, weights=arrays['duration'], minlength=len(services))
+    earnings = np.bincount(index, weights=arrays['earnings'], minlength=len(services))
+    orders = np.bincount(index, weights=arrays['orders'], minlength=len(services))
+    return {
+        str(service): {
+            'shifts': int(shifts[i]),
+            'hours': round(float(hours[i]), 2),
+            'earnings': round(float(earnings[i]), 2),
+            'earnings_per_hour': round(float(earnings[i] / hours[i]), 2) if hours[i] else 0.0,
+            'orders_per_hour': round(float(orders[i] / hours[i]), 2) if hours[i] else 0.0,
         }
+        for i, service in enumerate(services)
+    }
+
+
+def compute_statistics(arrays: Dict[str, np.ndarray], now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Считает статистику курьера по колонкам смен
+
+    Args:
+        arrays: Колонки из load_session_arrays
+        now: Текущее время (для трендов)
+
+    Returns:
+        Dict с итогами, доходом в час, перцентилями, трендами 7/30 дней,
+        разбивкой по сервисам, тепловой картой день недели x час и итогами по часу начала смены
+    """
+    shifts = len(arrays['start'])
+    total_hours = float(arrays['duration'].sum())
+    total_earnings = float(arrays['earnings'].sum())
+    total_orders = int(arrays['orders'].sum())
+
+    stats: Dict[str, Any] = {
+        'total_shifts': shifts,
+        'total_hours': round(total_hours, 2),
+        'total_earnings': round(total_earnings, 2),
+        'total_orders': total_orders,
+        'avg_shift_duration': round(total_hours / shifts, 2) if shifts else 0,
+        'avg_earnings_per_hour': round(total_earnings / total_hours, 2) if total_hours else 0,
+        'avg_orders_per_hour': round(total_orders / total_hours, 2) if total_hours else 0,
+    }
+    if not shifts:
+        return stats
+
+    shift_rate = arrays['earnings'] / arrays['duration']
+    stats['earnings_per_hour_percentiles'] = dict(zip(PERCENTILES, np.percentile(shift_rate, PERCENTILES).round(2)))
+    stats['shift_earnings_percentiles'] = dict(zip(PERCENTILES, np.percentile(arrays['earnings'], PERCENTILES).round(2)))
+    stats['trends'] = _trends(arrays, to_epoch(now or datetime.now()))
+    stats['services'] = _by_service(arrays)
+    stats['heatmap'] = _heatmap(arrays)
+    # По часу начала смены: в этом разрезе считаются распределения services/benchmarks.py
+    start_hour = (arrays['start'] // HOUR) % 24
+    stats['start_hours'] = {
+        'hours': np.bincount(start_hour, weights=arrays['duration'], minlength=24),
+        'earnings': np.bincount(start_hour, weights=arrays['earnings'], minlength=24),
+    }
+    return stats
+
+
+def best_time_slots(heatmap: Dict[str, np.ndarray], top: int = 3, min_hours: float = 2) -> List[Tuple[int, int, float]]:
+    """
+    Самые доходные часы недели
+
+    Args:
+        heatmap: Результат compute_statistics()['heatmap']
+        top: Сколько слотов вернуть
+        min_hours: Минимум отработанных часов в слоте (отсекает случайные выбросы)
+
+    Returns:
+        Список (день недели 0-6, час 0-23, доход в час)
+    """
+    rate = np.where(heatmap['hours'] >= min_hours, heatmap['earnings_per_hour'], -1.0).ravel()
+    best = np.argsort(rate)[::-1][:top]
+    return [(int(cell // 24), int(cell % 24), float(rate[cell])) for cell in best if rate[cell] > 0]
+
+
+def calculate_user_statistics(user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Полная статистика пользователя по всем его сменам
+
+    Читает базу синхронно: из обработчиков вызывается через AsyncDatabase.run.
+
+    Args:
+        user_id: ID пользователя
+
+    Returns:
+        Результат compute_statistics или None в случае ошибки
+    """
+    try:
+        return compute_statistics(load_session_arrays(db.get_session_columns(user_id)))
     except Exception as e:
-        logger.error(f"Error calculating statistics for user {user_id}: {e}")
-        return None
\ No newline at end of file
+        logger.error(f"Ошибка при расчете статистики пользователя {user_id}: {e}")
+        return None
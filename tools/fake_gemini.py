@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import json
+import logging
+from aiohttp import web
+
+# Local stand-in for the Gemini API: point GEMINI_API_URL at http://127.0.0.1:<port>/v1beta.
+logger = logging.getLogger(__name__)
+
+ANSWER = (
+    "Чтобы заработать больше, выходите на линию в часы пик: с 12 до 14 и с 18 до 21. "
+    "Держите телефон заряженным, берите заказы рядом с ресторанами и следите за статистикой смен. "
+    "Какие часы вы сейчас работаете?"
+)
+
+
+def _answer_for(request_body: dict) -> str:
+    prompt = request_body['contents'][0]['parts'][0]['text']
+    question = prompt.rsplit("Вопрос:", 1)[-1].strip()
+    return f"{ANSWER} (вопрос: {question})"
+
+
+def _response_chunk(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+
+async def generate_content(request: web.Request) -> web.Response:
+    body = await request.json()
+    await asyncio.sleep(request.app['delay'])
+    return web.json_response(_response_chunk(_answer_for(body)))
+
+
+async def stream_generate_content(request: web.Request) -> web.StreamResponse:
+    body = await request.json()
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+    await response.prepare(request)
+
+    await asyncio.sleep(request.app['first_chunk_delay'])
+    words = _answer_for(body).split(' ')
+    size = request.app['chunk_words']
+    for start in range(0, len(words), size):
+        text = ' '.join(words[start:start + size]) + ' '
+        await response.write(f"data: {json.dumps(_response_chunk(text), ensure_ascii=False)}\r\n\r\n".encode())
+        await asyncio.sleep(request.app['chunk_delay'])
+
+    await response.write_eof()
+    return response
+
+
+def create_app(delay: float = 1.0, first_chunk_delay: float = 0.2, chunk_delay: float = 0.15, chunk_words: int = 4) -> web.Application:
+    """
+    Создает приложение заглушки
+
+    Args:
+        delay: Задержка ответа generateContent
+        first_chunk_delay: Задержка до первого фрагмента streamGenerateContent
+        chunk_delay: Пауза между фрагментами потока
+        chunk_words: Слов во фрагменте потока
+    """
+    app = web.Application()
+    app['delay'] = delay
+    app['first_chunk_delay'] = first_chunk_delay
+    app['chunk_delay'] = chunk_delay
+    app['chunk_words'] = chunk_words
+    app.router.add_post('/v1beta/models/{model}:generateContent', generate_content)
+    app.router.add_post('/v1beta/models/{model}:streamGenerateContent', stream_generate_content)
+    return app
+
+
+async def start_server(port: int = 8090, **options) -> web.AppRunner:
+    """Запускает заглушку в текущем цикле событий (для бенчмарков и проверок)"""
+    runner = web.AppRunner(create_app(**options), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Gemini API")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--delay', type=float, default=1.0, help="Задержка обычного ответа, с")
+    parser.add_argument('--first-chunk-delay', type=float, default=0.2, help="Задержка первого фрагмента потока, с")
+    parser.add_argument('--chunk-delay', type=float, default=0.15, help="Пауза между фрагментами потока, с")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"Заглушка Gemini: GEMINI_API_URL=http://127.0.0.1:{args.port}/v1beta")
+    web.run_app(
+        create_app(args.delay, args.first_chunk_delay, args.chunk_delay),
+        host='127.0.0.1',
+        port=args.port,
+        print=None,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Synthetic database generator for query audits and benchmarks (never run against the real bot DB).
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import Database  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+SERVICES = ['yandex_food', 'yandex_express', 'glovo']
+TRANSPORTS = ['bike', 'car', 'foot', 'scooter']
+STREETS = ['Чуй', 'Манаса', 'Токтогула', 'Киевская', 'Ахунбаева', 'Жибек Жолу', 'Московская', 'Советская']
+ADVICE_TYPES = ['legal', 'nutrition', 'vehicle', 'optimization']
+FIRST_USER_ID = 100000
+
+
+def _session_rows(rng: random.Random, user_id: int, count: int, period_start: datetime, period_days: int):
+    for _ in range(count):
+        start = period_start + timedelta(days=rng.randrange(period_days), hours=rng.choice([8, 10, 11, 12, 16, 17, 18]))
+        hours = rng.uniform(2, 11)
+        yield (
+            user_id,
+            rng.choice(SERVICES),
+            start.strftime('%Y-%m-%d %H:%M:%S'),
+            (start + timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M:%S'),
+            round(hours * rng.uniform(150, 450), 2),
+            rng.randint(1, 20),
+        )
+
+
+def _order_row(rng: random.Random, user_id: int, session_id: int) -> tuple:
+    # rng.random() заметно быстрее randint/choice, а заказов десятки миллионов
+    r = rng.random
+    return (
+        user_id,
+        session_id,
+        f"{8 + int(r() * 15):02d}:{int(r() * 60):02d}",
+        f"ул. {STREETS[int(r() * len(STREETS))]}, {1 + int(r() * 200)}",
+        round(100 + r() * 500, 2),
+        round(0.5 + r() * 11.5, 1),
+        'completed',
+    )
+
+
+def generate(db_path: str, users: int = 1000, sessions_per_user: int = 50, orders_per_session: int = 3,
+             seed: int = 42, advice_per_user: int = 2, chunk_users: int = 1000) -> Database:
+    """
+    Заполняет новую базу синтетическими пользователями, сменами, заказами и советами
+
+    Данные пишутся порциями по chunk_users пользователей, поэтому память не растет
+    с объемом базы (100 тыс. пользователей и десятки миллионов смен и заказов).
+
+    Args:
+        db_path: Путь к файлу базы (файл не должен существовать)
+        users: Количество пользователей
+        sessions_per_user: Смен на пользователя
+        orders_per_session: Заказов на смену
+        seed: Зерно генератора случайных чисел (одинаковые данные при каждом запуске)
+        advice_per_user: Советов ИИ на пользователя
+        chunk_users: Пользователей в одной транзакции
+
+    Returns:
+        Database, открытая на новой базе
+    """
+    if os.path.exists(db_path):
+        raise FileExistsError(f"База {db_path} уже существует")
+
+    rng = random.Random(seed)
+    db = Database(db_path)
+    conn = db.conn
+    started = time.perf_counter()
+    period_start = datetime(2023, 1, 1)
+    period_days = 700
+    session_count = order_count = 0
+
+    # Потеря синтетической базы при сбое не страшна: fsync не нужен
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+    try:
+        for first in range(0, users, chunk_users):
+            user_ids = range(FIRST_USER_ID + first, FIRST_USER_ID + min(first + chunk_users, users))
+            with conn:
+                conn.executemany(
+                    "INSERT INTO users (user_id, username, transport, current_service) VALUES (?, ?, ?, ?)",
+                    [
+                        (user_id, f"courier{user_id - FIRST_USER_ID}", rng.choice(TRANSPORTS), rng.choice(SERVICES))
+                        for user_id in user_ids
+                    ]
+                )
+
+                session_rows = [
+                    row
+                    for user_id in user_ids
+                    for row in _session_rows(rng, user_id, sessions_per_user, period_start, period_days)
+                ]
+                conn.executemany(
+                    """
+                    INSERT INTO sessions (user_id, service, start_time, end_time, earnings, order_count)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    session_rows
+                )
+                # В новой базе ID смен идут подряд: последний ID порции минус ее размер
+                last_session_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                first_session_id = last_session_id - len(session_rows) + 1
+
+                conn.executemany(
+                    """
+                    INSERT INTO orders (user_id, session_id, time, address, price, distance, status)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        _order_row(rng, session[0], first_session_id + offset)
+                        for offset, session in enumerate(session_rows)
+                        for _ in range(orders_per_session)
+                    )
+                )
+
+                conn.executemany(
+                    """
+                    INSERT INTO ai_advice (user_id, advice_type, advice_text, related_data, question_key)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (user_id, rng.choice(ADVICE_TYPES), f"Совет {user_id}", None, f"вопрос {rng.randrange(500)}")
+                        for user_id in user_ids
+                        for _ in range(advice_per_user)
+                    ]
+                )
+
+            session_count += len(session_rows)
+            order_count += len(session_rows) * orders_per_session
+            logger.debug(f"Записано пользователей: {user_ids[-1] - FIRST_USER_ID + 1}/{users}")
+    finally:
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+    logger.info(
+        f"Синтетическая база {db_path}: {users} пользователей, {session_count} смен, "
+        f"{order_count} заказов за {time.perf_counter() - started:.1f} с"
+    )
+    return db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетической базы данных")
+    parser.add_argument('db_path', help="Путь к новой базе")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--sessions', type=int, default=50, help="Смен на пользователя")
+    parser.add_argument('--orders', type=int, default=3, help="Заказов на смену")
+    parser.add_argument('--advice', type=int, default=2, help="Советов ИИ на пользователя")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--large', action='store_true',
+                        help="Объем продакшена: 100 тыс. пользователей по 200 смен (20 млн смен, 60 млн заказов)")
+    args = parser.parse_args()
+
+    if args.large:
+        args.users, args.sessions = 100000, 200
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = generate(args.db_path, args.users, args.sessions, args.orders, args.seed, args.advice)
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
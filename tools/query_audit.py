@@ -0,0 +1,152 @@
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# EXPLAIN QUERY PLAN audit: runs every Database method on a synthetic DB and flags full scans and temp B-trees.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import Database  # noqa: E402
+from tools.generate_data import FIRST_USER_ID, generate  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# Служебные запросы, план которых не интересен
+SKIPPED_STATEMENTS = ('PRAGMA', 'CREATE', 'ALTER', 'DROP', 'BEGIN', 'COMMIT', 'ROLLBACK',
+                      'SAVEPOINT', 'RELEASE', 'EXPLAIN', 'ANALYZE')
+
+ORDER = {'time': '12:30', 'address': 'ул. Чуй, 1', 'price': 250.0, 'distance': 3.5}
+
+
+def exercise(db: Database, user_id: int):
+    """
+    Вызывает все методы Database, работающие с данными (запросы запоминаются трассировкой)
+
+    Args:
+        db: База данных с включенной записью запросов
+        user_id: Существующий пользователь
+    """
+    new_user_id = user_id + 10 ** 9
+    session_id = db.get_last_session_id(user_id)
+    start = datetime(2024, 5, 1, 9, 0)
+    day = datetime.now().strftime('%Y-%m-%d')
+
+    calls = [
+        ('get_or_create_user', lambda: db.get_or_create_user(user_id, 'courier')),
+        ('get_or_create_user (новый)', lambda: db.get_or_create_user(new_user_id, 'new')),
+        ('flush_user_activity', db.flush_user_activity),
+        ('get_user_sessions', lambda: db.get_user_sessions(user_id)),
+        ('get_session', lambda: db.get_session(session_id)),
+        ('get_user_transport', lambda: db.get_user_transport(user_id)),
+        ('get_user_service', lambda: db.get_user_service(new_user_id)),
+        ('update_user_service', lambda: db.update_user_service(user_id, 'glovo')),
+        ('update_user_transport', lambda: db.update_user_transport(user_id, 'bike')),
+        ('add_session', lambda: db.add_session(user_id, 'glovo', start.strftime('%Y-%m-%d %H:%M:%S'))),
+        ('end_session', lambda: db.end_session(db.get_last_session_id(user_id), 1500, 5)),
+        ('update_session', lambda: db.update_session(session_id, weather='rain')),
+        ('record_completed_session', lambda: db.record_completed_session(
+            user_id, None, start, start + timedelta(hours=6), 2400, 8)),
+        ('add_order', lambda: db.add_order(user_id, session_id, ORDER)),
+        ('save_order', lambda: db.save_order(user_id, ORDER)),
+        ('get_orders_by_session', lambda: db.get_orders_by_session(session_id)),
+        ('get_user_orders', lambda: db.get_user_orders(user_id)),
+        ('get_order_by_id', lambda: db.get_order_by_id(db.get_user_orders(user_id, 1)[0]['id'])),
+        ('update_order', lambda: db.update_order(db.get_user_orders(user_id, 1)[0]['id'], price=300)),
+        ('update_order_field', lambda: db.update_order_field(db.get_user_orders(user_id, 1)[0]['id'], 'price', 310)),
+        ('delete_order', lambda: db.delete_order(db.get_user_orders(user_id, 1)[0]['id'])),
+        ('save_temporary_order', lambda: db.save_temporary_order(user_id, ORDER)),
+        ('delete_temporary_order', lambda: db.delete_temporary_order(1)),
+        ('add_ai_advice', lambda: db.add_ai_advice(user_id, 'legal', 'Совет', None, question_key='вопрос 1')),
+        ('get_user_advice', lambda: db.get_user_advice(user_id)),
+        ('get_user_advice (тема)', lambda: db.get_user_advice(user_id, 'legal')),
+        ('find_cached_advice', lambda: db.find_cached_advice('legal', 'вопрос 1', 7 * 24 * 3600)),
+        ('get_cached_advice', lambda: db.get_cached_advice(7 * 24 * 3600, 2000)),
+        ('get_ai_quota_used', lambda: db.get_ai_quota_used(user_id, day)),
+        ('add_ai_quota_usage', lambda: db.add_ai_quota_usage({(user_id, day): 1})),
+        ('set_fsm_records', lambda: db.set_fsm_records([(f"fsm:{user_id}", 'S:a', '{}')])),
+        ('get_fsm_record', lambda: db.get_fsm_record(f"fsm:{user_id}")),
+        ('delete_expired_fsm_records', lambda: db.delete_expired_fsm_records(24 * 3600)),
+        ('get_user_statistics', lambda: db.get_user_statistics(user_id)),
+        ('get_detailed_statistics', lambda: db.get_detailed_statistics(user_id)),
+        ('rebuild_user_stats', lambda: db.rebuild_user_stats(user_id)),
+    ]
+
+    for name, call in calls:
+        started = time.perf_counter()
+        try:
+            call()
+        except Exception as e:
+            logger.warning(f"{name}: {e}")
+        logger.info(f"{name}: {(time.perf_counter() - started) * 1000:.2f} мс")
+
+
+def find_problems(plan):
+    """Полные проходы по таблицам и временные B-деревья в плане запроса"""
+    problems = []
+    for detail in plan:
+        if detail.startswith('SCAN ') and not detail.startswith('SCAN CONSTANT ROW'):
+            problems.append(detail)
+        elif 'TEMP B-TREE' in detail:
+            problems.append(detail)
+    return problems
+
+
+def audit(db: Database) -> int:
+    """
+    Печатает планы всех записанных запросов
+
+    Returns:
+        Количество запросов с проблемами в плане
+    """
+    flagged = 0
+    for sql, parameters in db.get_recorded_queries().items():
+        statement = sql.lstrip().split(None, 1)[0].upper()
+        if statement in SKIPPED_STATEMENTS:
+            continue
+
+        try:
+            plan = db.explain_query_plan(sql, parameters)
+        except Exception as e:
+            logger.warning(f"Не удалось построить план: {e}: {' '.join(sql.split())}")
+            continue
+
+        problems = find_problems(plan)
+        flagged += bool(problems)
+        print(("⚠️ " if problems else "✅ ") + ' '.join(sql.split()))
+        for detail in plan:
+            print(f"      {'!!' if detail in problems else '  '} {detail}")
+    return flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Аудит планов запросов database.py")
+    parser.add_argument('--db', help="Готовая синтетическая база (по умолчанию создается временная)")
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--sessions', type=int, default=50, help="Смен на пользователя")
+    parser.add_argument('--slow-ms', type=float, default=20, help="Порог лога медленных запросов, мс")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    logging.getLogger(__name__).setLevel(logging.INFO)
+
+    if args.db and os.path.exists(args.db):
+        db = Database(args.db)
+    else:
+        db_path = args.db or os.path.join(tempfile.mkdtemp(), 'audit.db')
+        db = generate(db_path, users=args.users, sessions_per_user=args.sessions)
+
+    db.enable_query_trace(slow_query_ms=args.slow_ms, record=True)
+    exercise(db, FIRST_USER_ID + 1)
+    flagged = audit(db)
+    db.close()
+
+    print(f"\nЗапросов с полным проходом или временным B-деревом: {flagged}")
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import signal
+from typing import Any, Dict, Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+# Webhook mode: embedded aiohttp server, 200 right away, handlers in the background.
+logger = logging.getLogger(__name__)
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """
+    Прием апдейтов по вебхуку с ограничением одновременно обрабатываемых.
+
+    Telegram получает ответ 200 сразу после разбора JSON, апдейт обрабатывается
+    в фоне. Одновременно работают не больше max_concurrent_updates обработчиков,
+    остальные ждут очереди. Если очередь длиннее max_pending_updates, апдейт
+    не принимается (503) и Telegram пришлет его повторно.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        secret_token: Optional[str] = None,
+        max_concurrent_updates: int = 64,
+        max_pending_updates: int = 1000,
+        shutdown_timeout: float = 10,
+        **data: Any,
+    ):
+        """
+        Args:
+            dispatcher: Диспетчер бота
+            bot: Бот
+            secret_token: Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+            max_concurrent_updates: Максимум одновременно работающих обработчиков
+            max_pending_updates: Максимум принятых, но еще не обработанных апдейтов
+            shutdown_timeout: Сколько секунд ждать фоновые обработчики при остановке
+        """
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.max_concurrent_updates = max_concurrent_updates
+        self.max_pending_updates = max_pending_updates
+        self.shutdown_timeout = shutdown_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent_updates)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if len(self._background_feed_update_tasks) >= self.max_pending_updates:
+            logger.warning("Очередь апдейтов переполнена, апдейт отклонен")
+            return web.Response(status=503)
+        return await super()._handle_request_background(bot, request)
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        async with self._semaphore:
+            try:
+                await super()._background_feed_update(bot, update)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+
+    async def close(self) -> None:
+        """Дожидается фоновых обработчиков и закрывает сессию бота"""
+        if self._background_feed_update_tasks:
+            logger.info(f"Ожидание обработки апдейтов: {len(self._background_feed_update_tasks)}")
+            await asyncio.wait(set(self._background_feed_update_tasks), timeout=self.shutdown_timeout)
+        await super().close()
+
+
+def create_app(
+    dp: Dispatcher,
+    bot: Bot,
+    path: str = '/webhook',
+    secret_token: Optional[str] = None,
+    base_url: Optional[str] = None,
+    max_concurrent_updates: int = 64,
+) -> web.Application:
+    """
+    Создает aiohttp-приложение для приема апдейтов
+
+    Args:
+        dp: Диспетчер бота
+        bot: Бот
+        path: Путь вебхука
+        secret_token: Секретный токен вебхука
+        base_url: Внешний адрес сервера; если указан, вебхук регистрируется при запуске
+        max_concurrent_updates: Максимум одновременно работающих обработчиков
+
+    Returns:
+        Приложение aiohttp
+    """
+    app = web.Application()
+    handler = LimitedRequestHandler(
+        dp,
+        bot,
+        secret_token=secret_token,
+        max_concurrent_updates=max_concurrent_updates,
+    )
+    handler.register(app, path=path)
+    setup_application(app, dp, bot=bot)
+
+    if base_url:
+        async def set_webhook(_app: web.Application):
+            url = base_url.rstrip('/') + path
+            await bot.set_webhook(
+                url,
+                secret_token=secret_token,
+                max_connections=min(max_concurrent_updates, 100),
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logger.info(f"Вебхук установлен: {url}")
+
+        app.on_startup.append(set_webhook)
+
+    return app
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    host: str = '127.0.0.1',
+    port: int = 8080,
+    keepalive_timeout: float = 75,
+    **app_options: Any,
+):
+    """
+    Запускает сервер вебхука и работает до SIGINT/SIGTERM
+
+    Args:
+        dp: Диспетчер бота
+        bot: Бот
+        host: Адрес, на котором слушает сервер
+        port: Порт сервера
+        keepalive_timeout: Сколько секунд держать открытым соединение без запросов
+        app_options: Параметры create_app (path, secret_token, base_url, max_concurrent_updates)
+    """
+    await serve_app(create_app(dp, bot, **app_options), host, port, keepalive_timeout)
+
+
+async def serve_app(app: web.Application, host: str, port: int, keepalive_timeout: float = 75):
+    """Обслуживает aiohttp-приложение до SIGINT/SIGTERM"""
+    # Telegram переиспользует соединения, keep-alive экономит TLS-рукопожатия на прокси
+    runner = web.AppRunner(app, keepalive_timeout=keepalive_timeout, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Сервер вебхука запущен на {host}:{port}")
+
+    try:
+        await wait_for_stop_signal()
+        logger.info("Остановка сервера вебхука")
+    finally:
+        await runner.cleanup()
+
+
+async def wait_for_stop_signal():
+    """Ждет SIGINT или SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    await stop.wait()
@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from aiohttp import web
+from aiogram import Bot
+from aiogram.methods import TelegramMethod
+from app import configure_logging, create_bot, create_database, create_dispatcher
+from webhook import serve_app, wait_for_stop_signal
+
+# Multi-process fan-out: the front process shards updates across workers by user_id.
+logger = logging.getLogger(__name__)
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """
+    Определяет пользователя, от которого пришел апдейт
+
+    Args:
+        update: Апдейт в виде JSON-словаря
+
+    Returns:
+        ID пользователя (или чата) или None
+    """
+    for key, event in update.items():
+        if key == 'update_id' or not isinstance(event, dict):
+            continue
+        for field in ('from', 'user', 'chat'):
+            sender = event.get(field)
+            if isinstance(sender, dict) and 'id' in sender:
+                return sender['id']
+    return None
+
+
+class UpdateRouter:
+    """
+    Распределение апдейтов по процессам-обработчикам.
+
+    Все апдейты одного пользователя попадают в один процесс по hash(user_id),
+    поэтому его сценарии (SessionStates, AIAdviceStates) идут по порядку,
+    а кэши процесса (пользователи, FSM, квота) остаются согласованными.
+    """
+
+    def __init__(self, workers: int, queue_size: int = 1000, max_concurrent_updates: int = 64):
+        """
+        Args:
+            workers: Число процессов
+            queue_size: Максимум апдейтов в очереди одного процесса
+            max_concurrent_updates: Максимум одновременно работающих обработчиков в процессе
+        """
+        self.max_concurrent_updates = max_concurrent_updates
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+
+    def start(self):
+        for index in range(len(self._processes)):
+            self._spawn(index)
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=worker_main,
+            args=(index, self._queues[index], self.max_concurrent_updates),
+            name=f"bot-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info(f"Запущен обработчик {index} (pid {process.pid})")
+
+    def shard(self, update: Dict[str, Any]) -> int:
+        user_id = update_user_id(update)
+        # Апдейты без пользователя обрабатывает первый процесс
+        return hash(user_id) % len(self._queues) if user_id is not None else 0
+
+    def route(self, update: Dict[str, Any]) -> bool:
+        """
+        Кладет апдейт в очередь его процесса
+
+        Returns:
+            False если очередь процесса переполнена
+        """
+        try:
+            self._queues[self.shard(update)].put_nowait(update)
+            return True
+        except queue.Full:
+            return False
+
+    def restart_dead_workers(self):
+        """Перезапускает упавшие процессы (очередь с апдейтами сохраняется)"""
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                logger.error(f"Обработчик {index} завершился с кодом {process.exitcode}, перезапуск")
+                self._spawn(index)
+
+    def stop(self, timeout: float = 15):
+        """Дает процессам обработать очередь и завершиться"""
+        # Упавший процесс не освободит полную очередь для стоп-сигнала
+        self.restart_dead_workers()
+        for index, updates in enumerate(self._queues):
+            try:
+                updates.put(None, timeout=timeout)
+            except queue.Full:
+                # Процесс завис: не ждем, пока он разберет очередь
+                logger.warning(f"Очередь обработчика {index} не освободилась за {timeout} с, остановка")
+                if self._processes[index] is not None:
+                    self._processes[index].terminate()
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Обработчик {index} не завершился за {timeout} с, остановка")
+                process.terminate()
+
+
+def worker_main(index: int, updates: multiprocessing.Queue, max_concurrent_updates: int):
+    """Точка входа процесса-обработчика"""
+    # Ctrl+C получает вся группа процессов; обработчик останавливается по команде от front-процесса
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ['BOT_WORKER_INDEX'] = str(index)
+    # Процесс запущен через spawn: логирование настраивается заново (окружение наследуется от front-процесса)
+    configure_logging()
+    asyncio.run(_run_worker(index, updates, max_concurrent_updates))
+
+
+async def _run_worker(index: int, updates: multiprocessing.Queue, max_concurrent_updates: int):
+    # У каждого процесса свои диспетчер, сессия бота, соединения с базой и кэши
+    bot = create_bot()
+    db = create_database()
+    dp = create_dispatcher(db)
+    loop = asyncio.get_running_loop()
+    reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='updates')
+    semaphore = asyncio.Semaphore(max_concurrent_updates)
+    user_locks: Dict[Any, asyncio.Lock] = {}
+    user_waiting: Dict[Any, int] = defaultdict(int)
+    tasks = set()
+
+    async def process(update: Dict[str, Any]):
+        user_id = update_user_id(update)
+        lock = user_locks.setdefault(user_id, asyncio.Lock())
+        user_waiting[user_id] += 1
+        try:
+            # Lock отдает очередь в порядке запроса, апдейты пользователя идут по порядку
+            async with lock, semaphore:
+                result = await dp.feed_raw_update(bot, update)
+                if isinstance(result, TelegramMethod):
+                    await dp.silent_call_request(bot, result)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+        finally:
+            user_waiting[user_id] -= 1
+            if not user_waiting[user_id]:
+                del user_waiting[user_id]
+                del user_locks[user_id]
+
+    await dp.emit_startup(bot=bot)
+    logger.info(f"Обработчик {index} готов")
+    try:
+        while True:
+            update = await loop.run_in_executor(reader, updates.get)
+            if update is None:
+                break
+            task = loop.create_task(process(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.wait(set(tasks))
+    finally:
+        reader.shutdown(wait=False)
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        await db.close()
+        logger.info(f"Обработчик {index} остановлен")
+
+
+async def _supervise(router: UpdateRouter, interval: float = 5):
+    while True:
+        await asyncio.sleep(interval)
+        router.restart_dead_workers()
+
+
+async def _poll_updates(bot: Bot, router: UpdateRouter, polling_timeout: int = 30):
+    """Long polling в front-процессе: апдейты раскладываются по очередям обработчиков"""
+    offset = None
+    while True:
+        try:
+            received = await bot.get_updates(offset=offset, timeout=polling_timeout)
+        except Exception as e:
+            logger.error(f"Ошибка при получении апдейтов: {e}")
+            await asyncio.sleep(5)
+            continue
+
+        for update in received:
+            raw = update.model_dump(mode='json', exclude_none=True, by_alias=True)
+            while not router.route(raw):
+                # Очередь обработчика переполнена - ждем, не теряя порядок апдейтов
+                await asyncio.sleep(0.1)
+            offset = update.update_id + 1
+
+
+def _create_front_app(
+    bot: Bot,
+    router: UpdateRouter,
+    path: str,
+    secret_token: Optional[str] = None,
+    base_url: Optional[str] = None,
+) -> web.Application:
+    """Вебхук front-процесса: проверка секрета, разбор JSON, ответ 200 после постановки в очередь"""
+    async def handle(request: web.Request) -> web.Response:
+        if secret_token and not secrets.compare_digest(
+            request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), secret_token
+        ):
+            return web.Response(body="Unauthorized", status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            # Пустое или битое тело (json.JSONDecodeError и ошибки кодировки - подклассы ValueError)
+            return web.Response(body="Bad Request", status=400)
+        if not isinstance(update, dict):
+            return web.Response(body="Bad Request", status=400)
+        if not router.route(update):
+            return web.Response(status=503)
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+
+    if base_url:
+        async def set_webhook(_app: web.Application):
+            url = base_url.rstrip('/') + path
+            await bot.set_webhook(url, secret_token=secret_token, max_connections=100)
+            logger.info(f"Вебхук установлен: {url}")
+
+        app.on_startup.append(set_webhook)
+
+    return app
+
+
+async def run_sharded(
+    bot: Bot,
+    workers: int,
+    webhook: bool = False,
+    host: str = '127.0.0.1',
+    port: int = 8080,
+    path: str = '/webhook',
+    secret_token: Optional[str] = None,
+    base_url: Optional[str] = None,
+    max_concurrent_updates: int = 64,
+):
+    """
+    Запускает front-процесс и процессы-обработчики
+
+    Args:
+        bot: Бот (в front-процессе только получает апдейты)
+        workers: Число процессов-обработчиков
+        webhook: Получать апдейты по вебхуку вместо long polling
+        host: Адрес сервера вебхука
+        port: Порт сервера вебхука
+        path: Путь вебхука
+        secret_token: Секретный токен вебхука
+        base_url: Внешний адрес сервера; если указан, вебхук регистрируется при запуске
+        max_concurrent_updates: Максимум одновременно работающих обработчиков в процессе
+    """
+    router = UpdateRouter(workers, max_concurrent_updates=max_concurrent_updates)
+    router.start()
+    supervisor = asyncio.create_task(_supervise(router))
+    try:
+        if webhook:
+            await serve_app(_create_front_app(bot, router, path, secret_token, base_url), host, port)
+        else:
+            polling = asyncio.create_task(_poll_updates(bot, router))
+            await wait_for_stop_signal()
+            polling.cancel()
+    finally:
+        supervisor.cancel()
+        logger.info("Остановка обработчиков")
+        await asyncio.get_running_loop().run_in_executor(None, router.stop)
+        await bot.session.close()